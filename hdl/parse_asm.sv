@@ -10,6 +10,21 @@ typedef struct packed {
 } channel_update;
 `endif
 
+/* module parse_asm
+ *  turns the UART loader byte stream into AXI-Stream writes for traffic_merger.
+ *  every frame is a symbol byte followed by 16 little-endian payload bytes:
+ *   '@' : payload[26:0] is a (32-bit word) address, sent as a write command (TUSER high)
+ *   '[' : payload is a 128-bit chunk of write data
+ *   '*' : payload[31:0] is a repeat count N; the next '[' chunk is sent N times
+ *   '%' : payload[15:0] is a new UART bit period in clk_in cycles (0: the default
+ *         BAUD), pulsed out on baud_valid for uart_baud instead of going to DDR
+ *  a completed frame is latched into axis_data, so the next frame's bytes can
+ *  arrive while it (or its repeats) wait on axis_ready. a '*' count is held in
+ *  repeat_pending until the next '[' frame completes, so it can't apply to a
+ *  beat still waiting on axis_ready. a repeated chunk must drain before the
+ *  frame after it completes -- the host caps runs to fit the DEPTH of the
+ *  ddr_fifo downstream.
+ */
 module parse_asm
   (
    input wire 		clk_in,
@@ -20,12 +35,15 @@ module parse_asm
    output logic 	axis_tuser,
    output logic [127:0] axis_data,
    input wire 		axis_ready,
-   output logic 	axis_valid);
+   output logic 	axis_valid,
+
+   output logic 	baud_valid,
+   output logic [15:0] 	baud_period);
 
    typedef enum 	{ASC,CHUNK} linestate;
    linestate lstate;
    
-   typedef enum 	{ADDR,DATA} filestate;
+   typedef enum 	{ADDR,DATA,REPEAT,BAUD} filestate;
    filestate fstate;
    
    logic [3:0] 		byte_index;
@@ -54,8 +72,16 @@ module parse_asm
    assign command.stream_length = 27'b0;
    assign command.wen = 1'b1;
 
-   assign axis_tuser = (fstate == ADDR);
-   assign axis_data = axis_tuser ? command : axis_data_chunk;
+   logic 		frame_done;  // all 16 payload bytes of the last frame are in axis_bytes
+   logic [31:0] 	repeat_count;
+   logic [31:0] 	repeat_left; // beats of the current chunk still to send after this one
+   logic [31:0] 	repeat_pending; // from a '*' frame, for the next '[' chunk
+   assign repeat_count = axis_data_chunk[31:0];
+
+   logic 		tuser_hold;
+   logic [127:0] 	data_hold;
+   assign axis_tuser = tuser_hold;
+   assign axis_data = data_hold;
    
    always_ff @(posedge clk_in) begin
       if (rst_in) begin
@@ -63,29 +89,73 @@ module parse_asm
 	 fstate <= ADDR;
 	 byte_index <= 0;
 	 axis_valid <= 0;
+	 frame_done <= 0;
+	 repeat_left <= 0;
+	 repeat_pending <= 0;
+	 tuser_hold <= 0;
+	 data_hold <= 0;
+	 baud_valid <= 0;
+	 baud_period <= 0;
       end
-      else if (valid_fbyte) begin
-	 case (lstate)
-	   ASC: begin
-	      fstate <= (fbyte == 8'h40) ? ADDR : DATA;
-	      lstate <= CHUNK;
-	      byte_index <= 0;
-	   end
-	   CHUNK: begin
-	      axis_bytes[byte_index] <= fbyte;
-	      byte_index <= byte_index + 1;
-	      if (byte_index == 15) begin
-		 axis_valid <= 1;
-		 lstate <= ASC;
+      else begin
+	 frame_done <= 1'b0;
+	 baud_valid <= 1'b0;
+	 if (valid_fbyte) begin
+	    case (lstate)
+	      ASC: begin
+		 fstate <= (fbyte == 8'h40) ? ADDR :
+			   (fbyte == 8'h2A) ? REPEAT :
+			   (fbyte == 8'h25) ? BAUD : DATA;
+		 lstate <= CHUNK;
+		 byte_index <= 0;
+	      end
+	      CHUNK: begin
+		 axis_bytes[byte_index] <= fbyte;
+		 byte_index <= byte_index + 1;
+		 if (byte_index == 15) begin
+		    frame_done <= 1'b1;
+		    lstate <= ASC;
+		 end
+	      end
+	    endcase
+	 end // if (valid_fbyte)
+
+	 if (axis_valid && axis_ready) begin
+	    if (repeat_left != 0) begin
+	       repeat_left <= repeat_left - 1;
+	    end else begin
+	       axis_valid <= 1'b0;
+	    end
+	 end
+
+	 if (frame_done) begin
+	    case (fstate)
+	      ADDR: begin
+		 tuser_hold <= 1'b1;
+		 data_hold <= command;
+		 axis_valid <= 1'b1;
+		 repeat_left <= 0;
+		 repeat_pending <= 0;
+	      end
+	      DATA: begin
+		 tuser_hold <= 1'b0;
+		 data_hold <= axis_data_chunk;
+		 axis_valid <= 1'b1;
+		 repeat_left <= repeat_pending;
+		 repeat_pending <= 0;
+	      end
+	      REPEAT: begin
+		 repeat_pending <= (repeat_count == 0) ? 0 : repeat_count - 1;
+	      end
+	      BAUD: begin
+		 baud_valid <= 1'b1;
+		 baud_period <= axis_data_chunk[15:0];
 	      end
-	   end
-	 endcase
-      end // if (valid_fbyte)
-      if (axis_valid) begin
-	 axis_valid <= ~axis_ready;
+	    endcase
+	 end
       end
       if (axis_tuser && axis_valid) begin
-	 $display("addr: %x",command.addr);
+	 $display("addr: %x",data_hold[54:28]);
       end
    end
 	 
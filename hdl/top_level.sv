@@ -463,6 +463,11 @@ module top_level
 
    logic 	       uart_valid;
    logic [7:0] 	       data_uart;
+
+   // bit period shared by the receiver and transmitter, switched by '%' loader frames
+   logic [15:0]        uart_period;
+   logic 	       baud_switch_valid;
+   logic [15:0]        baud_switch_period;
    
    always_ff @(posedge sys_clk) begin
       uart_rxd_buf0 <= uart_rxd;
@@ -476,6 +481,7 @@ module top_level
    urm
      (.clk_in(sys_clk),
       .rst_in(sys_rst),
+      .period_in(uart_period),
       .uart_rx(uart_rxd_buf1),
       .valid_out(uart_valid),
       .data_out(data_uart));
@@ -498,7 +504,9 @@ module top_level
       .axis_tuser(assembly_axis_tuser),
       .axis_data(assembly_axis_data),
       .axis_ready(assembly_axis_ready),
-      .axis_valid(assembly_axis_valid));
+      .axis_valid(assembly_axis_valid),
+      .baud_valid(baud_switch_valid),
+      .baud_period(baud_switch_period));
 
    logic [127:0]       ui_assembly_axis_data;
    logic 	       ui_assembly_axis_ready;
@@ -538,15 +546,35 @@ module top_level
    logic [7:0] 	       uart_tx_data;
    logic 	       uart_tx_ready;
    logic 	       uart_tx_valid;
+
+   logic [7:0] 	       utm_data;
+   logic 	       utm_ready;
+   logic 	       utm_valid;
+
+   uart_baud
+     #(.BAUD_RATE(BAUD),
+       .CLOCK_SPEED(100_000_000)) ubaud
+       (.clk_in(sys_clk),
+	.rst_in(sys_rst),
+	.switch_valid(baud_switch_valid),
+	.switch_period(baud_switch_period),
+	.period_out(uart_period),
+	.proc_tx_data(uart_tx_data),
+	.proc_tx_valid(uart_tx_valid),
+	.proc_tx_ready(uart_tx_ready),
+	.tx_data(utm_data),
+	.tx_valid(utm_valid),
+	.tx_ready(utm_ready));
    
    uart_transmitter
      #(.BAUD_RATE(BAUD),
        .CLOCK_SPEED(100_000_000)) utm
        (.clk_in(sys_clk),
 	.rst_in(sys_rst),
-	.data_in(uart_tx_data),
-	.valid_in(uart_tx_valid),
-	.ready_in(uart_tx_ready),
+	.period_in(uart_period),
+	.data_in(utm_data),
+	.valid_in(utm_valid),
+	.ready_in(utm_ready),
 	.uart_tx(uart_txd));
    
    logic 	       proc_reset;
@@ -0,0 +1,103 @@
+`timescale 1ns / 1ps
+`default_nettype none
+
+/* module uart_baud
+ *  runtime UART bit period, negotiated with the host through '%' loader frames.
+ *   - every accepted switch request is acknowledged with one ACK byte, sent at
+ *     the *current* rate; the new period applies once that byte is out
+ *   - a switch away from the default leaves the period PENDING: unless the host
+ *     repeats the same '%' frame at the new rate within CONFIRM_CYCLES, the
+ *     period falls back to the default (so a host that never heard the ACK can
+ *     keep talking at BAUD_RATE)
+ *   - a '%' frame with period 0 returns to the default; periods below
+ *     MIN_PERIOD are ignored (no ACK, the host falls back)
+ *  the ACK byte is muxed onto the transmitter ahead of processor output.
+ */
+module uart_baud
+  #(parameter BAUD_RATE = 57600,
+    parameter CLOCK_SPEED = 100_000_000,
+    parameter CONFIRM_CYCLES = 50_000_000,
+    parameter MIN_PERIOD = 16)
+   (input wire 	       clk_in,
+    input wire 	       rst_in,
+
+    // switch requests from parse_asm
+    input wire 	       switch_valid,
+    input wire [15:0]  switch_period,
+
+    // bit period for uart_rcv / uart_transmitter
+    output logic [15:0] period_out,
+
+    // processor output, passed through while no ACK is pending
+    input wire [7:0]   proc_tx_data,
+    input wire 	       proc_tx_valid,
+    output logic       proc_tx_ready,
+
+    // to uart_transmitter
+    output logic [7:0] tx_data,
+    output logic       tx_valid,
+    input wire 	       tx_ready);
+
+   localparam DEFAULT_PERIOD = CLOCK_SPEED / BAUD_RATE;
+   localparam ACK = 8'h25; // '%'
+
+   typedef enum        {STEADY,ACK_SEND,ACK_DRAIN,PENDING} baud_state;
+   baud_state state;
+
+   logic [15:0]        target;
+   logic [15:0]        next_period;
+   logic [$clog2(CONFIRM_CYCLES+1)-1:0] watchdog;
+
+   assign target = (switch_period == 0) ? DEFAULT_PERIOD : switch_period;
+
+   assign tx_data = (state == ACK_SEND) ? ACK : proc_tx_data;
+   assign tx_valid = (state == ACK_SEND) ? 1'b1 :
+		     (state == ACK_DRAIN) ? 1'b0 : proc_tx_valid;
+   assign proc_tx_ready = (state == ACK_SEND || state == ACK_DRAIN) ? 1'b0 : tx_ready;
+
+   always_ff @(posedge clk_in) begin
+      if (rst_in) begin
+	 state <= STEADY;
+	 period_out <= DEFAULT_PERIOD;
+	 next_period <= DEFAULT_PERIOD;
+	 watchdog <= 0;
+      end else begin
+	 case (state)
+	   STEADY, PENDING: begin
+	      if (switch_valid && target >= MIN_PERIOD) begin
+		 // the current period again is a probe, or (while PENDING) the confirmation
+		 next_period <= target;
+		 state <= ACK_SEND;
+	      end else if (state == PENDING) begin
+		 if (watchdog == 0) begin
+		    period_out <= DEFAULT_PERIOD;
+		    state <= STEADY;
+		 end else begin
+		    watchdog <= watchdog - 1;
+		 end
+	      end
+	   end
+	   ACK_SEND: begin
+	      if (tx_ready) begin
+		 state <= ACK_DRAIN;
+	      end
+	   end
+	   ACK_DRAIN: begin
+	      // transmitter is back to idle once the ACK's stop bit is out
+	      if (tx_ready) begin
+		 if (next_period == period_out) begin
+		    state <= STEADY;
+		 end else begin
+		    period_out <= next_period;
+		    watchdog <= CONFIRM_CYCLES;
+		    state <= (next_period == DEFAULT_PERIOD) ? STEADY : PENDING;
+		 end
+	      end
+	   end
+	 endcase
+      end
+   end
+
+endmodule
+
+`default_nettype wire
@@ -7,6 +7,7 @@ module uart_rcv
     )
    (input wire clk_in,
     input wire 	       rst_in,
+    input wire [15:0]  period_in, // bit period in clk_in cycles, 0 selects CLOCK_SPEED/BAUD_RATE
     input wire 	       uart_rx,
     output logic       valid_out,
     output logic [7:0] data_out,
@@ -14,8 +15,14 @@ module uart_rcv
     output logic [2:0] ustate
     );
 
-   localparam PERIOD_CYCLES = CLOCK_SPEED / BAUD_RATE;
-   localparam READ_POINT = PERIOD_CYCLES / 2;
+   localparam DEFAULT_PERIOD = CLOCK_SPEED / BAUD_RATE;
+
+   // the period is latched at each start bit, so it can change between bytes
+   logic [15:0] 	 next_period;
+   logic [15:0] 	 bit_period;
+   logic [15:0] 	 read_point;
+   assign next_period = (period_in == 0) ? DEFAULT_PERIOD : period_in;
+   assign read_point = bit_period >> 1;
 
    typedef enum  {IDLE,START,READ,STOP,TRANSMIT} uart_state;
    uart_state state;
@@ -25,7 +32,7 @@ module uart_rcv
 
    assign valid_out = (state == TRANSMIT);
 
-   logic [$clog2(PERIOD_CYCLES):0] cycle_count;
+   logic [15:0] 		   cycle_count;
 
    // frame including start and stop bits
    logic [9:0] 			   uart_frame;
@@ -35,6 +42,7 @@ module uart_rcv
 	 state <= IDLE;
 	 cycle_count <= 0;
 	 index <= 0;
+	 bit_period <= DEFAULT_PERIOD;
       end else begin
 
 	 case(state)
@@ -42,18 +50,19 @@ module uart_rcv
 	      if (~uart_rx) begin
 		 state <= START;
 		 index <= 0;
-		 cycle_count <= PERIOD_CYCLES-1;
+		 bit_period <= next_period;
+		 cycle_count <= next_period - 1;
 		 uart_frame <= 10'b0;
 	      end
 	   end
 	   START: begin
 	      if (cycle_count == 0) begin
-		 cycle_count <= PERIOD_CYCLES-1;
+		 cycle_count <= bit_period-1;
 		 index <= index + 1;
 		 state <= READ;
 	      end else begin
 		 cycle_count <= cycle_count - 1;
-		 if (cycle_count == READ_POINT) begin
+		 if (cycle_count == read_point) begin
 		    // ensure start bit is still a zero, send back to idle otherwise
 		    state <= (uart_rx == 1'b0) ? START : IDLE;
 		    uart_frame[index] <= uart_rx;
@@ -64,7 +73,7 @@ module uart_rcv
 
 	      if (cycle_count == 0) begin
 		 // baud cycle completed--read value
-		 cycle_count <= PERIOD_CYCLES-1;
+		 cycle_count <= bit_period-1;
 		 index <= index + 1;
 		 if (index == 8) begin
 		    state <= STOP;
@@ -73,7 +82,7 @@ module uart_rcv
 		 // count down cycles
 		 cycle_count <= cycle_count - 1;
 
-		 if (cycle_count == READ_POINT) begin
+		 if (cycle_count == read_point) begin
 		    // write data as currently seen, at center of period
 		    uart_frame[index] <= uart_rx;
 		 end
@@ -92,7 +101,7 @@ module uart_rcv
 		    state <= IDLE;
 		 end
 	      end else begin
-		 if (cycle_count == READ_POINT) begin
+		 if (cycle_count == read_point) begin
 		    uart_frame[index] <= uart_rx;
 		 end
 		 cycle_count <= cycle_count - 1;
@@ -6,12 +6,18 @@ module uart_transmitter
     parameter CLOCK_SPEED = 100_000_000)
    (input wire clk_in,
     input wire 	     rst_in,
+    input wire [15:0] period_in, // bit period in clk_in cycles, 0 selects CLOCK_SPEED/BAUD_RATE
     input wire [7:0] data_in,
     input wire 	     valid_in,
     output logic     ready_in,
     output logic     uart_tx);
 
-   localparam PERIOD_CYCLES = CLOCK_SPEED / BAUD_RATE;
+   localparam DEFAULT_PERIOD = CLOCK_SPEED / BAUD_RATE;
+
+   // the period is latched with each byte, so it can change between bytes
+   logic [15:0] 	     next_period;
+   logic [15:0] 	     bit_period;
+   assign next_period = (period_in == 0) ? DEFAULT_PERIOD : period_in;
    
    typedef enum      {IDLE, TRANSMIT} uart_tx_state;
    uart_tx_state state;
@@ -23,7 +29,7 @@ module uart_transmitter
    assign frame[9] = 1'b1; // STOP big
 
    logic [3:0] 	     index;
-   logic [$clog2(PERIOD_CYCLES):0] cycle_count;
+   logic [15:0] 	     cycle_count;
 
    assign uart_tx = (state == TRANSMIT) ? frame[index] : 1'b1; // idle high
    assign ready_in = (state == IDLE);
@@ -34,6 +40,7 @@ module uart_transmitter
 	 state <= IDLE;
 	 index <= 0;
 	 cycle_count <= 0;
+	 bit_period <= DEFAULT_PERIOD;
       end else begin
 	 case(state)
 	   IDLE: begin
@@ -41,7 +48,8 @@ module uart_transmitter
 		 current_data <= data_in;
 		 state <= TRANSMIT;
 		 index <= 0;
-		 cycle_count <= PERIOD_CYCLES-1;
+		 bit_period <= next_period;
+		 cycle_count <= next_period - 1;
 	      end
 	   end
 	   TRANSMIT: begin
@@ -49,7 +57,7 @@ module uart_transmitter
 		 if (index == 9) begin
 		    state <= IDLE;
 		 end else begin
-		    cycle_count <= PERIOD_CYCLES-1;
+		    cycle_count <= bit_period-1;
 		    index <= index + 1;
 		 end
 	      end else begin
@@ -0,0 +1,307 @@
+""" axis: shared testbench helpers -- clock/reset, AXI-Stream drivers and monitors, throughput counters
+
+Everything here wakes only on RisingEdge(clk). Values read right after the edge
+are the ones the flops sampled at that edge, so valid & ready seen there is
+exactly the handshake that happened; values written then apply to the next
+edge. A source can therefore present its next beat in the same step it sees
+the last one accepted: back-to-back beats, no FallingEdge bubble.
+
+Every driver/monitor keeps a StreamStats (beats, stall cycles, utilization);
+LatencyLink builds a cycle histogram between two monitored streams.
+"""
+
+import cocotb
+from cocotb.clock import Clock
+from cocotb.triggers import RisingEdge, ClockCycles, Event
+from cocotb.utils import get_sim_time
+from collections import deque, Counter
+import math
+
+CLOCK_PERIOD_NS = 10
+
+
+def start_clock(clk, period_ns=CLOCK_PERIOD_NS):
+    """ free-running clock on `clk`, starting low; returns its task """
+    return cocotb.start_soon(Clock(clk, period_ns, units="ns").start(start_high=False))
+
+async def reset(clk, rst, cycles=2):
+    """ hold `rst` high for `cycles` rising edges """
+    rst.value = 1
+    await ClockCycles(clk, cycles)
+    rst.value = 0
+    await RisingEdge(clk)
+
+def handshake(valid, ready):
+    return (valid.value == 1 and ready.value == 1)
+
+def read_int(signal):
+    return None if signal is None else int(signal.value)
+
+
+class StreamStats:
+    """ handshake counters for one stream, sampled once per cycle """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.cycles = 0
+        self.beats = 0
+        self.stall_cycles = 0 # valid without ready
+        self.idle_cycles = 0  # no valid
+        self.stall_run = 0
+        self.max_stall_run = 0 # longest wait of one beat for ready
+        self.first_beat = None
+        self.last_beat = None
+
+    def sample(self, valid, ready):
+        self.cycles += 1
+        if valid and ready:
+            self.beats += 1
+            if self.first_beat is None:
+                self.first_beat = self.cycles
+            self.last_beat = self.cycles
+            self.stall_run = 0
+        elif valid:
+            self.stall_cycles += 1
+            self.stall_run += 1
+            self.max_stall_run = max(self.max_stall_run, self.stall_run)
+        else:
+            self.idle_cycles += 1
+            self.stall_run = 0
+
+    def utilization(self):
+        """ beats per cycle over the whole run """
+        return self.beats / self.cycles if self.cycles else 0.0
+
+    def throughput(self):
+        """ beats per cycle between the first and last beat """
+        if self.first_beat is None:
+            return 0.0
+        return self.beats / (self.last_beat - self.first_beat + 1)
+
+    def as_dict(self):
+        return {"name": self.name, "cycles": self.cycles, "beats": self.beats,
+                "stall_cycles": self.stall_cycles, "idle_cycles": self.idle_cycles,
+                "max_stall_run": self.max_stall_run,
+                "utilization": self.utilization(), "throughput": self.throughput()}
+
+    def report(self):
+        print("[{}] {} beats in {} cycles: {:.1%} utilization, {:.3f} beats/cycle while active, {} stall cycles".format(
+            self.name, self.beats, self.cycles, self.utilization(), self.throughput(), self.stall_cycles))
+
+
+class Histogram:
+    """ counts of integer samples (latencies in cycles) """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.total = 0
+
+    def add(self, value):
+        self.counts[value] += 1
+        self.total += 1
+
+    def percentile(self, p):
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(p * self.total)) # nearest rank
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= rank:
+                return value
+
+    def mean(self):
+        if not self.total:
+            return None
+        return sum(v * n for (v, n) in self.counts.items()) / self.total
+
+    def as_dict(self, bins=True):
+        summary = {"count": self.total, "mean": self.mean(),
+                "min": min(self.counts) if self.total else None,
+                "p50": self.percentile(0.5), "p99": self.percentile(0.99),
+                "max": max(self.counts) if self.total else None}
+        if bins:
+            summary["bins"] = {str(v): n for (v, n) in sorted(self.counts.items())}
+        return summary
+
+    def report(self, label):
+        if not self.total:
+            print("[{}] no samples".format(label))
+            return
+        print("[{}] {} samples, latency min {} / p50 {} / mean {:.1f} / p99 {} / max {} cycles".format(
+            label, self.total, min(self.counts), self.percentile(0.5), self.mean(),
+            self.percentile(0.99), max(self.counts)))
+
+
+class AxisMonitor:
+    """ passive: counts every cycle of one stream, reports handshakes to callbacks (and a list, if record) """
+
+    def __init__(self, clk, valid, ready, data=None, tuser=None, name="", record=False):
+        self.clk = clk
+        self.valid = valid
+        self.ready = ready
+        self.data = data
+        self.tuser = tuser
+        self.stats = StreamStats(name)
+        self.beats = [] if record else None
+        self.callbacks = []
+        self.task = cocotb.start_soon(self.run())
+
+    def on_beat(self, callback):
+        """ callback(time_ns, data, tuser) for every accepted beat """
+        self.callbacks.append(callback)
+
+    async def run(self):
+        while True:
+            await RisingEdge(self.clk)
+            valid = self.valid.value == 1
+            ready = self.ready.value == 1
+            self.stats.sample(valid, ready)
+            if valid and ready:
+                (data, tuser) = (read_int(self.data), read_int(self.tuser))
+                if self.beats is not None:
+                    self.beats.append((tuser, data))
+                now = get_sim_time("ns")
+                for callback in self.callbacks:
+                    callback(now, data, tuser)
+
+    def stop(self):
+        self.task.kill()
+
+
+class AxisSource:
+    """ drives queued beats onto valid/data(/tuser); the next beat goes out the cycle after a handshake """
+
+    def __init__(self, clk, valid, ready, data, tuser=None, name=""):
+        self.clk = clk
+        self.valid = valid
+        self.ready = ready
+        self.data = data
+        self.tuser = tuser
+        self.stats = StreamStats(name)
+        self.queue = deque()
+        self.current = None # (data, tuser) on the bus
+        self.callbacks = []
+        self.drained = Event()
+        self.drained.set()
+        self.valid.value = 0
+        self.task = cocotb.start_soon(self.run())
+
+    def append(self, data, tuser=0):
+        self.queue.append((data, tuser))
+        self.drained.clear()
+
+    def on_beat(self, callback):
+        """ callback(time_ns, data, tuser) for every accepted beat """
+        self.callbacks.append(callback)
+
+    async def send(self, data, tuser=0):
+        """ queue one beat and return once it has been accepted """
+        self.append(data, tuser)
+        await self.wait()
+
+    async def wait(self):
+        """ return once every queued beat has been accepted """
+        if self.queue or self.current is not None:
+            await self.drained.wait()
+
+    async def run(self):
+        while True:
+            await RisingEdge(self.clk)
+            ready = self.ready.value == 1
+            self.stats.sample(self.current is not None, ready)
+            if self.current is not None and ready:
+                now = get_sim_time("ns")
+                for callback in self.callbacks:
+                    callback(now, *self.current)
+                self.current = None
+            if self.current is None:
+                if self.queue:
+                    self.current = self.queue.popleft()
+                    (data, tuser) = self.current
+                    self.data.value = data
+                    if self.tuser is not None:
+                        self.tuser.value = tuser
+                    self.valid.value = 1
+                else:
+                    self.valid.value = 0
+                    self.drained.set()
+
+    def stop(self):
+        self.task.kill()
+        self.valid.value = 0
+
+
+class AxisSink:
+    """ drives ready from pattern(cycle) (always ready by default) and collects accepted beats """
+
+    def __init__(self, clk, valid, ready, data, tuser=None, name="", pattern=None):
+        self.clk = clk
+        self.valid = valid
+        self.ready = ready
+        self.data = data
+        self.tuser = tuser
+        self.pattern = pattern if pattern is not None else (lambda cycle: 1)
+        self.stats = StreamStats(name)
+        self.beats = deque()
+        self.arrived = Event()
+        self.ready.value = self.pattern(0)
+        self.task = cocotb.start_soon(self.run())
+
+    async def recv(self):
+        """ next accepted (tuser, data) beat """
+        while not self.beats:
+            self.arrived.clear()
+            await self.arrived.wait()
+        return self.beats.popleft()
+
+    async def run(self):
+        cycle = 0
+        while True:
+            await RisingEdge(self.clk)
+            valid = self.valid.value == 1
+            ready = self.ready.value == 1
+            self.stats.sample(valid, ready)
+            if valid and ready:
+                self.beats.append((read_int(self.tuser), read_int(self.data)))
+                self.arrived.set()
+            cycle += 1
+            self.ready.value = self.pattern(cycle)
+
+    def stop(self):
+        self.task.kill()
+
+
+class LatencyLink:
+    """ cycle latency histogram between two streams (monitors or sources)
+
+    A transaction starts at an upstream beat that passes `starts(data, tuser)` and
+    ends at the `downstream_beats`-th following downstream beat, in order.
+    """
+
+    def __init__(self, upstream, downstream, downstream_beats=1, starts=None,
+                 period_ns=CLOCK_PERIOD_NS, name=""):
+        self.name = name
+        self.period_ns = period_ns
+        self.starts = starts
+        self.downstream_beats = downstream_beats
+        self.pending = deque() # start times of open transactions
+        self.seen = 0          # downstream beats of the oldest open transaction
+        self.histogram = Histogram()
+        upstream.on_beat(self.upstream_beat)
+        downstream.on_beat(self.downstream_beat)
+
+    def upstream_beat(self, now, data, tuser):
+        if self.starts is None or self.starts(data, tuser):
+            self.pending.append(now)
+
+    def downstream_beat(self, now, data, tuser):
+        if not self.pending:
+            return
+        self.seen += 1
+        if self.seen == self.downstream_beats:
+            self.seen = 0
+            self.histogram.add(round((now - self.pending.popleft()) / self.period_ns))
+
+    def report(self):
+        self.histogram.report(self.name)
@@ -1,91 +1,71 @@
 import cocotb
 from cocotb.triggers import RisingEdge, Timer, FallingEdge
 from cocotb.utils import get_sim_time
+from collections import deque
+import os
 import random
 
+from axis import start_clock, reset, handshake, AxisSource, AxisSink, AxisMonitor, Histogram
+from mig import MigModel, DDR3Timing, CLOCK_PERIOD_NS
+from memstore import PagedMemory
+from memimage import CAMERA_FB_ADDR, FRAME_WIDTH, FRAME_HEIGHT
+from structs import channel_updates, first_mismatch
+from migtrace import read_trace, summary, TraceReplay
+
+# MIG_TRACE_REPLAY=<file> enables test_replay_trace (MIG_TRACE_ASAP=1: ignore the recorded timing)
+MIG_TRACE_REPLAY = os.environ.get("MIG_TRACE_REPLAY")
+
 CMD_READ = 1
 CMD_WRITE = 0
 CHANNEL_COUNT = 3
 
-async def generate_clock(dut):
-    """ generate clock pulses """
-    while True:
-        dut.clk_in.value = 0
-        await Timer(5,units="ns")
-        dut.clk_in.value = 1
-        await Timer(5,units="ns")
-
-async def reset(dut):
-    dut.rst_in.value = 1
-    await Timer(10,units="ns")
-    dut.rst_in.value = 0
-    await Timer(10,units="ns")
+def print_mig_commands_issued(dut):
+    """ a passive monitor on each write channel, printing what the merger accepts """
+    monitors = []
+    for i in range(CHANNEL_COUNT):
+        monitor = AxisMonitor(dut.clk_in, dut.write_axis_valid[i], dut.write_axis_ready[i],
+                              dut.write_axis_data[i], dut.write_axis_tuser[i], name="write channel %d" % i)
+        monitor.on_beat(lambda now,data,tuser,i=i:
+                        print("merger received command on channel %d: tuser = %d, data = %x" % (i, tuser, data)))
+        monitors.append(monitor)
+    return monitors
 
+def channel_sources(dut):
+    return [AxisSource(dut.clk_in, dut.write_axis_valid[i], dut.write_axis_ready[i],
+                       dut.write_axis_data[i], dut.write_axis_tuser[i], name="write channel %d" % i)
+            for i in range(CHANNEL_COUNT)]
 
-async def print_mig_commands_issued(dut):
+async def answer_mig_commands(dut, commands, write_data, rng):
+    """ print each command the sinks accepted; a read is answered with 3290 one beat per
+    read, each after a random delay """
+    dut.app_rd_data_valid.value = 0
+    dut.app_rd_data_end.value = 0
+    dut.app_rd_data.value = 0
     while True:
+        (cmd, addr) = await commands.recv()
+        if cmd == CMD_WRITE:
+            (_, data) = await write_data.recv()
+            print("MIG received WRITE command (@%dns): addr = %x, data = %x" % (get_sim_time('ns'), addr>>7, data))
+            continue
+        print("MIG received READ command (@%dns): addr = %x" % (get_sim_time('ns'), addr))
+        while rng.random() <= 0.4:
+            await RisingEdge(dut.clk_in)
+        dut.app_rd_data_valid.value = 1
+        dut.app_rd_data_end.value = 1
+        dut.app_rd_data.value = 3290
         await RisingEdge(dut.clk_in)
-        for i in range(CHANNEL_COUNT):
-            if (dut.write_axis_valid[i].value == 1 and dut.write_axis_ready[i].value == 1):
-                print("merger received command on channel %d: tuser = %d, data = %x" % (i, dut.write_axis_tuser[i].value, dut.write_axis_data[i].value))
-
-def cmd_assent(dut):
-    return (dut.app_en.value == 1 and dut.app_rdy.value == 1) # and
-            # ( dut.app_cmd.value == CMD_READ or (dut.app_cmd.value == CMD_WRITE and dut.app_wdf_wren.value == 1 and dut.app_wdf_rdy.value == 1) ) )
+        dut.app_rd_data_valid.value = 0
+        dut.app_rd_data_end.value = 0
+        dut.app_rd_data.value = 0
 
-async def simulate_mig_ready(dut):
-    while True:
-        await RisingEdge(dut.clk_in)
-        if (random.random() > 0): # 0.3
-            dut.app_rdy.value = 1
-            if (random.random() > 0): # 0.2
-                dut.app_wdf_rdy.value = 1
-            else:
-                dut.app_wdf_rdy.value = 0
-        else:
-            dut.app_rdy.value = 0
-            dut.app_wdf_rdy.value = 0
+def stub_mig(dut, rng=random):
+    """ the MIG side for the directed tests: always ready, commands and write data taken by
+    AxisSinks; returns them """
+    commands = AxisSink(dut.clk_in, dut.app_en, dut.app_rdy, dut.app_addr, dut.app_cmd, name="mig commands")
+    write_data = AxisSink(dut.clk_in, dut.app_wdf_wren, dut.app_wdf_rdy, dut.app_wdf_data, name="mig write data")
+    cocotb.start_soon(answer_mig_commands(dut, commands, write_data, rng))
+    return (commands, write_data)
 
-async def simulate_mig_readresponses(dut):
-    total_reads = 0
-    while True:
-        await RisingEdge(dut.clk_in)
-        if (cmd_assent(dut) and dut.app_cmd.value == CMD_READ):
-            total_reads += 1
-        if (random.random() > 0.4 and total_reads > 0):
-            total_reads -= 1
-            dut.app_rd_data_valid.value = 1
-            dut.app_rd_data_end.value = 1
-            dut.app_rd_data.value = 3290
-        else:
-            dut.app_rd_data_valid.value = 0
-            dut.app_rd_data_end.value = 0
-            dut.app_rd_data.value = 0
-            
-async def print_mig_commands_received(dut):
-    while True: 
-        await RisingEdge(dut.clk_in)
-        if (cmd_assent(dut)):
-            if (dut.app_cmd.value == CMD_READ):
-                print("MIG received READ command (@%dns): addr = %x" % (get_sim_time('ns'),dut.app_addr.value))
-            elif (dut.app_cmd.value == CMD_WRITE):
-                print("MIG received WRITE command (@%dns): addr = %x, data = %x" % (get_sim_time('ns'), dut.app_addr.value>>7, dut.app_wdf_data.value))
-
-async def submit_data(dut,channel,data,tuser=0):
-    # await FallingEdge(dut.clk_in)
-    dut.write_axis_valid[channel].value = 1
-    dut.write_axis_tuser[channel].value = tuser
-    dut.write_axis_data[channel].value = data
-    # print("submitting data %x @%dns" % (data, get_sim_time('ns')))
-    await RisingEdge(dut.clk_in)
-    while(dut.write_axis_ready[channel].value == 0):
-        await Timer(10,units="ns")
-    await FallingEdge(dut.clk_in)
-    # print('done sime time %dns' % get_sim_time('ns'))
-    dut.write_axis_valid[channel].value = 0
-    dut.write_axis_tuser[channel].value = 0
-    dut.write_axis_data[channel].value = 0
-    # await RisingEdge(dut.clk_in)
 
 @cocotb.test()
 async def test_a(dut):
@@ -96,13 +76,11 @@ async def test_a(dut):
     dut.app_zq_ack.value = 1
     dut.init_calib_complete.value = 0
 
-    await cocotb.start( generate_clock(dut) )
-    await reset(dut)
+    start_clock(dut.clk_in)
+    await reset(dut.clk_in, dut.rst_in)
 
-    await cocotb.start(print_mig_commands_issued(dut))
-    await cocotb.start(simulate_mig_ready(dut))
-    await cocotb.start(simulate_mig_readresponses(dut))
-    await cocotb.start(print_mig_commands_received(dut))
+    monitors = print_mig_commands_issued(dut)
+    (mig_commands, _) = stub_mig(dut)
 
     for i in range(CHANNEL_COUNT):
         dut.write_axis_data[i].value = 0
@@ -111,17 +89,21 @@ async def test_a(dut):
         dut.write_axis_smallpile[i].value = 0
         dut.read_axis_ready[i].value = 1
         dut.read_axis_af[i].value = 0
+    sources = channel_sources(dut)
     await Timer(20,units="ns")
     dut.init_calib_complete.value = 1
     await RisingEdge(dut.clk_in)
-    command_val = (0x443 << 28) + (0x10 << 1) + 1
-    await submit_data(dut,1,command_val,tuser=1)
-    await submit_data(dut,1,0x1234)
-    await submit_data(dut,1,0x3922)
+    (write_val, read_val) = channel_updates([0x443, 0x111], 0x10, [1, 0])
+    sources[1].append(write_val,tuser=1)
+    sources[1].append(0x1234)
+    sources[1].append(0x3922)
+    await sources[1].wait()
     # read command restricted by target addr
-    command_val = (0x111 << 28) + (0x10 << 1) + 0
-    await submit_data(dut,0,command_val,tuser=1)
+    await sources[0].send(read_val,tuser=1)
     await Timer(400,units="ns")
+    for monitor in monitors:
+        monitor.stats.report()
+    mig_commands.stats.report()
 
 
 @cocotb.test()
@@ -140,27 +122,270 @@ async def test_looping_read(dut):
         dut.read_axis_ready[i].value = 1
         dut.read_axis_af[i].value = 0
 
-    await cocotb.start( generate_clock(dut) )
-    await reset(dut)
+    start_clock(dut.clk_in)
+    await reset(dut.clk_in, dut.rst_in)
 
-    await cocotb.start(print_mig_commands_issued(dut))
-    await cocotb.start(simulate_mig_ready(dut))
-    await cocotb.start(simulate_mig_readresponses(dut))
-    await cocotb.start(print_mig_commands_received(dut))
+    monitors = print_mig_commands_issued(dut)
+    stub_mig(dut)
 
     await Timer(20,units="ns")
     dut.init_calib_complete.value = 1
 
     await RisingEdge(dut.clk_in)
-    command_val = (0x111 << 28) + (0x12 << 1) + 0
+    command_val = channel_updates(0x111, 0x12, 0)[0]
     dut.write_axis_data[i].value = command_val
     dut.write_axis_tuser[i].value = 1
     dut.write_axis_valid[i].value = 1
 
     await Timer(1000,units="ns")
+    monitors[i].stats.report()
 
     
+# ---- camera / HDMI contention scenario ----
+# rates are real-hardware figures converted to ui_clk cycles; the sim clock period doesn't matter
+
+UI_CLK_HZ = 81.25e6        # MIG ui_clk: 325MHz DDR3, 4:1
+PHRASE_PIXELS = 8          # 16-bit pixels per 128-bit phrase
+FRAME_PHRASES = (FRAME_WIDTH*FRAME_HEIGHT) // PHRASE_PIXELS
+(FRAME_WRITE, FRAME_READ) = channel_updates(CAMERA_FB_ADDR, FRAME_PHRASES, [1, 0])
+
+# camera: pixels arrive at CAMERA_PIXEL_HZ during the active part of each line
+CAMERA_FPS = 30
+CAMERA_V_TOTAL = 750
+CAMERA_PIXEL_HZ = 36e6     # two bytes per pixel from a 72MHz PCLK
+
+# HDMI 720p60 (video_sig_gen)
+HDMI_PIXEL_HZ = 74.25e6
+HDMI_H_TOTAL = 1650
+HDMI_V_TOTAL = 750
+
+# channels of the merger under test
+PROC_CHANNEL = 0
+CAMERA_CHANNEL = 1
+HDMI_CHANNEL = 2
+
+class DdrFifoModel:
+    """ occupancy of a ddr_fifo (xpm_fifo_axis), DEPTH entries, prog_full at DEPTH-PROGFULL_DEPTH;
+    the clock crossing itself (a few cycles of latency) isn't modeled """
+
+    def __init__(self, name, depth=512, progfull_depth=12):
+        self.name = name
+        self.depth = depth
+        self.progfull_depth = progfull_depth
+        self.entries = deque()
+        self.high_water = 0
+        self.low_water = None  # lowest occupancy seen while the reader was draining
+        self.drops = 0         # pushes refused because the FIFO was full
+
+    def full(self):
+        return len(self.entries) >= self.depth
+
+    def prog_full(self):
+        return len(self.entries) >= self.depth - self.progfull_depth
+
+    def push(self, item):
+        if self.full():
+            self.drops += 1
+            return False
+        self.entries.append(item)
+        self.high_water = max(self.high_water, len(self.entries))
+        return True
+
+    def pop(self):
+        item = self.entries.popleft()
+        occupancy = len(self.entries)
+        self.low_water = occupancy if self.low_water is None else min(self.low_water, occupancy)
+        return item
+
+    def report(self):
+        print("[{}] DEPTH {} PROGFULL_DEPTH {}: high water {}, low water {}, {} dropped".format(
+            self.name, self.depth, self.progfull_depth, self.high_water, self.low_water, self.drops))
+
+class CameraWriter:
+    """ camera_coord/build_wr_data into the camera_write ddr_fifo: a frame command, then a phrase
+    every 8 pixels; a full FIFO drops the phrase (top_level ignores its ready) """
+
+    def __init__(self, fifo, fps=CAMERA_FPS):
+        self.fifo = fifo
+        self.line_cycles = UI_CLK_HZ / (fps * CAMERA_V_TOTAL)
+        self.pixels_per_cycle = CAMERA_PIXEL_HZ / UI_CLK_HZ
+        assert FRAME_WIDTH / self.pixels_per_cycle <= self.line_cycles, "camera line doesn't fit its line period"
+        self.line = 0
+        self.position = 0.0 # ui cycles into the line
+        self.pixels = 0
+        self.phrases = 0
+        self.fifo.push((1, FRAME_WRITE))
+
+    def step(self):
+        self.position += 1
+        if self.line < FRAME_HEIGHT:
+            due = min(FRAME_WIDTH, int(self.position * self.pixels_per_cycle))
+            while self.pixels < due:
+                self.pixels += 1
+                if self.pixels % PHRASE_PIXELS == 0:
+                    self.phrases += 1
+                    self.fifo.push((0, self.phrases))
+        if self.position >= self.line_cycles:
+            self.position -= self.line_cycles
+            self.pixels = 0
+            self.line += 1
+            if self.line == CAMERA_V_TOTAL:
+                self.line = 0
+                self.fifo.push((1, FRAME_WRITE))
+
+class HdmiReader:
+    """ video_sig_gen/digest_phrase draining the hdmi_read ddr_fifo: every 8th active pixel needs
+    a phrase, and an empty FIFO at that moment is a missed deadline """
+
+    def __init__(self, fifo, start_line=HDMI_V_TOTAL-1):
+        self.fifo = fifo
+        self.pixels_per_cycle = HDMI_PIXEL_HZ / UI_CLK_HZ
+        self.position = 0.0
+        self.hcount = 0
+        self.vcount = start_line # start in blanking, the way hdmi_pixel_ready waits for a new frame
+        self.lines = 0
+        self.phrases = 0
+        self.missed = 0
+        self.missed_lines = set()
+
+    def step(self):
+        self.position += self.pixels_per_cycle
+        while self.position >= 1:
+            self.position -= 1
+            if self.vcount < FRAME_HEIGHT and self.hcount < FRAME_WIDTH and self.hcount % PHRASE_PIXELS == 0:
+                if self.fifo.entries:
+                    self.fifo.pop()
+                    self.phrases += 1
+                else:
+                    self.missed += 1
+                    self.missed_lines.add(self.lines)
+            self.hcount += 1
+            if self.hcount == HDMI_H_TOTAL:
+                self.hcount = 0
+                self.lines += 1
+                self.vcount = (self.vcount + 1) % HDMI_V_TOTAL
+
+async def processor_traffic(dut, rng, source, sink, latency, memory, reads=0.6, line=4):
+    """ back-to-back cache-line reads and writes on the processor channel; each line read
+    is checked against what `memory` holds (the channel is the only writer in its region) """
+    region = 0x100000
+    while True:
+        addr = region + line * rng.randrange(1 << 12)
+        start = get_sim_time("ns")
+        if rng.random() < reads:
+            source.append(channel_updates(addr, line, 0)[0], tuser=1)
+            data = [(await sink.recv())[1] for _ in range(line)]
+            bad = first_mismatch(data, [memory.read_int(addr + i) for i in range(line)])
+            assert bad is None, "processor read of chunk {:x}: got {:032x}, DDR holds {:032x}".format(
+                addr + bad, data[bad], memory.read_int(addr + bad))
+        else:
+            source.append(channel_updates(addr, 0, 1)[0], tuser=1)
+            for i in range(line):
+                source.append(addr + i)
+            await source.wait()
+        latency.add(round((get_sim_time("ns") - start) / CLOCK_PERIOD_NS))
+
 @cocotb.test()
 async def test_camera_read(dut):
-    """simulate conditions of the camera input/output setup"""
+    """simulate conditions of the camera input/output setup
+
+    Camera frames written through a ddr_fifo at the camera's real rate, HDMI
+    reading the framebuffer back through another with its line deadlines, the
+    processor hammering a third channel. FIFO sizes and the run length come from
+    CAM_FIFO_DEPTH, HDMI_FIFO_DEPTH, HDMI_PROGFULL_DEPTH and SCENARIO_LINES.
+    """
+    seed = int(os.environ.get("SCENARIO_SEED", "1"))
+    lines = int(os.environ.get("SCENARIO_LINES", "12"))
+    cam_fifo = DdrFifoModel("camera_write", depth=int(os.environ.get("CAM_FIFO_DEPTH", "512")))
+    hdmi_fifo = DdrFifoModel("hdmi_read", depth=int(os.environ.get("HDMI_FIFO_DEPTH", "512")),
+                             progfull_depth=int(os.environ.get("HDMI_PROGFULL_DEPTH", "12")))
+    rng = random.Random(seed)
+
+    for i in range(CHANNEL_COUNT):
+        dut.write_axis_data[i].value = 0
+        dut.write_axis_tuser[i].value = 0
+        dut.write_axis_valid[i].value = 0
+        dut.write_axis_smallpile[i].value = 0
+        dut.read_axis_ready[i].value = 1
+        dut.read_axis_af[i].value = 0
+    dut.read_axis_ready[CAMERA_CHANNEL].value = 0
+    dut.app_rd_data.value = 0
+    memory = PagedMemory()
+    mig = MigModel(memory, seed=seed, read_latency=(10, 20), timing=DDR3Timing())
+    cocotb.start_soon( mig.run(dut, clk=dut.clk_in) )
+    await reset(dut.clk_in, dut.rst_in)
+    await Timer(40,units="ns") # past calibration
+
+    proc_source = AxisSource(dut.clk_in, dut.write_axis_valid[PROC_CHANNEL], dut.write_axis_ready[PROC_CHANNEL],
+                             dut.write_axis_data[PROC_CHANNEL], dut.write_axis_tuser[PROC_CHANNEL], name="processor")
+    proc_sink = AxisSink(dut.clk_in, dut.read_axis_valid[PROC_CHANNEL], dut.read_axis_ready[PROC_CHANNEL],
+                         dut.read_axis_data[PROC_CHANNEL], dut.read_axis_tuser[PROC_CHANNEL], name="processor reads")
+    proc_latency = Histogram()
+    proc = cocotb.start_soon(processor_traffic(dut, rng, proc_source, proc_sink, proc_latency, memory))
+
+    # HDMI channel: the frame read command, always presented (top_level channel 4)
+    dut.write_axis_data[HDMI_CHANNEL].value = FRAME_READ
+    dut.write_axis_tuser[HDMI_CHANNEL].value = 1
+    dut.write_axis_valid[HDMI_CHANNEL].value = 1
+
+    camera = CameraWriter(cam_fifo)
+    hdmi = HdmiReader(hdmi_fifo)
+    overflow = 0 # HDMI responses with nowhere to go: traffic_merger doesn't look at read ready
+    while hdmi.lines < lines + 1:
+        await RisingEdge(dut.clk_in)
+        if handshake(dut.write_axis_valid[CAMERA_CHANNEL], dut.write_axis_ready[CAMERA_CHANNEL]):
+            cam_fifo.pop()
+        if dut.read_axis_valid[HDMI_CHANNEL].value == 1 and not hdmi_fifo.push(1):
+            overflow += 1
+        camera.step()
+        hdmi.step()
+        # the FIFO heads and flags the merger sees next cycle
+        if cam_fifo.entries:
+            (tuser, data) = cam_fifo.entries[0]
+            dut.write_axis_data[CAMERA_CHANNEL].value = data
+            dut.write_axis_tuser[CAMERA_CHANNEL].value = tuser
+            dut.write_axis_valid[CAMERA_CHANNEL].value = 1
+        else:
+            dut.write_axis_valid[CAMERA_CHANNEL].value = 0
+        dut.read_axis_af[HDMI_CHANNEL].value = int(hdmi_fifo.prog_full())
+        dut.read_axis_ready[HDMI_CHANNEL].value = int(not hdmi_fifo.full())
+    proc.kill()
+
+    print("[camera] {} phrases produced, {} dropped at a full camera_write FIFO".format(camera.phrases, cam_fifo.drops))
+    print("[hdmi] {} lines, {} phrases delivered, {} missed deadlines on {} lines, {} responses overflowed hdmi_read".format(
+        hdmi.lines, hdmi.phrases, hdmi.missed, len(hdmi.missed_lines), overflow))
+    cam_fifo.report()
+    hdmi_fifo.report()
+    proc_source.stats.report()
+    proc_latency.report("processor transaction latency")
+    mig.report()
     
+
+
+@cocotb.test(skip=MIG_TRACE_REPLAY is None)
+async def test_replay_trace(dut):
+    """ replay a recorded MIG trace (e.g. from proc_context_tb MIG_TRACE=...) through the merger """
+    trace = read_trace(MIG_TRACE_REPLAY)
+    timed = os.environ.get("MIG_TRACE_ASAP", "0") != "1"
+    print("[trace] {}: {}".format(MIG_TRACE_REPLAY, summary(trace)))
+
+    for i in range(CHANNEL_COUNT):
+        dut.write_axis_data[i].value = 0
+        dut.write_axis_tuser[i].value = 0
+        dut.write_axis_valid[i].value = 0
+        dut.write_axis_smallpile[i].value = 0
+        dut.read_axis_ready[i].value = 1
+        dut.read_axis_af[i].value = 0
+    dut.app_rd_data.value = 0
+    memory = PagedMemory()
+    mig = MigModel(memory, seed=1, timing=DDR3Timing())
+    cocotb.start_soon( mig.run(dut, clk=dut.clk_in) )
+    await reset(dut.clk_in, dut.rst_in)
+    await Timer(40,units="ns") # past calibration
+
+    replay = TraceReplay(dut, trace, timed=timed)
+    cycles = await replay.run()
+    recorded = trace["cycle"][-1] - trace["cycle"][0] + 1
+    print("[trace] replayed {} commands in {} cycles ({} recorded)".format(len(trace["cycle"]), cycles, recorded))
+    mig.report()
+    assert (mig.reads, mig.writes) == (sum(trace["cmd"]), len(trace["cmd"]) - sum(trace["cmd"]))
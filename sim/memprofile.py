@@ -0,0 +1,225 @@
+""" memprofile: where a processor run's DDR traffic goes, cheap enough to leave on
+
+Every command the MIG accepts is attributed to an address region (by default
+the program image as "code", the camera framebuffer, everything else as
+"data": stack, heap, buffers) and counted into per-region time bins. With the
+processor behind mkCache, each DDR read is part of a line fill, i.e. a miss,
+so per region the profile also gives
+ * miss streams: runs of reads (or writes) to consecutive chunks, as a
+   histogram of run lengths -- long runs are streaming, runs of one line are
+   scattered misses
+ * reuse distance: for each read of a cache line DDR has seen before, the
+   number of DDR commands since that line was last touched, in power-of-two
+   bins -- short distances are lines the cache evicted and fetched again
+ * bytes read/written, and first touches (cold lines)
+
+Counters live in arrays sized up front (time bins grow by doubling), so the
+per-command cost is a bisect and a few array stores; nothing is printed until
+report(). summary() is JSON-ready; its time series are [region][bin] rows of
+bytes, ready to plot as a heatmap.
+
+    MIG_PROFILE=profile.json make          (proc_context_tb)
+    python memprofile.py trace.bin [--image mem.vmh] [--out profile.json]
+profiles a live run, or a migtrace recording after the fact.
+"""
+
+from array import array
+from bisect import bisect_right
+import json
+
+from axis import Histogram
+from memimage import CAMERA_FB_ADDR, FRAME_WIDTH, FRAME_HEIGHT
+from mig import CMD_READ, CMD_WRITE
+
+CHUNK_BYTES = 16
+LINE_CHUNKS = 4           # mkCache line fill: one read command, 4 response beats
+FRAME_CHUNKS = FRAME_WIDTH * FRAME_HEIGHT * 2 // CHUNK_BYTES
+BIN_SHIFT = 12            # ui_clk cycles per time bin = 1 << BIN_SHIFT
+INITIAL_BINS = 1024
+REUSE_BINS = 33           # bin b: distance < 2**b commands
+
+
+def default_regions(image=None):
+    """ [(name, first chunk, end chunk)]: the image's segments as code, then the framebuffer """
+    regions = []
+    if image is not None:
+        for (addr, data) in image.segments:
+            regions.append(("code", addr, addr + len(data) // CHUNK_BYTES))
+    regions.append(("framebuffer", CAMERA_FB_ADDR, CAMERA_FB_ADDR + FRAME_CHUNKS))
+    return regions
+
+
+class MemoryProfile:
+    """ per-region DDR access counters; pass as MigModel(profile=...) or call access() directly
+
+    `regions` is a list of (name, first chunk, end chunk); ranges sharing a name
+    are one region, chunks outside every range go to `other`. Where ranges
+    overlap the earlier one wins.
+    """
+
+    def __init__(self, regions=None, other="data", bin_shift=BIN_SHIFT, line_chunks=LINE_CHUNKS):
+        regions = default_regions() if regions is None else regions
+        self.names = []
+        for (name, _, _) in regions:
+            if name not in self.names:
+                self.names.append(name)
+        if other not in self.names:
+            self.names.append(other)
+        other_index = self.names.index(other)
+
+        # flatten the ranges into sorted boundaries, earlier ranges on top
+        owner = {}
+        points = sorted({p for (_, start, end) in regions for p in (start, end)})
+        for (lo, hi) in zip(points, points[1:]):
+            owner[lo] = next((self.names.index(name) for (name, start, end) in regions
+                              if start <= lo and hi <= end), other_index)
+        self.bounds = points
+        self.owners = [other_index] + [owner.get(p, other_index) for p in points]
+
+        self.bin_shift = bin_shift
+        self.line_shift = (line_chunks - 1).bit_length()
+        count = len(self.names)
+        # index r*2 + cmd for everything kept per region and direction
+        self.bins = [array("I", [0]) * INITIAL_BINS for _ in range(2 * count)]
+        self.used_bins = 0
+        self.commands = array("Q", [0]) * (2 * count)
+        self.last_addr = [-2] * (2 * count)
+        self.run = [0] * (2 * count)
+        self.streams = [Histogram() for _ in range(2 * count)]
+        self.reuse = [array("Q", [0]) * REUSE_BINS for _ in range(count)]
+        self.cold = array("Q", [0]) * count
+        self.last_seen = {} # line -> command number of its last access
+        self.total = 0
+        self.first_cycle = None
+        self.last_cycle = 0
+
+    def region(self, addr):
+        """ region index of chunk `addr` """
+        return self.owners[bisect_right(self.bounds, addr)]
+
+    def access(self, cycle, cmd, addr):
+        """ one accepted command to chunk `addr` at ui_clk `cycle` """
+        r = self.owners[bisect_right(self.bounds, addr)]
+        k = 2 * r + cmd
+        if self.first_cycle is None:
+            self.first_cycle = cycle
+        self.last_cycle = cycle
+
+        t = (cycle - self.first_cycle) >> self.bin_shift
+        bins = self.bins[k]
+        if t >= len(bins):
+            self.grow(t)
+            bins = self.bins[k]
+        bins[t] += 1
+        if t >= self.used_bins:
+            self.used_bins = t + 1
+        self.commands[k] += 1
+
+        if addr == self.last_addr[k] + 1:
+            self.run[k] += 1
+        else:
+            if self.run[k]:
+                self.streams[k].add(self.run[k])
+            self.run[k] = 1
+        self.last_addr[k] = addr
+
+        # reuse is per line, counted once per line fill (its first chunk)
+        line = addr >> self.line_shift
+        n = self.total
+        last = self.last_seen.get(line)
+        if cmd == CMD_READ and (last is None or last != n - 1):
+            if last is None:
+                self.cold[r] += 1
+            else:
+                self.reuse[r][min((n - last).bit_length(), REUSE_BINS - 1)] += 1
+        self.last_seen[line] = n
+        self.total = n + 1
+
+    def grow(self, t):
+        size = len(self.bins[0])
+        while size <= t:
+            size *= 2
+        for bins in self.bins:
+            bins.extend(array("I", [0]) * (size - len(bins)))
+
+    def streams_of(self, r, cmd):
+        """ run-length histogram for region r, including the run still open """
+        k = 2 * r + cmd
+        histogram = Histogram()
+        histogram.counts.update(self.streams[k].counts)
+        histogram.total = self.streams[k].total
+        if self.run[k]:
+            histogram.add(self.run[k])
+        return histogram
+
+    def summary(self):
+        """ JSON-ready totals, histograms and [region][bin] byte series """
+        regions = []
+        for (r, name) in enumerate(self.names):
+            reads = self.commands[2 * r + CMD_READ]
+            writes = self.commands[2 * r + CMD_WRITE]
+            reuse = self.reuse[r]
+            last = max((b for b in range(REUSE_BINS) if reuse[b]), default=0)
+            regions.append({
+                "name": name,
+                "read_bytes": reads * CHUNK_BYTES, "write_bytes": writes * CHUNK_BYTES,
+                "cold_lines": self.cold[r],
+                "read_streams": self.streams_of(r, CMD_READ).as_dict(),
+                "write_streams": self.streams_of(r, CMD_WRITE).as_dict(),
+                # reuse_distance[b]: line refetches fewer than 2**b commands after the last touch
+                "reuse_distance": list(reuse[:last + 1]),
+            })
+        used = self.used_bins
+        return {
+            "commands": self.total,
+            "first_cycle": self.first_cycle, "last_cycle": self.last_cycle,
+            "bin_cycles": 1 << self.bin_shift,
+            "regions": regions,
+            "read_bytes": [[n * CHUNK_BYTES for n in self.bins[2 * r + CMD_READ][:used]]
+                           for r in range(len(self.names))],
+            "write_bytes": [[n * CHUNK_BYTES for n in self.bins[2 * r + CMD_WRITE][:used]]
+                            for r in range(len(self.names))],
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f)
+        print("[profile] {} MIG commands -> {}".format(self.total, path))
+
+    def report(self):
+        span = self.last_cycle - (self.first_cycle or 0) + 1
+        print("[profile] {} MIG commands over {} cycles".format(self.total, span))
+        for region in self.summary()["regions"]:
+            reads = region["read_streams"]
+            refetches = sum(region["reuse_distance"])
+            print("[profile] {:>12}: {} B read, {} B written, {} cold lines, {} refetched lines, "
+                  "read streams mean {} / max {} chunks".format(
+                      region["name"], region["read_bytes"], region["write_bytes"],
+                      region["cold_lines"], refetches,
+                      "-" if reads["mean"] is None else "{:.1f}".format(reads["mean"]), reads["max"]))
+
+
+def profile_trace(trace, profile):
+    """ feed a migtrace.read_trace() recording through `profile` """
+    for (cycle, cmd, addr) in zip(trace["cycle"], trace["cmd"], trace["addr"]):
+        profile.access(cycle, cmd, addr)
+    return profile
+
+
+if __name__ == "__main__":
+    import argparse
+    from memimage import load_image
+    from migtrace import read_trace
+
+    parser = argparse.ArgumentParser(description="per-region DDR access profile of a MIG trace")
+    parser.add_argument("trace")
+    parser.add_argument("--image", help="program .hex/.vmh whose segments are the code region")
+    parser.add_argument("--bin-shift", type=int, default=BIN_SHIFT, help="log2 cycles per time bin")
+    parser.add_argument("--out", help="write the summary JSON here")
+    args = parser.parse_args()
+
+    regions = default_regions(load_image(args.image) if args.image else None)
+    profile = profile_trace(read_trace(args.trace), MemoryProfile(regions, bin_shift=args.bin_shift))
+    profile.report()
+    if args.out:
+        profile.write(args.out)
@@ -0,0 +1,98 @@
+""" merger_bench: sweep the traffic_merger benchmark over CHANNEL_COUNT / MAX_CMD_QUEUE
+
+usage: python merger_bench.py [--channels 2,3,4] [--queue 2,4,8,16]
+                              [--workload mixed] [--mig default] [--transactions 32]
+                              [--seed 1] [--sim icarus] [--out merger_bench]
+
+Every (CHANNEL_COUNT, MAX_CMD_QUEUE) pair gets its own build directory, so the
+parameterized builds don't overwrite each other. Each run appends one JSON line
+(see merger_bench_tb.py); the sweep collects them into <out>.json and a flat
+<out>.csv with one row per configuration.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from cocotb.runner import get_runner
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+HDL_DIR = os.path.join(SIM_DIR, "..", "hdl")
+UTIL_DIR = os.path.join(SIM_DIR, "..", "util")
+SOURCES = [os.path.join(HDL_DIR, "traffic_merger.sv"), os.path.join(HDL_DIR, "cursor.sv")]
+
+CSV_FIELDS = ["channel_count", "max_cmd_queue", "workload", "mig", "transactions", "seed",
+              "mig_beats", "busy_cycles", "beats_per_cycle", "burst_mean", "burst_p50", "burst_max",
+              "latency_p50", "latency_p99", "max_stall_run", "fairness_ratio"]
+
+
+def int_list(text):
+    return [int(x) for x in text.split(",")]
+
+def run_config(args, channels, queue, jsonl):
+    """ build and run one configuration; returns its result record """
+    build_dir = os.path.join(SIM_DIR, "sim_build", "merger_c{}_q{}".format(channels, queue))
+    runner = get_runner(args.sim)
+    runner.build(verilog_sources=SOURCES, hdl_toplevel="traffic_merger",
+                 parameters={"CHANNEL_COUNT": channels, "MAX_CMD_QUEUE": queue},
+                 build_dir=build_dir, always=True)
+    if os.path.exists(jsonl):
+        os.remove(jsonl)
+    runner.test(test_module="merger_bench_tb", hdl_toplevel="traffic_merger",
+                build_dir=build_dir, test_dir=SIM_DIR,
+                extra_env={"BENCH_WORKLOAD": args.workload, "BENCH_MIG": args.mig,
+                           "BENCH_TRANSACTIONS": str(args.transactions), "BENCH_SEED": str(args.seed),
+                           "BENCH_OUT": jsonl, "MAX_CMD_QUEUE": str(queue),
+                           "PYTHONPATH": os.pathsep.join([SIM_DIR, UTIL_DIR, os.environ.get("PYTHONPATH", "")])})
+    with open(jsonl) as f:
+        return json.loads(f.readlines()[-1])
+
+def csv_row(result):
+    """ flatten one result record to CSV_FIELDS; latency percentiles are the worst channel's """
+    row = {field: result.get(field) for field in CSV_FIELDS}
+    row["burst_mean"] = result["bursts"]["mean"]
+    row["burst_p50"] = result["bursts"]["p50"]
+    row["burst_max"] = result["bursts"]["max"]
+    latencies = [channel["latency"] for channel in result["channels"] if channel["latency"]["count"]]
+    row["latency_p50"] = max((latency["p50"] for latency in latencies), default=None)
+    row["latency_p99"] = max((latency["p99"] for latency in latencies), default=None)
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="traffic_merger bandwidth/fairness sweep")
+    parser.add_argument("--channels", type=int_list, default=[2, 3, 4],
+                        help="comma-separated CHANNEL_COUNT values (at least 2)")
+    parser.add_argument("--queue", type=int_list, default=[2, 4, 8, 16],
+                        help="comma-separated MAX_CMD_QUEUE values")
+    parser.add_argument("--workload", default="mixed")
+    parser.add_argument("--mig", default="default")
+    parser.add_argument("--transactions", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sim", default=os.environ.get("SIM", "icarus"))
+    parser.add_argument("--out", default="merger_bench", help="output basename for .json and .csv")
+    args = parser.parse_args()
+
+    if min(args.channels) < 2:
+        # traffic_merger sizes its channel index with $clog2(CHANNEL_COUNT)
+        sys.exit("CHANNEL_COUNT must be at least 2")
+
+    results = []
+    for channels in args.channels:
+        for queue in args.queue:
+            jsonl = os.path.join(SIM_DIR, "sim_build", "merger_c{}_q{}.jsonl".format(channels, queue))
+            result = run_config(args, channels, queue, jsonl)
+            print("CHANNEL_COUNT={} MAX_CMD_QUEUE={}: {:.3f} beats/cycle, fairness {}".format(
+                channels, queue, result["beats_per_cycle"], result["fairness_ratio"]))
+            results.append(result)
+
+    with open(args.out + ".json", "w") as f:
+        json.dump(results, f, indent=1)
+    with open(args.out + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(csv_row(result))
+    print("wrote {0}.json, {0}.csv".format(args.out))
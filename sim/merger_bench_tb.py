@@ -0,0 +1,246 @@
+""" merger_bench_tb: traffic_merger bandwidth / fairness benchmark (TOPLEVEL = traffic_merger)
+
+Each channel runs a script of read/write transactions from a named WORKLOADS
+profile against a MigModel with a named MIG_PROFILES backpressure/latency
+profile. Reported per run:
+ * MIG beats per cycle (accepted 128-bit commands over the busy window)
+ * burst length distribution: runs of same-type commands to contiguous
+   addresses on consecutive cycles, as the MIG sees them
+ * per-channel transaction latency percentiles, command accept to last beat
+ * starvation: the longest any channel's pending beat waited for ready, and
+   the max/min ratio of per-channel bandwidth
+Read responses are checked against the address they were requested from.
+
+Configured through the environment (see merger_bench.py for sweeps):
+BENCH_WORKLOAD, BENCH_MIG, BENCH_TRANSACTIONS, BENCH_SEED, BENCH_OUT,
+MAX_CMD_QUEUE (only recorded: the parameter itself is set at build time).
+"""
+
+import cocotb
+from cocotb.triggers import RisingEdge, Timer
+from cocotb.utils import get_sim_time
+import json
+import os
+import random
+import time
+
+from memstore import PagedMemory
+from mig import MigModel, DDR3Timing, CMD_READ, CLOCK_PERIOD_NS
+from axis import reset, AxisSource, AxisSink, Histogram
+from structs import channel_updates, first_mismatch
+
+CHANNEL_STRIDE = 1 << 20 # chunks between channel address regions
+
+# per-channel transaction mixes; channel i uses profile[i % len(profile)]
+#  reads: fraction of transactions that are reads
+#  length: chunks per transaction, fixed or (min, max)
+WORKLOADS = {
+    "write_stream": [{"reads": 0.0, "length": 16}],
+    "read_stream": [{"reads": 1.0, "length": 16}],
+    "mixed": [{"reads": 0.5, "length": (1, 32)}],
+    "short_mixed": [{"reads": 0.5, "length": (1, 4)}],
+    # processor cache lines beside a camera writer and a display reader
+    "proc_camera_display": [{"reads": 0.6, "length": 4},
+                            {"reads": 0.0, "length": 64},
+                            {"reads": 1.0, "length": 64}],
+}
+
+# MigModel keyword arguments
+MIG_PROFILES = {
+    "ideal": {"rdy_stall": 0.0, "wdf_stall": 0.0, "read_latency": 10},
+    "default": {},
+    "ddr3": {"read_latency": (10, 20), "timing": True},
+    "congested": {"rdy_stall": 0.3, "wdf_stall": 0.3, "read_latency": (10, 40)},
+}
+
+
+def chunk_value(addr):
+    """ what DDR holds at chunk `addr`: the address itself, recognizable in any response """
+    return (addr << 64) | (addr ^ 0x5A5A5A5A5A5A5A5A)
+
+def make_script(profile, channel, count, rng):
+    """ list of (is_read, addr, length) transactions, streaming through the channel's region """
+    script = []
+    addr = (channel + 1) * CHANNEL_STRIDE
+    for _ in range(count):
+        length = profile["length"]
+        if not isinstance(length, int):
+            length = rng.randint(*length)
+        script.append((rng.random() < profile["reads"], addr, length))
+        addr += length
+    return script
+
+
+class ChannelBench:
+    """ drives one channel's script and times each transaction """
+
+    def __init__(self, dut, index, script):
+        self.index = index
+        self.script = script
+        self.source = AxisSource(dut.clk_in, dut.write_axis_valid[index], dut.write_axis_ready[index],
+                                 dut.write_axis_data[index], dut.write_axis_tuser[index],
+                                 name="channel %d" % index)
+        self.sink = AxisSink(dut.clk_in, dut.read_axis_valid[index], dut.read_axis_ready[index],
+                             dut.read_axis_data[index], dut.read_axis_tuser[index])
+        self.latency = Histogram()
+        self.chunks = 0
+        self.first_start = None
+        self.last_done = None
+        self.starts = []       # accept time of each transaction's command beat
+        self.data_left = 0     # write data beats still due for the latest command
+        self.source.on_beat(self.beat_accepted)
+
+    def beat_accepted(self, now, data, tuser):
+        if tuser:
+            self.starts.append(now)
+            (is_read, _, length) = self.script[len(self.starts) - 1]
+            self.data_left = 0 if is_read else length
+        else:
+            self.data_left -= 1
+            if self.data_left == 0:
+                self.done(len(self.starts) - 1, now)
+
+    def done(self, n, now):
+        start = self.starts[n]
+        self.latency.add(round((now - start) / CLOCK_PERIOD_NS))
+        if self.first_start is None:
+            self.first_start = start
+        self.last_done = now
+        self.chunks += self.script[n][2]
+
+    async def run(self):
+        # everything is queued up front: traffic_merger itself holds a channel's
+        # next command until its reads have returned
+        (reads, addrs, lengths) = zip(*self.script)
+        commands = channel_updates(addrs, lengths, [0 if is_read else 1 for is_read in reads])
+        for ((is_read, addr, length), command) in zip(self.script, commands):
+            self.source.append(command, tuser=1)
+            if not is_read:
+                for i in range(length):
+                    self.source.append(chunk_value(addr + i))
+        for (n, (is_read, addr, length)) in enumerate(self.script):
+            if not is_read:
+                continue
+            data = []
+            for i in range(length):
+                (tuser, chunk) = await self.sink.recv()
+                assert tuser == (i == 0), "channel {}: tuser {} on response {} of {}".format(
+                    self.index, tuser, i, length)
+                data.append(chunk)
+            bad = first_mismatch(data, [chunk_value(addr + i) for i in range(length)])
+            assert bad is None, "channel {}: response {:032x} for chunk {:x}".format(
+                self.index, data[bad], addr + bad)
+            self.done(n, get_sim_time("ns"))
+        await self.source.wait()
+
+    def bandwidth(self):
+        """ chunks per cycle this channel moved while it was running """
+        if self.last_done is None or self.last_done == self.first_start:
+            return 0.0
+        return self.chunks / ((self.last_done - self.first_start) / CLOCK_PERIOD_NS)
+
+
+async def watch_mig(dut, bursts, counts):
+    """ histogram of burst lengths as the MIG accepts them """
+    run = 0
+    last = None # (cmd, app_addr) of the previous cycle's accepted command
+    while True:
+        await RisingEdge(dut.clk_in)
+        accepted = None
+        if dut.app_en.value == 1 and dut.app_rdy.value == 1:
+            cmd = int(dut.app_cmd.value)
+            if cmd == CMD_READ or (dut.app_wdf_wren.value == 1 and dut.app_wdf_rdy.value == 1):
+                accepted = (cmd, int(dut.app_addr.value))
+        if accepted is not None:
+            counts["beats"] += 1
+            counts["last"] = counts["cycle"]
+            if counts["first"] is None:
+                counts["first"] = counts["cycle"]
+            if last is not None and accepted[0] == last[0] and accepted[1] == last[1] + 8:
+                run += 1
+            else:
+                if run:
+                    bursts.add(run)
+                run = 1
+        elif run:
+            bursts.add(run)
+            run = 0
+        last = accepted
+        counts["cycle"] += 1
+
+
+@cocotb.test()
+async def test_merger_benchmark(dut):
+    """ run the configured workload through traffic_merger, append results to BENCH_OUT """
+
+    workload = os.environ.get("BENCH_WORKLOAD", "mixed")
+    mig_profile = os.environ.get("BENCH_MIG", "default")
+    transactions = int(os.environ.get("BENCH_TRANSACTIONS", "32"))
+    seed = int(os.environ.get("BENCH_SEED", "1"))
+    out = os.environ.get("BENCH_OUT", "merger_bench.jsonl")
+    channel_count = len(dut.write_axis_valid)
+    rng = random.Random(seed)
+
+    profiles = WORKLOADS[workload]
+    scripts = [make_script(profiles[i % len(profiles)], i, transactions, rng) for i in range(channel_count)]
+
+    memory = PagedMemory()
+    for script in scripts:
+        for (is_read, addr, length) in script:
+            for i in range(length):
+                memory.write_int(addr + i, chunk_value(addr + i))
+
+    mig_args = dict(MIG_PROFILES[mig_profile])
+    if mig_args.pop("timing", False):
+        mig_args["timing"] = DDR3Timing()
+    mig = MigModel(memory, seed=seed, **mig_args)
+
+    for i in range(channel_count):
+        dut.write_axis_valid[i].value = 0
+        dut.write_axis_tuser[i].value = 0
+        dut.write_axis_data[i].value = 0
+        dut.write_axis_smallpile[i].value = 0
+        dut.read_axis_af[i].value = 0
+    dut.app_rd_data.value = 0
+    cocotb.start_soon( mig.run(dut, clk=dut.clk_in) )
+    await reset(dut.clk_in, dut.rst_in)
+
+    bursts = Histogram()
+    counts = {"beats": 0, "cycle": 0, "first": None, "last": None}
+    cocotb.start_soon( watch_mig(dut, bursts, counts) )
+    channels = [ChannelBench(dut, i, scripts[i]) for i in range(channel_count)]
+    await Timer(40, units="ns") # past calibration
+
+    wall_start = time.perf_counter()
+    for task in [cocotb.start_soon(channel.run()) for channel in channels]:
+        await task
+    wall = time.perf_counter() - wall_start
+
+    busy = counts["last"] - counts["first"] + 1
+    bandwidths = [channel.bandwidth() for channel in channels]
+    result = {
+        "bench": "traffic_merger",
+        "channel_count": channel_count,
+        "max_cmd_queue": int(os.environ["MAX_CMD_QUEUE"]) if "MAX_CMD_QUEUE" in os.environ else None,
+        "workload": workload, "mig": mig_profile, "transactions": transactions, "seed": seed,
+        "mig_beats": counts["beats"], "busy_cycles": busy,
+        "beats_per_cycle": counts["beats"] / busy,
+        "bursts": bursts.as_dict(),
+        "max_stall_run": max(channel.source.stats.max_stall_run for channel in channels),
+        "fairness_ratio": (max(bandwidths) / min(bandwidths)) if min(bandwidths) > 0 else None,
+        "channels": [dict(channel=channel.index, chunks=channel.chunks, bandwidth=bandwidth,
+                          stall_cycles=channel.source.stats.stall_cycles,
+                          max_stall_run=channel.source.stats.max_stall_run,
+                          latency=channel.latency.as_dict(bins=False))
+                     for (channel, bandwidth) in zip(channels, bandwidths)],
+        "wall_s": wall,
+    }
+
+    print("[merger] {workload}/{mig}: {mig_beats} beats in {busy_cycles} cycles = {beats_per_cycle:.3f} beats/cycle, "
+          "longest channel stall {max_stall_run} cycles".format(**result))
+    bursts.report("burst length")
+    for channel in channels:
+        channel.latency.report("channel {} latency".format(channel.index))
+    mig.report()
+    with open(out, "a") as f:
+        f.write(json.dumps(result) + "\n")
@@ -1,139 +1,328 @@
 import cocotb
+from cocotb.clock import Clock
 from cocotb.triggers import RisingEdge, Timer, FallingEdge
 from cocotb.utils import get_sim_time
+from collections import deque
+import math
 import random
+import struct
+
+from memimage import load_image, SEGMENT_HEADER, CAMERA_FB_ADDR
+from memstore import PagedMemory, CHUNK_BYTES
 
 debug = False
 
-def writemem(memory, addr, data):
-    # data: bytearray, length 128 bits/16 bytes
-    memory[addr] = data
-
-def readmem(memory,addr):
-    # returned 128 bit/16 byte bytearray
-    if (addr in memory):
-        return memory[addr]
-    else:
-        return 0xABABABABABABABABABABABABABABABAB.to_bytes(16,'big')
-
-def write_memory(memory,current_addr,current_chunk):
-    current_chunk.reverse()
-    concatenated = bytearray()
-    for piece in current_chunk:
-        concatenated += piece
-    # print( concatenated.hex() )
-    memory[current_addr] = concatenated
-
-def generate_memory(filename):
-    memory = {}
-    with open(filename,'r') as vmhfile:
-        lines = vmhfile.readlines()
-        current_index = 0
-        current_chunk = []
-        current_addr = 0
-        for line in lines:
-            if '@' in line:
-                if current_chunk:
-                    write_memory(memory,current_addr,current_chunk)
-                    current_chunk = []
-                    current_index = 0
-                new_addr = int(line[1:].strip(),16) >> 2
-                current_addr = new_addr
-            else:
-                current_chunk.append( int(line.strip(), 16).to_bytes(4,'big') )
-                current_index = (current_index + 1) % 4
-                if (current_index == 0):
-                    write_memory(memory, current_addr,current_chunk)
-                    current_chunk = []
-                    current_addr = current_addr + 1
-        if (current_chunk):
-            write_memory(memory, current_addr, current_chunk)
-    # print(memory)
+def generate_memory(filename, backing=None):
+    # compiled (and cached) by the same loader the UART uploader uses
+    memory = PagedMemory(backing=backing)
+    memory.load_image(load_image(filename))
     return memory
 
-def command_assent(ready,valid):
-    return (ready.value == 1 and valid.value == 1)
-
-async def mimic_ready(clk,app_rdy,app_wdf_rdy):
-    while True:
-        await RisingEdge(clk)
-        if (random.random() > 0.9):
-            app_rdy.value = 0
-            if (random.random() > 0.9):
-                app_wdf_rdy.value = 0
-            else:
-                app_wdf_rdy.value = 1
-        else:
-            app_rdy.value = 1
-            app_wdf_rdy.value = 1
-
-async def generate_clock(clk):
-    """ generate clock pulses """
-    while True:
-        clk.value = 0
-        await Timer(5,units="ns")
-        clk.value = 1
-        await Timer(5,units="ns")
-
-async def handle_request(dut,memory,responses):
-    CMD_READ = 1
-    CMD_WRITE = 0
-
-    DELAY_NS = 100
-    
-    if (command_assent(dut.app_rdy,dut.app_en)):
-        if (dut.app_cmd.value == CMD_READ):
-            # READ cmd
-            addr = int(dut.app_addr.value) >> 3
-            await Timer(DELAY_NS,units="ns")
-            read_data = readmem(memory,addr)
-            # print(addr,read_data)
-            responses.append( int.from_bytes(read_data,"big") )
-            if (debug):
-                print("[mig] read request @{:07x}".format(addr))
-            return True
+def resolved_mask(mask):
+    # benches that never drive app_wdf_mask leave it at x/z: write every byte
+    return int(mask.value) if mask.value.is_resolvable else 0
+
+CMD_WRITE = 0
+CMD_READ = 1
+
+CLOCK_PERIOD_NS = 10
+READ_LATENCY = 10       # cycles from accepted read to app_rd_data_valid
+RDY_STALL = 0.1         # chance app_rdy is low on a given cycle
+WDF_STALL = 0.1         # chance app_wdf_rdy is also low while app_rdy is low
+SCHEDULE_LENGTH = 4096  # cycles of precomputed backpressure before it repeats
+
+# DDR3 geometry/timing from ip/ddr3_mig (MEM_ADDR_ORDER = BANK_ROW_COLUMN)
+COL_WIDTH = 10
+ROW_WIDTH = 13
+BANK_WIDTH = 3
+TCK_NS = 3.077    # memory clock period
+NCK_PER_CLK = 4   # memory clocks per ui_clk
+
+def ui_cycles(ns):
+    """ ui_clk cycles covering `ns` nanoseconds of DRAM timing """
+    return math.ceil(math.ceil(ns / TCK_NS) / NCK_PER_CLK)
+
+# snapshot file: header, outstanding responses, then memory as memimage segments
+SNAPSHOT_MAGIC = b"MIGSNP\x01"
+SNAPSHOT_HEADER = struct.Struct("<7sQqQQQQII") # magic, cycle, last_due, reads, writes,
+                                                # read latency total, seed, responses, segments
+RESPONSE_HEADER = struct.Struct("<Q")           # due cycle, then 16 bytes of data
+
+class DDR3Timing:
+    """ open-row bookkeeping for the MIG model's optional timing mode
+
+    Tracks the open row of each bank and when it can next take a column
+    command: a row hit costs nothing extra, a miss (bank precharged) costs
+    tRCD, a conflict (another row open) costs tRP + tRCD and queues later
+    commands to that bank behind it. Every tREFI, app_rdy drops for tRFC
+    while all banks refresh, which closes every row.
+    """
+
+    def __init__(self, t_rcd=ui_cycles(12.5), t_rp=ui_cycles(12.5),
+                 t_refi=int(7800 / TCK_NS) // NCK_PER_CLK, t_rfc=ui_cycles(110)):
+        self.t_rcd = t_rcd
+        self.t_rp = t_rp
+        self.t_refi = t_refi
+        self.t_rfc = t_rfc
+        self.open_rows = [None] * (1 << BANK_WIDTH)
+        self.bank_ready = [0] * (1 << BANK_WIDTH)
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.refresh_cycles = 0
+
+    def access(self, app_addr, cycle):
+        """ book a command at `cycle`; returns the cycle its column access issues """
+        bank = (app_addr >> (COL_WIDTH + ROW_WIDTH)) & ((1 << BANK_WIDTH) - 1)
+        row = (app_addr >> COL_WIDTH) & ((1 << ROW_WIDTH) - 1)
+        start = max(cycle, self.bank_ready[bank])
+        open_row = self.open_rows[bank]
+        if open_row == row:
+            self.hits += 1
+        elif open_row is None:
+            self.misses += 1
+            start += self.t_rcd
         else:
-            # WRITE cmd
-            if (command_assent(dut.app_wdf_rdy,dut.app_wdf_wren)):
-                addr = int(dut.app_addr.value) >> 3
-                data = int(dut.app_wdf_data.value).to_bytes(16,"big")
-                writemem(memory,addr,data)
-                if (debug):
-                    print("[mig] write request @{:07x} [{:032x}]".format(addr,int.from_bytes(data,'big')))
-                return True
+            self.conflicts += 1
+            start += self.t_rp + self.t_rcd
+        self.open_rows[bank] = row
+        self.bank_ready[bank] = start
+        return start
+
+    def refreshing(self, cycle):
+        """ True while a refresh holds app_rdy low on `cycle` """
+        phase = cycle % self.t_refi
+        if phase < self.t_refi - self.t_rfc:
             return False
-    return False
-
-async def deliver_responses(clk,valid,data,end,responses):
-    while True:
-        await RisingEdge(clk)
-        if (len(responses) > 0):
-            valid.value = 1
-            end.value = 1
-            resp = responses.pop(0)
-            data.value = resp
-            if (debug):
-                print("[mig] response {:032x}".format(int(resp)))
+        if phase == self.t_refi - self.t_rfc:
+            self.open_rows = [None] * len(self.open_rows)
+        self.refresh_cycles += 1
+        return True
+
+    def report(self):
+        accesses = self.hits + self.misses + self.conflicts
+        print("[mig] rows: {} hits, {} misses, {} conflicts ({:.1%} hit rate), {} refresh stall cycles".format(
+            self.hits, self.misses, self.conflicts,
+            self.hits / accesses if accesses else 0, self.refresh_cycles))
+
+class MigModel:
+    """ MIG user interface stand-in: commands, write data and read responses
+    are all handled by one coroutine, once per rising edge of ui_clk.
+
+    Backpressure and read latency come from schedules precomputed from `seed`,
+    so a run is exactly reproducible. `read_latency` is a fixed cycle count or
+    a (min,max) range to draw from; responses still come back in order.
+    Passing a DDR3Timing as `timing` adds row/bank and refresh costs on top,
+    a migtrace.TraceRecorder as `trace` records every accepted command, and a
+    memprofile.MemoryProfile as `profile` counts them per address region.
+    """
+
+    def __init__(self, memory, seed=None, read_latency=READ_LATENCY,
+                 rdy_stall=RDY_STALL, wdf_stall=WDF_STALL, schedule_length=SCHEDULE_LENGTH,
+                 timing=None, trace=None, profile=None):
+        if seed is None:
+            seed = random.getrandbits(32) # follows cocotb's RANDOM_SEED
+        self.seed = seed
+        self.memory = memory
+        rng = random.Random(seed)
+
+        self.rdy_schedule = []
+        self.wdf_rdy_schedule = []
+        for _ in range(schedule_length):
+            rdy = rng.random() >= rdy_stall
+            self.rdy_schedule.append(rdy)
+            self.wdf_rdy_schedule.append(rdy or rng.random() >= wdf_stall)
+        if isinstance(read_latency, int):
+            self.latency_schedule = [read_latency]
         else:
-            valid.value = 0
-            end.value = 0
-
-async def simulate_mig(dut,memory):
-    dut.init_calib_complete.value = 0
-    dut.app_sr_active.value = 0
-    dut.app_ref_ack.value = 0
-    dut.app_zq_ack.value = 0
-    await cocotb.start( generate_clock(dut.ui_clk) )
-    await Timer(10,units="ns")
-    await cocotb.start( mimic_ready(dut.ui_clk, dut.app_rdy, dut.app_wdf_rdy) )
-    await Timer(10,units="ns")
-    dut.init_calib_complete.value = 1
-    responses = []
-    await cocotb.start( deliver_responses(dut.ui_clk, dut.app_rd_data_valid, dut.app_rd_data, dut.app_rd_data_end, responses) )
+            (low, high) = read_latency
+            self.latency_schedule = [rng.randint(low, high) for _ in range(schedule_length)]
 
-    while True:
-        await RisingEdge(dut.ui_clk)
-        await cocotb.start( handle_request(dut,memory,responses) )
+        self.timing = timing
+        self.trace = trace
+        self.profile = profile
+        self.responses = deque() # (due cycle, data), due cycles strictly increasing
+        self.last_due = -1
+        self.cycle = 0
+        self.reads = 0
+        self.writes = 0
+        self.read_latency_total = 0
+
+    def accept_read(self, app_addr):
+        addr = app_addr >> 3
+        start = self.cycle if self.timing is None else self.timing.access(app_addr, self.cycle)
+        latency = self.latency_schedule[self.reads % len(self.latency_schedule)]
+        due = max(start + latency, self.last_due + 1) # one beat per cycle, in order
+        self.last_due = due
+        self.read_latency_total += due - self.cycle
+        self.responses.append((due, self.memory.read_int(addr)))
+        self.reads += 1
+        if self.trace is not None:
+            self.trace.record(self.cycle, CMD_READ, addr)
+        if self.profile is not None:
+            self.profile.access(self.cycle, CMD_READ, addr)
+        if (debug):
+            print("[mig] read request @{:07x}".format(addr))
+
+    def accept_write(self, app_addr, data, mask):
+        addr = app_addr >> 3
+        if self.timing is not None:
+            self.timing.access(app_addr, self.cycle)
+        self.memory.write_int(addr, data, mask)
+        self.writes += 1
+        if self.trace is not None:
+            self.trace.record(self.cycle, CMD_WRITE, addr, data, mask)
+        if self.profile is not None:
+            self.profile.access(self.cycle, CMD_WRITE, addr)
+        if (debug):
+            print("[mig] write request @{:07x} [{:032x}]".format(addr,data))
+
+    async def run(self, dut, clk=None):
+        """ drive the MIG side of `dut`, clocking `clk` (default dut.ui_clk) """
+        clk = dut.ui_clk if clk is None else clk
+        dut.init_calib_complete.value = 0
+        dut.app_sr_active.value = 0
+        dut.app_ref_ack.value = 0
+        dut.app_zq_ack.value = 0
+        dut.app_rdy.value = 1
+        dut.app_wdf_rdy.value = 1
+        dut.app_rd_data_valid.value = 0
+        dut.app_rd_data_end.value = 0
+        cocotb.start_soon( Clock(clk, CLOCK_PERIOD_NS, units="ns").start() )
+        await Timer(20,units="ns")
+        dut.init_calib_complete.value = 1
+        print("[mig] schedule seed {}".format(self.seed))
+
+        app_en = dut.app_en
+        app_cmd = dut.app_cmd
+        app_addr = dut.app_addr
+        app_wdf_wren = dut.app_wdf_wren
+        rd_valid = dut.app_rd_data_valid
+        rd_end = dut.app_rd_data_end
+        rd_data = dut.app_rd_data
+        responses = self.responses
+        timing = self.timing
+        period = len(self.rdy_schedule)
+
+        rdy = True
+        wdf_rdy = True
+        valid = False
+        while True:
+            await RisingEdge(clk)
+
+            # command presented during the cycle that just ended
+            if rdy and app_en.value == 1:
+                if app_cmd.value == CMD_READ:
+                    self.accept_read(int(app_addr.value))
+                elif wdf_rdy and app_wdf_wren.value == 1:
+                    self.accept_write(int(app_addr.value), int(dut.app_wdf_data.value),
+                                      resolved_mask(dut.app_wdf_mask))
+
+            # read response for the next cycle
+            if responses and responses[0][0] <= self.cycle:
+                (_, data) = responses.popleft()
+                rd_data.value = data
+                if not valid:
+                    rd_valid.value = 1
+                    rd_end.value = 1
+                    valid = True
+                if (debug):
+                    print("[mig] response {:032x}".format(data))
+            elif valid:
+                rd_valid.value = 0
+                rd_end.value = 0
+                valid = False
+
+            # backpressure for the next cycle
+            self.cycle += 1
+            next_rdy = self.rdy_schedule[self.cycle % period]
+            if timing is not None and timing.refreshing(self.cycle):
+                next_rdy = False
+            next_wdf_rdy = self.wdf_rdy_schedule[self.cycle % period]
+            if next_rdy != rdy:
+                dut.app_rdy.value = int(next_rdy)
+                rdy = next_rdy
+            if next_wdf_rdy != wdf_rdy:
+                dut.app_wdf_rdy.value = int(next_wdf_rdy)
+                wdf_rdy = next_wdf_rdy
+
+    def save_snapshot(self, path):
+        """ write memory, counters and outstanding read responses to `path` """
+        image = self.memory.to_image()
+        with open(path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.cycle, self.last_due, self.reads, self.writes,
+                                         self.read_latency_total, self.seed,
+                                         len(self.responses), len(image.segments)))
+            for (due, data) in self.responses:
+                f.write(RESPONSE_HEADER.pack(due))
+                f.write(data.to_bytes(CHUNK_BYTES, "little"))
+            for (addr, data) in image.segments:
+                f.write(SEGMENT_HEADER.pack(addr, len(data) // CHUNK_BYTES))
+                f.write(data)
+        print("[mig] snapshot at cycle {}: {} chunks, {} responses pending -> {}".format(
+            self.cycle, len(image), len(self.responses), path))
+
+    async def snapshot_at(self, clk, cycle, path):
+        """ save a snapshot once this model reaches `cycle` """
+        while self.cycle < cycle:
+            await RisingEdge(clk)
+        self.save_snapshot(path)
+
+    def report(self):
+        print("[mig] {} reads, {} writes over {} cycles, average read latency {:.1f} cycles".format(
+            self.reads, self.writes, self.cycle,
+            self.read_latency_total / self.reads if self.reads else 0))
+        if self.timing is not None:
+            self.timing.report()
+
+def load_snapshot(path, memory=None, responses=False, **kwargs):
+    """ a MigModel continuing from a save_snapshot() file; kwargs go to MigModel.
+
+    The cycle count, backpressure schedule position and read counters carry on
+    from the snapshot, so timing stays reproducible. Pending read responses are
+    only restored with responses=True: a processor starting from reset never
+    asked for them.
+    """
+    with open(path, "rb") as f:
+        blob = f.read()
+    (magic, cycle, last_due, reads, writes, latency_total, seed, pending, count) = \
+        SNAPSHOT_HEADER.unpack_from(blob, 0)
+    assert magic == SNAPSHOT_MAGIC, "{}: not a MIG snapshot".format(path)
+    offset = SNAPSHOT_HEADER.size
+    queued = []
+    for _ in range(pending):
+        (due,) = RESPONSE_HEADER.unpack_from(blob, offset)
+        offset += RESPONSE_HEADER.size
+        queued.append((due, int.from_bytes(blob[offset:offset+CHUNK_BYTES], "little")))
+        offset += CHUNK_BYTES
+    memory = PagedMemory() if memory is None else memory
+    for _ in range(count):
+        (addr, chunks) = SEGMENT_HEADER.unpack_from(blob, offset)
+        offset += SEGMENT_HEADER.size
+        memory.load(addr, blob[offset:offset + chunks*CHUNK_BYTES])
+        offset += chunks*CHUNK_BYTES
+
+    kwargs.setdefault("seed", seed)
+    mig = MigModel(memory, **kwargs)
+    mig.cycle = cycle
+    mig.reads = reads
+    mig.writes = writes
+    mig.read_latency_total = latency_total
+    if responses:
+        mig.responses.extend(queued)
+        mig.last_due = last_due
+    print("[mig] restored {} at cycle {}".format(path, cycle))
+    return mig
+
+def load_frame(memory, filename, addr=CAMERA_FB_ADDR):
+    """ put a camera frame (1280x720 P5/P6, or a raw RGB565 dump) in the framebuffer """
+    from framebuf import camera_bytes
+    memory.load(addr, camera_bytes(filename))
+
+async def simulate_mig(dut,memory,**kwargs):
+    """ run a MigModel over `memory` forever; kwargs go to MigModel """
+    mig = MigModel(memory,**kwargs)
+    await mig.run(dut)
 
 
 @cocotb.test()
@@ -165,5 +354,22 @@ async def test_migsim(dut):
     dut.app_en.value = 0
     await Timer(200,units="ns")
 
-    for addr in memory:
-        print("[{:07x}]: {:032x}".format(addr,int.from_bytes(memory[addr],"big")))
+    for addr in (0x100 >> 3, 0x200 >> 3):
+        print("[{:07x}]: {:032x}".format(addr,memory.read_int(addr)))
+    print("{} pages allocated ({} bytes)".format(len(memory.pages),memory.footprint()))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="build a MIG snapshot without simulating: program image plus a camera frame")
+    parser.add_argument("snapshot")
+    parser.add_argument("--image", default="mem.vmh", help="program .hex/.vmh")
+    parser.add_argument("--frame", help="camera frame to preload at CAMERA_FB_ADDR")
+    parser.add_argument("--from", dest="base", help="start from this snapshot instead of an empty memory")
+    args = parser.parse_args()
+
+    mig = load_snapshot(args.base) if args.base else MigModel(PagedMemory(), seed=0)
+    mig.memory.load_image(load_image(args.image))
+    if args.frame:
+        load_frame(mig.memory, args.frame)
+    mig.save_snapshot(args.snapshot)
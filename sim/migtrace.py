@@ -0,0 +1,240 @@
+""" migtrace: compact binary trace of MIG commands, and replay of a trace
+
+A trace holds one record per command the MIG accepted: ui_clk cycle, cmd,
+chunk address, 128-bit data (writes), write mask and issuing traffic_merger
+channel (-1 if unknown). Records are buffered in preallocated column arrays
+and flushed a chunk at a time, so recording costs a few list stores per
+command instead of a print.
+
+File layout (little-endian):
+  MAGIC
+  repeated blocks: uint32 record count, then each column in COLUMNS order,
+                   `count` items of that column's type back to back
+
+Replay:
+ * replay_model(): straight into a MigModel, no simulator -- for iterating on
+   the memory model (DDR3Timing, latency) against a captured run
+ * TraceReplay: regenerates each channel's command/data streams and drives
+   them into traffic_merger, at the recorded timing or as fast as possible
+
+    python migtrace.py trace.bin [--timing] [--asap]
+prints a summary, and with --timing replays into MigModel with DDR3Timing.
+"""
+
+import cocotb
+from cocotb.triggers import ClockCycles
+from cocotb.utils import get_sim_time
+from array import array
+import struct
+import sys
+
+from axis import AxisSource, AxisSink
+from mig import CMD_READ, CMD_WRITE, CLOCK_PERIOD_NS
+from structs import channel_updates
+
+MAGIC = b"MIGTRC01"
+
+# (name, array typecode)
+COLUMNS = [
+    ("cycle", "Q"),
+    ("cmd", "B"),
+    ("channel", "b"),
+    ("addr", "I"),    # 128-bit chunk address (app_addr >> 3)
+    ("mask", "H"),
+    ("data_lo", "Q"),
+    ("data_hi", "Q"),
+]
+CHUNK_RECORDS = 1 << 16
+MASK64 = (1 << 64) - 1
+
+
+class TraceRecorder:
+    """ collects MIG commands; pass as MigModel(trace=...) or call record() directly """
+
+    def __init__(self, path, channel=None, chunk=CHUNK_RECORDS):
+        self.path = path
+        self.channel = channel # signal holding the issuing channel, e.g. dut.tg.current_channel
+        self.chunk = chunk
+        self.columns = {name: array(code, [0]) * chunk for (name, code) in COLUMNS}
+        self.count = 0
+        self.total = 0
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+
+    def record(self, cycle, cmd, addr, data=0, mask=0):
+        n = self.count
+        columns = self.columns
+        columns["cycle"][n] = cycle
+        columns["cmd"][n] = cmd
+        columns["channel"][n] = -1 if self.channel is None else int(self.channel.value)
+        columns["addr"][n] = addr
+        columns["mask"][n] = mask
+        columns["data_lo"][n] = data & MASK64
+        columns["data_hi"][n] = data >> 64
+        self.count = n + 1
+        if self.count == self.chunk:
+            self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        self.file.write(struct.pack("<I", self.count))
+        for (name, _) in COLUMNS:
+            column = self.columns[name][:self.count]
+            if sys.byteorder == "big":
+                column.byteswap()
+            column.tofile(self.file)
+        self.total += self.count
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        print("[trace] {} MIG commands -> {}".format(self.total, self.path))
+
+
+def read_trace(path):
+    """ the whole trace as {column name: array} """
+    columns = {name: array(code) for (name, code) in COLUMNS}
+    with open(path, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC, "{}: not a MIG trace".format(path)
+        while True:
+            header = f.read(4)
+            if not header:
+                break
+            (count,) = struct.unpack("<I", header)
+            for (name, code) in COLUMNS:
+                block = array(code)
+                block.fromfile(f, count)
+                if sys.byteorder == "big":
+                    block.byteswap()
+                columns[name].extend(block)
+    return columns
+
+def records(trace):
+    """ (cycle, cmd, channel, addr, data, mask) per command """
+    for (cycle, cmd, channel, addr, mask, lo, hi) in zip(*(trace[name] for (name, _) in COLUMNS)):
+        yield (cycle, cmd, channel, addr, (hi << 64) | lo, mask)
+
+def transactions(trace):
+    """ per channel: [(first cycle, is_read, addr, [write data])], merging runs of
+    same-direction commands to consecutive chunks into one channel_update """
+    channels = {}
+    for (cycle, cmd, channel, addr, data, _) in records(trace):
+        script = channels.setdefault(channel, [])
+        is_read = cmd == CMD_READ
+        if script:
+            (_, last_read, last_addr, payload, length) = script[-1]
+            if last_read == is_read and addr == last_addr + length:
+                if not is_read:
+                    payload.append(data)
+                script[-1][4] += 1
+                continue
+        script.append([cycle, is_read, addr, [] if is_read else [data], 1])
+    return {channel: [(cycle, is_read, addr, payload if not is_read else length)
+                      for (cycle, is_read, addr, payload, length) in script]
+            for (channel, script) in channels.items()}
+
+def summary(trace):
+    count = len(trace["cycle"])
+    if not count:
+        return "empty trace"
+    reads = sum(trace["cmd"])
+    span = trace["cycle"][-1] - trace["cycle"][0] + 1
+    channels = sorted(set(trace["channel"]))
+    return "{} commands ({} reads, {} writes) over {} cycles = {:.3f} commands/cycle, channels {}".format(
+        count, reads, count - reads, span, count / span, channels)
+
+
+def replay_model(trace, mig, timed=True):
+    """ apply every command to `mig` (a MigModel) without a simulator; returns the cycle count.
+    timed keeps the recorded cycles, otherwise commands go one per cycle """
+    first = trace["cycle"][0] if len(trace["cycle"]) else 0
+    for (n, (cycle, cmd, _, addr, data, mask)) in enumerate(records(trace)):
+        mig.cycle = (cycle - first) if timed else n
+        while mig.responses and mig.responses[0][0] <= mig.cycle:
+            mig.responses.popleft()
+        if cmd == CMD_READ:
+            mig.accept_read(addr << 3)
+        else:
+            mig.accept_write(addr << 3, data, mask)
+    return mig.cycle + 1
+
+
+class TraceReplay:
+    """ drives a trace's per-channel transactions into traffic_merger
+
+    Each channel gets an AxisSource for commands/write data and an AxisSink for
+    read responses. timed=True holds every transaction until its recorded cycle
+    (relative to the first command); timed=False queues them all at once.
+    Commands recorded without a channel (-1) replay on channel 0.
+    """
+
+    def __init__(self, dut, trace, timed=True, period_ns=CLOCK_PERIOD_NS):
+        self.dut = dut
+        self.timed = timed
+        self.period_ns = period_ns
+        self.scripts = transactions(trace)
+        self.first = trace["cycle"][0] if len(trace["cycle"]) else 0
+        self.sources = {}
+        self.sinks = {}
+        for channel in self.scripts:
+            index = max(channel, 0)
+            self.sources[channel] = AxisSource(dut.clk_in, dut.write_axis_valid[index], dut.write_axis_ready[index],
+                                               dut.write_axis_data[index], dut.write_axis_tuser[index],
+                                               name="replay channel %d" % index)
+            self.sinks[channel] = AxisSink(dut.clk_in, dut.read_axis_valid[index], dut.read_axis_ready[index],
+                                           dut.read_axis_data[index], dut.read_axis_tuser[index])
+
+    async def run_channel(self, channel):
+        source = self.sources[channel]
+        sink = self.sinks[channel]
+        script = self.scripts[channel]
+        commands = channel_updates([addr for (_, _, addr, _) in script],
+                                   [payload if is_read else 0 for (_, is_read, _, payload) in script],
+                                   [0 if is_read else 1 for (_, is_read, _, _) in script])
+        for ((start, is_read, addr, payload), command) in zip(script, commands):
+            delay = start - self.first - self.elapsed()
+            if self.timed and delay > 0:
+                await ClockCycles(self.dut.clk_in, delay)
+            if is_read:
+                source.append(command, tuser=1)
+                for _ in range(payload):
+                    await sink.recv()
+            else:
+                source.append(command, tuser=1)
+                for data in payload:
+                    source.append(data)
+                if self.timed:
+                    await source.wait()
+        await source.wait()
+
+    def elapsed(self):
+        return round((get_sim_time("ns") - self.start_ns) / self.period_ns)
+
+    async def run(self):
+        """ replay everything; returns the cycles it took """
+        self.start_ns = get_sim_time("ns")
+        tasks = [cocotb.start_soon(self.run_channel(channel)) for channel in self.scripts]
+        for task in tasks:
+            await task
+        return self.elapsed()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="summarize a MIG trace, optionally replay it into MigModel")
+    parser.add_argument("trace")
+    parser.add_argument("--timing", action="store_true", help="replay into MigModel with DDR3Timing")
+    parser.add_argument("--asap", action="store_true", help="one command per cycle instead of the recorded timing")
+    args = parser.parse_args()
+
+    trace = read_trace(args.trace)
+    print(summary(trace))
+    if args.timing:
+        from memstore import PagedMemory
+        from mig import MigModel, DDR3Timing
+        mig = MigModel(PagedMemory(), seed=0, timing=DDR3Timing())
+        cycles = replay_model(trace, mig, timed=not args.asap)
+        print("replayed over {} cycles".format(cycles))
+        mig.report()
@@ -0,0 +1,87 @@
+""" parse_asm_model: reference model of hdl/parse_asm.sv
+
+Fed the UART byte stream one byte at a time, it produces the AXI-Stream beats
+parse_asm should send to traffic_merger, as (tuser, 128-bit data) tuples:
+ * ASC/CHUNK: the first byte of a frame picks the frame type, the next 16 are
+   the little-endian payload
+ * ADDR ('@'): one tuser beat carrying a channel_update {addr, stream_length 0, wen 1}
+ * DATA ('[', or any other symbol): one data beat per chunk, repeated if a '*'
+   frame set a count
+ * REPEAT ('*') and BAUD ('%') produce no beats
+The model assumes the host paces frames the way processor_port does, i.e. a
+repeated chunk drains before the next frame completes.
+"""
+
+from memimage import ADDR_MASK, FRAME_BYTES
+from structs import CHANNEL_UPDATE, channel_updates
+
+ASC = 0
+CHUNK = 1
+
+ADDR = 0
+DATA = 1
+REPEAT = 2
+BAUD = 3
+
+SYMBOLS = {ord("@"): ADDR, ord("*"): REPEAT, ord("%"): BAUD}
+
+
+class ParseAsmModel:
+    """ byte-at-a-time model of the parse_asm state machine """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lstate = ASC
+        self.fstate = ADDR
+        self.payload = bytearray()
+        self.repeat = 1
+        self.baud_periods = [] # every '%' request, in order
+
+    def feed(self, byte):
+        """ take one UART byte, return the list of beats it completes """
+        if self.lstate == ASC:
+            self.fstate = SYMBOLS.get(byte, DATA)
+            self.payload = bytearray()
+            self.lstate = CHUNK
+            return []
+        self.payload.append(byte)
+        if len(self.payload) < FRAME_BYTES - 1:
+            return []
+        self.lstate = ASC
+        value = int.from_bytes(self.payload, 'little')
+        if self.fstate == ADDR:
+            self.repeat = 1
+            return [(1, channel_updates((value & ADDR_MASK) >> 2)[0])]
+        if self.fstate == DATA:
+            (count, self.repeat) = (self.repeat, 1)
+            return [(0, value)] * count
+        if self.fstate == REPEAT:
+            self.repeat = max(value & 0xFFFFFFFF, 1)
+        else:
+            self.baud_periods.append(value & 0xFFFF)
+        return []
+
+    def feed_bytes(self, data):
+        beats = []
+        for byte in data:
+            beats += self.feed(byte)
+        return beats
+
+
+def expected_beats(buf):
+    """ every beat parse_asm sends for an upload stream, from reset """
+    return ParseAsmModel().feed_bytes(buf)
+
+def apply_beats(beats, memory=None):
+    """ DDR contents (chunk address -> 128-bit value) traffic_merger writes for `beats` """
+    memory = {} if memory is None else memory
+    addr = None
+    for (tuser, data) in beats:
+        if tuser:
+            addr = CHANNEL_UPDATE.field(data, "addr")
+        else:
+            memory[addr] = data
+            addr += 1
+    return memory
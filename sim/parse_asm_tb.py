@@ -1,38 +1,94 @@
 import cocotb
-from cocotb.triggers import RisingEdge, Timer, FallingEdge
+from cocotb.triggers import RisingEdge, ClockCycles
 from cocotb.utils import get_sim_time
+from collections import deque
+import glob
+import json
+import os
 import random
+import subprocess
+import time
 
-async def generate_clock(dut):
-    """ generate clock pulses """
-    while True:
-        dut.clk_in.value = 0
-        await Timer(5,units="ns")
-        dut.clk_in.value = 1
-        await Timer(5,units="ns")
+from memimage import load_image, RLE_MAX_RUN
+from parse_asm_model import ParseAsmModel
+from structs import CHANNEL_UPDATE
+from axis import start_clock, reset, handshake, AxisMonitor
 
-async def reset(dut):
-    dut.rst_in.value = 1
-    await Timer(10,units="ns")
-    dut.rst_in.value = 0
-    await Timer(10,units="ns")
+HEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "util", "hex")
+SCOREBOARD_DEPTH = 2*RLE_MAX_RUN # beats the model may run ahead of the DUT
 
-def cmd_assent(ready,valid):
-    return (ready.value == 1 and valid.value == 1)
+# benchmark mode: PARSE_ASM_BENCH=1 make ... (BENCH_READY / BENCH_HEX / BENCH_OUT optional)
+BENCH = os.environ.get("PARSE_ASM_BENCH") is not None
+BENCH_OUT = os.environ.get("BENCH_OUT", "parse_asm_bench.jsonl")
 
 async def print_axis_assents(dut):
     while True:
         await RisingEdge(dut.clk_in)
-        if( cmd_assent( dut.axis_ready, dut.axis_valid ) ):
+        if( handshake( dut.axis_valid, dut.axis_ready ) ):
             print( "axis command: [%d]%032x" % (dut.axis_tuser.value, dut.axis_data.value) )
 
+async def record_ddr(dut,memory):
+    """ apply accepted AXIS beats to `memory` the way traffic_merger writes them to DDR """
+    addr = None
+    while True:
+        await RisingEdge(dut.clk_in)
+        if( handshake( dut.axis_valid, dut.axis_ready ) ):
+            data = int(dut.axis_data.value)
+            if (dut.axis_tuser.value == 1):
+                addr = CHANNEL_UPDATE.field(data, "addr")
+            else:
+                memory[addr] = data
+                addr += 1
+
+class Scoreboard:
+    """ beats predicted by ParseAsmModel from the bytes sent, checked against the DUT as they come out """
+
+    def __init__(self, depth=SCOREBOARD_DEPTH):
+        self.model = ParseAsmModel()
+        self.expected = deque()
+        self.depth = depth
+        self.matched = 0
+
+    def sent(self, byte):
+        self.expected.extend(self.model.feed(byte))
+        assert len(self.expected) <= self.depth, \
+            "{} beats outstanding: parse_asm stopped producing output".format(len(self.expected))
+
+    def check(self, beat):
+        assert self.expected, "unexpected beat #{}: [{}]{:032x}".format(self.matched, *beat)
+        want = self.expected.popleft()
+        assert beat == want, "beat #{}: got [{}]{:032x}, expected [{}]{:032x}".format(
+            self.matched, beat[0], beat[1], want[0], want[1])
+        self.matched += 1
+
+    def done(self):
+        assert not self.expected, "{} expected beats never arrived".format(len(self.expected))
+
+async def score_axis(dut,scoreboard):
+    while True:
+        await RisingEdge(dut.clk_in)
+        if( handshake( dut.axis_valid, dut.axis_ready ) ):
+            scoreboard.check( (int(dut.axis_tuser.value), int(dut.axis_data.value)) )
+
+async def drain(dut):
+    """ wait for parse_asm to hand off its last beat """
+    await RisingEdge(dut.clk_in)
+    while (dut.axis_valid.value == 1):
+        await RisingEdge(dut.clk_in)
+    await RisingEdge(dut.clk_in)
+
+async def random_ready(dut):
+    while True:
+        await RisingEdge(dut.clk_in)
+        dut.axis_ready.value = int(random.random() > 0.3)
+
 async def send_byte(dut,byte):
+    """ valid_fbyte for one rising edge, then 2-5 idle cycles (call right after an edge) """
     dut.valid_fbyte.value = 1
     dut.fbyte.value = byte
-    await Timer(10,units='ns')
+    await RisingEdge(dut.clk_in)
     dut.valid_fbyte.value = 0
-    cycles_wait = random.randint(2,5)
-    await Timer(10*cycles_wait,units='ns')
+    await ClockCycles(dut.clk_in, random.randint(2,5))
 
 def transmit_addr_print( addr ):
     print("@%x" % addr)
@@ -45,26 +101,28 @@ def transmit_chunk_print( chunk ):
         out_string += "{:08x}".format(word)
     print(out_string)
 
-async def write(dut,byteobject):
+async def write(dut,byteobject,scoreboard=None):
     # ser.write(byteobject)
     for byte in byteobject:
+        if scoreboard is not None:
+            scoreboard.sent(byte)
         await send_byte(dut,byte)
         # print("%02x" % byte)
     
-async def transmit_addr(dut, addr ):
+async def transmit_addr(dut, addr, scoreboard=None ):
     symbol = "@".encode('utf-8')
-    await write(dut, symbol)
+    await write(dut, symbol, scoreboard)
     addr_bytes = addr.to_bytes(16, 'little')
-    await write(dut, addr_bytes)
+    await write(dut, addr_bytes, scoreboard)
     # transmit_addr_print( addr )
 
-async def transmit_chunk(dut, chunk ):
+async def transmit_chunk(dut, chunk, scoreboard=None ):
     symbol = "[".encode('utf-8')
-    await write(dut, symbol)
+    await write(dut, symbol, scoreboard)
     for i in range(4):
         word = chunk[i] if (i < len(chunk)) else 0
         word_bytes = word.to_bytes(4,'little')
-        await write(dut, word_bytes)
+        await write(dut, word_bytes, scoreboard)
     # transmit_chunk_print( chunk )
     
 
@@ -75,11 +133,12 @@ async def test_with_file(dut):
     dut.axis_ready.value = 0
     dut.valid_fbyte.value = 0
     dut.fbyte.value = 0
-    await cocotb.start( generate_clock(dut) )
-    await reset(dut)
-    await cocotb.start( print_axis_assents(dut) )
+    start_clock(dut.clk_in)
+    await reset(dut.clk_in, dut.rst_in)
+    scoreboard = Scoreboard()
+    await cocotb.start( score_axis(dut,scoreboard) )
     dut.axis_ready.value = 1
-    await Timer(20,units='ns')
+    await ClockCycles(dut.clk_in, 2)
     
     with open("mem.vmh",mode="r") as vmhfile:
         lines = vmhfile.readlines()
@@ -89,19 +148,201 @@ async def test_with_file(dut):
             if '@' in line:
                 print ("@ in line")
                 if current_chunk:
-                    await transmit_chunk(dut, current_chunk)
+                    await transmit_chunk(dut, current_chunk, scoreboard)
                     current_chunk = []
                     current_index = 0
                 addr = int(line[1:].strip(),16)
-                await transmit_addr( dut, addr )
+                await transmit_addr( dut, addr, scoreboard )
             else:
                 current_chunk.append( int(line.strip(), 16) )
                 current_index = (current_index + 1) % 4
                 if (current_index == 0):
-                    await transmit_chunk(dut, current_chunk)
+                    await transmit_chunk(dut, current_chunk, scoreboard)
                     current_chunk = []
         if (current_chunk):
-            await transmit_chunk(dut, current_chunk)
-    
-        
+            await transmit_chunk(dut, current_chunk, scoreboard)
+    await drain(dut)
+    scoreboard.done()
+    print("{} beats matched the model".format(scoreboard.matched))
+
+
+async def upload(dut,buf,scoreboard=None):
+    """ send a framed upload stream; after a '*' run, wait for the repeats to drain
+    (the real UART link is ~1700 cycles/byte, far slower than a run drains) """
+    for i in range(0,len(buf),17):
+        await write(dut, buf[i:i+17], scoreboard)
+        if (i >= 17 and buf[i-17] == ord('*')):
+            await RisingEdge(dut.clk_in)
+            while (dut.axis_valid.value == 1):
+                await RisingEdge(dut.clk_in)
+
+@cocotb.test()
+async def test_rle_matches_raw(dut):
+    """ RLE-encoded and raw uploads of the same image leave identical DDR contents """
+
+    image = load_image("mem.vmh")
+    image.segments.append((0x900, bytearray(16*40)))                 # zero fill
+    image.segments.append((0x980, bytearray(bytes(range(16))*24)))  # repeated pattern
+    expected = {addr: int.from_bytes(chunk,'little') for (addr,chunk) in image.chunks()}
+
+    dut.axis_ready.value = 0
+    dut.valid_fbyte.value = 0
+    dut.fbyte.value = 0
+    start_clock(dut.clk_in)
+    await cocotb.start( random_ready(dut) )
+
+    results = []
+    for rle in (False, True):
+        await reset(dut.clk_in, dut.rst_in)
+        memory = {}
+        monitor = await cocotb.start( record_ddr(dut,memory) )
+        buf = image.frames(rle)
+        await upload(dut, buf)
+        await drain(dut)
+        monitor.kill()
+        print("rle={}: {} bytes on the wire, {} chunks written".format(rle,len(buf),len(memory)))
+        results.append(memory)
+
+    assert results[0] == expected
+    assert results[1] == results[0]
+
+@cocotb.test()
+async def test_hex_regression(dut):
+    """ every program in util/hex, raw and RLE-encoded, checked beat by beat against the model """
+
+    dut.axis_ready.value = 0
+    dut.valid_fbyte.value = 0
+    dut.fbyte.value = 0
+    start_clock(dut.clk_in)
+    await cocotb.start( random_ready(dut) )
+
+    for filename in sorted(glob.glob(os.path.join(HEX_DIR, "*.hex"))) + ["mem.vmh"]:
+        image = load_image(filename)
+        for rle in (False, True):
+            await reset(dut.clk_in, dut.rst_in)
+            scoreboard = Scoreboard()
+            monitor = await cocotb.start( score_axis(dut,scoreboard) )
+            await upload(dut, image.frames(rle), scoreboard)
+            await drain(dut)
+            monitor.kill()
+            scoreboard.done()
+            print("{} rle={}: {} beats matched".format(os.path.basename(filename),rle,scoreboard.matched))
+
+@cocotb.test()
+async def test_repeat_behind_stalled_beat(dut):
+    """ a '*' frame completing while the previous chunk still waits on axis_ready repeats
+    the next chunk, not the stalled one """
+
+    dut.axis_ready.value = 0
+    dut.valid_fbyte.value = 0
+    dut.fbyte.value = 0
+    start_clock(dut.clk_in)
+    await reset(dut.clk_in, dut.rst_in)
+    scoreboard = Scoreboard()
+    monitor = await cocotb.start( score_axis(dut,scoreboard) )
+
+    await write(dut, b"@" + (0x100).to_bytes(16,'little'), scoreboard)
+    dut.axis_ready.value = 1
+    await drain(dut)
+    dut.axis_ready.value = 0 # ddr_fifo full: the next chunk is held
+    await write(dut, b"[" + (0x1111).to_bytes(16,'little'), scoreboard)
+    await write(dut, b"*" + (5).to_bytes(16,'little'), scoreboard)
+    assert dut.axis_valid.value == 1, "the first chunk should still be waiting"
+    dut.axis_ready.value = 1
+    await drain(dut)
+    await write(dut, b"[" + (0x2222).to_bytes(16,'little'), scoreboard)
+    await drain(dut)
+    monitor.kill()
+    scoreboard.done()
+    assert scoreboard.matched == 7, "{} beats, expected 1 command + 1 + 5".format(scoreboard.matched)
+
+
+# axis_ready backpressure patterns for the benchmark: cycle number -> ready
+READY_PATTERNS = {
+    "always": lambda cycle: 1,
+    "alternate": lambda cycle: cycle & 1,
+    "random70": lambda cycle: int(random.random() < 0.7),
+    "burst32of64": lambda cycle: int((cycle % 64) >= 32), # 32 cycles stalled in every 64
+    "fifo_progfull": lambda cycle: int((cycle % 512) >= 12), # 12 stalled cycles in every 512
+}
+
+async def drive_ready(dut,pattern):
+    cycle = 0
+    while True:
+        dut.axis_ready.value = pattern(cycle)
+        await RisingEdge(dut.clk_in)
+        cycle += 1
+
+async def blast(dut,buf,scoreboard,stats):
+    """ one byte per cycle; the last byte of a frame is held while parse_asm still holds
+    an unaccepted beat (it would overwrite it), which is counted as a stall cycle """
+    i = 0
+    while i < len(buf):
+        if (i % 17 == 16 and dut.axis_valid.value == 1):
+            dut.valid_fbyte.value = 0
+            stats["stall_cycles"] += 1
+        else:
+            scoreboard.sent(buf[i])
+            dut.valid_fbyte.value = 1
+            dut.fbyte.value = buf[i]
+            i += 1
+        await RisingEdge(dut.clk_in)
+        stats["cycles"] += 1
+    dut.valid_fbyte.value = 0
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@cocotb.test(skip=not BENCH)
+async def test_throughput_benchmark(dut):
+    """ back-to-back bytes under each axis_ready pattern; results appended to BENCH_OUT as one JSON line """
+
+    hexfile = os.environ.get("BENCH_HEX", os.path.join(HEX_DIR, "dither.hex"))
+    patterns = os.environ.get("BENCH_READY", ",".join(READY_PATTERNS)).split(",")
+    image = load_image(hexfile)
+
+    dut.axis_ready.value = 0
+    dut.valid_fbyte.value = 0
+    dut.fbyte.value = 0
+    start_clock(dut.clk_in)
+
+    runs = []
+    for name in patterns:
+        for rle in (False, True):
+            buf = image.frames(rle)
+            await reset(dut.clk_in, dut.rst_in)
+            stats = {"cycles": 0, "stall_cycles": 0}
+            scoreboard = Scoreboard()
+            ready = await cocotb.start( drive_ready(dut,READY_PATTERNS[name]) )
+            axis = AxisMonitor(dut.clk_in, dut.axis_valid, dut.axis_ready, name="axis")
+            monitors = [await cocotb.start( score_axis(dut,scoreboard) ), axis.task]
+            wall_start = time.perf_counter()
+            sim_start = get_sim_time(units="us")
+            await blast(dut,buf,scoreboard,stats)
+            await drain(dut)
+            wall = time.perf_counter() - wall_start
+            sim_us = get_sim_time(units="us") - sim_start
+            for task in monitors + [ready]:
+                task.kill()
+            scoreboard.done()
+            stats["beats"] = axis.stats.beats
+            stats["backpressure_cycles"] = axis.stats.stall_cycles
+            run = dict(stats, ready=name, rle=rle, bytes=len(buf),
+                       bytes_per_cycle=len(buf) / stats["cycles"],
+                       sim_us=sim_us, wall_s=wall, wall_s_per_sim_us=wall / sim_us)
+            print("{ready:>14} rle={rle:d}: {bytes} bytes in {cycles} cycles, {bytes_per_cycle:.3f} B/cycle, "
+                  "{stall_cycles} stalls, {backpressure_cycles} backpressure, "
+                  "{wall_s_per_sim_us:.4f} s wall per sim us".format(**run))
+            runs.append(run)
 
+    record = {"bench": "parse_asm", "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "revision": git_revision(), "simulator": cocotb.SIM_NAME,
+              "simulator_version": cocotb.SIM_VERSION, "hexfile": os.path.basename(hexfile),
+              "runs": runs}
+    with open(BENCH_OUT, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print("results appended to {}".format(BENCH_OUT))
@@ -0,0 +1,175 @@
+""" proc_bench: every util/hex workload on every core in processors/, through proc_context_tb
+
+usage: python proc_bench.py [--procs kiranv_blu,kmorhun_mini] [--workloads hello,grayscale,edge,dither]
+                            [--jobs 4] [--max-cycles N] [--frame frame.ppm] [--check]
+                            [--sim icarus] [--out proc_bench]
+
+Each core is built once into sim_build/proc_<core>; each (core, workload) run
+gets its own directory under it for results, logs and waves, so runs go out as
+parallel simulator processes (--jobs at a time) without sharing any files.
+Reported per run: ui_clk cycles to processor_done, DDR reads and writes (MIG
+commands), UART bytes and simulator wall time, as a table and in <out>.json /
+<out>.csv. With --check, each workload's UART output is first computed on
+util/rvsim and every core's output must match it. Both start from the same
+memory: the image, --frame if given, and the MIG model's 0xAB fill
+everywhere else (the camera framebuffer included when there's no --frame).
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+
+from cocotb.runner import get_runner
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(SIM_DIR, "..")
+HDL_DIR = os.path.join(ROOT_DIR, "hdl")
+UTIL_DIR = os.path.join(ROOT_DIR, "util")
+PROCESSORS_DIR = os.path.join(ROOT_DIR, "processors")
+HEX_DIR = os.path.join(UTIL_DIR, "hex")
+WORKLOADS = ["hello", "grayscale", "edge", "dither"]
+
+CSV_FIELDS = ["proc", "workload", "finished", "matches", "cycles", "reads", "writes", "uart_bytes",
+              "wall_s", "process_s"]
+
+
+def cores():
+    """ every design under processors/ (a directory with a proc_bridge.sv) """
+    return sorted(name for name in os.listdir(PROCESSORS_DIR)
+                  if os.path.exists(os.path.join(PROCESSORS_DIR, name, "proc_bridge.sv")))
+
+def sources(proc):
+    """ the same file list sim/Makefile uses, with processors/<proc> in place of hdl/proc """
+    proc_dir = os.path.join(PROCESSORS_DIR, proc)
+    verilog = sorted(os.path.join(proc_dir, name) for name in os.listdir(proc_dir) if name.endswith(".v"))
+    return ([os.path.join(SIM_DIR, "memorytb_top.sv"), os.path.join(proc_dir, "proc_bridge.sv"),
+             os.path.join(HDL_DIR, "cursor.sv")] + verilog + [os.path.join(HDL_DIR, "traffic_merger.sv")])
+
+def build_dir(proc):
+    return os.path.join(SIM_DIR, "sim_build", "proc_" + proc)
+
+def build(args, proc):
+    runner = get_runner(args.sim)
+    runner.build(verilog_sources=sources(proc), hdl_toplevel="memorytb_top",
+                 build_dir=build_dir(proc), always=True,
+                 log_file=os.path.join(build_dir(proc) + ".build.log"))
+
+def golden(args, workload):
+    """ UART output of `workload` on rvsim, written next to the builds. rvsim fills unloaded
+    memory with memstore.FILL_BYTE, as generate_memory does for the RTL runs, so programs
+    reading the framebuffer without --frame see the same 0xAB bytes in both """
+    os.makedirs(os.path.join(SIM_DIR, "sim_build"), exist_ok=True)
+    path = os.path.join(SIM_DIR, "sim_build", "golden_{}.bin".format(workload))
+    command = [sys.executable, os.path.join(UTIL_DIR, "rvsim.py"), os.path.join(HEX_DIR, workload + ".hex"), path]
+    if args.frame:
+        command += ["--image", args.frame]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return path
+
+def run(args, proc, workload, golden_path):
+    """ one proc_context_tb run in its own directory; returns its result record """
+    test_dir = os.path.join(build_dir(proc), workload)
+    os.makedirs(test_dir, exist_ok=True)
+    result_path = os.path.join(test_dir, "result.jsonl")
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    env = {"PROC": proc, "MEM_IMAGE": os.path.join(HEX_DIR, workload + ".hex"), "PROC_RESULT": result_path,
+           "PYTHONPATH": os.pathsep.join([SIM_DIR, UTIL_DIR, os.environ.get("PYTHONPATH", "")])}
+    if args.max_cycles:
+        env["PROC_MAX_CYCLES"] = str(args.max_cycles)
+    if args.frame:
+        env["MIG_FRAME"] = os.path.abspath(args.frame)
+    if golden_path:
+        env["UART_GOLDEN"] = golden_path
+
+    runner = get_runner(args.sim)
+    start = time.perf_counter()
+    record = {"proc": proc, "workload": workload, "finished": False}
+    try:
+        results_xml = runner.test(test_module="proc_context_tb", hdl_toplevel="memorytb_top",
+                                  build_dir=build_dir(proc), test_dir=test_dir, extra_env=env,
+                                  log_file=os.path.join(test_dir, "sim.log"))
+    except subprocess.CalledProcessError as e:
+        record["error"] = str(e) # the simulator itself failed; see sim.log
+        results_xml = None
+    record["process_s"] = time.perf_counter() - start
+
+    if os.path.exists(result_path):
+        with open(result_path) as f:
+            record.update(json.loads(f.readlines()[-1]))
+        record["workload"] = workload
+    if golden_path and record["finished"] and results_xml is not None:
+        # the test fails on a mismatch; results.xml says whether it did
+        with open(results_xml) as f:
+            record["matches"] = "<failure" not in f.read()
+    return record
+
+def print_table(records):
+    """ one row per (workload, core), fastest core per workload marked """
+    columns = ["workload", "proc", "cycles", "reads", "writes", "uart_bytes", "wall_s"]
+    best = {}
+    for record in records:
+        if record["finished"]:
+            workload = record["workload"]
+            best[workload] = min(best.get(workload, record["cycles"]), record["cycles"])
+    rows = []
+    for record in sorted(records, key=lambda r: (WORKLOADS.index(r["workload"]) if r["workload"] in WORKLOADS
+                                                  else len(WORKLOADS), r["proc"])):
+        cycles = str(record.get("cycles", "-")) if record["finished"] else ">{}".format(record.get("cycles", "?"))
+        if record["finished"] and record["cycles"] == best[record["workload"]]:
+            cycles += " *"
+        if record.get("error"):
+            cycles = "simulator failed"
+        if record.get("matches") is False:
+            cycles += " (output differs)"
+        rows.append([record["workload"], record["proc"], cycles, str(record.get("reads", "-")),
+                     str(record.get("writes", "-")), str(record.get("uart_bytes", "-")),
+                     "{:.1f}".format(record.get("wall_s", record["process_s"]))])
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for (i, column) in enumerate(columns)]
+    print("  ".join(column.ljust(width) for (column, width) in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(cell.ljust(width) for (cell, width) in zip(row, widths)))
+    print("(* fewest cycles for the workload; >N: no processor_done within N cycles)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare processors/ cores on the util/hex workloads")
+    parser.add_argument("--procs", default=",".join(cores()), help="comma-separated designs under processors/")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="comma-separated util/hex programs")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="simulator processes at a time")
+    parser.add_argument("--max-cycles", type=int, help="stop a run that hasn't finished after this many ui_clk cycles")
+    parser.add_argument("--frame", help="camera frame to preload (1280x720 P5/P6 or raw RGB565)")
+    parser.add_argument("--check", action="store_true", help="compare UART output with util/rvsim's")
+    parser.add_argument("--sim", default=os.environ.get("SIM", "icarus"))
+    parser.add_argument("--out", default="proc_bench", help="output basename for .json and .csv")
+    args = parser.parse_args()
+    procs = args.procs.split(",")
+    workloads = args.workloads.split(",")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        goldens = {workload: pool.submit(golden, args, workload) if args.check else None for workload in workloads}
+        for future in [pool.submit(build, args, proc) for proc in procs]:
+            future.result()
+        goldens = {workload: (future.result() if future else None) for (workload, future) in goldens.items()}
+        futures = [pool.submit(run, args, proc, workload, goldens[workload])
+                   for workload in workloads for proc in procs]
+        records = [future.result() for future in futures]
+    wall = time.perf_counter() - start
+
+    print_table(records)
+    print("{} runs in {:.1f}s (sum of simulator processes {:.1f}s)".format(
+        len(records), wall, sum(record["process_s"] for record in records)))
+    with open(args.out + ".json", "w") as f:
+        json.dump(records, f, indent=1)
+    with open(args.out + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+    print("wrote {0}.json, {0}.csv".format(args.out))
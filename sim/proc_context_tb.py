@@ -1,27 +1,64 @@
 import cocotb
 from cocotb.triggers import RisingEdge, Timer, FallingEdge
 from cocotb.utils import get_sim_time
+import json
+import os
 import random
+import time
 
-from mig import simulate_mig, generate_memory
+from mig import MigModel, DDR3Timing, generate_memory, load_snapshot, load_frame, CLOCK_PERIOD_NS
+from axis import AxisMonitor, LatencyLink
+from migtrace import TraceRecorder
+from memprofile import MemoryProfile, default_regions
+from memimage import load_image
 
-async def reset(reset):
-    reset.value = 1
-    await Timer(10,units="ns")
-    reset.value = 0
-    await Timer(10,units="ns")
+# MEM_IMAGE=<file> runs another program than mem.vmh (e.g. ../util/hex/edge.hex)
+MEM_IMAGE = os.environ.get("MEM_IMAGE", "mem.vmh")
+# PROC_MAX_CYCLES=<n> gives up on a processor that hasn't finished after n ui_clk cycles
+PROC_MAX_CYCLES = os.environ.get("PROC_MAX_CYCLES")
+# PROC_RESULT=<file> appends one JSON line of run figures (see proc_bench.py); PROC names the core in it
+PROC_RESULT = os.environ.get("PROC_RESULT")
 
-def cmd_assent(valid,ready):
-    return (valid.value == 1 and ready.value == 1)
+# MIG_TIMING=1 adds DDR3 row/bank/refresh timing to the memory model
+MIG_TIMING = os.environ.get("MIG_TIMING", "0") == "1"
+# MIG_TRACE=<file> records every MIG command (replay with channel_merger_tb / migtrace.py)
+MIG_TRACE = os.environ.get("MIG_TRACE")
+# MIG_PROFILE=<file> writes a per-region DDR access profile (code / data / framebuffer, see memprofile.py)
+MIG_PROFILE = os.environ.get("MIG_PROFILE")
 
+# MIG_RESTORE=<file> starts from a MIG snapshot instead of MEM_IMAGE (make one with python mig.py);
+# MIG_FRAME=<image> puts a camera frame in the framebuffer first
+MIG_RESTORE = os.environ.get("MIG_RESTORE")
+MIG_FRAME = os.environ.get("MIG_FRAME")
+# MIG_SNAPSHOT=<file> saves one when the processor finishes, or at MIG_SNAPSHOT_CYCLE
+MIG_SNAPSHOT = os.environ.get("MIG_SNAPSHOT")
+MIG_SNAPSHOT_CYCLE = os.environ.get("MIG_SNAPSHOT_CYCLE")
+# FRAME_OUT=<file.ppm> saves the framebuffer at CAMERA_FB_ADDR when the processor finishes
+# (FRAME_PACKING=gray for the low-byte grayscale view, see util/framebuf.py)
+FRAME_OUT = os.environ.get("FRAME_OUT")
+FRAME_PACKING = os.environ.get("FRAME_PACKING", "rgb565")
 
-async def handle_mmio(dut):
+# UART_GOLDEN=<file> checks the program's UART output against it (e.g. from util/rvsim.py mem.vmh <file>)
+UART_GOLDEN = os.environ.get("UART_GOLDEN")
+# UART_BAUD=<rate> holds uart_tx_ready low for as long as uart_transmitter takes per byte at that rate
+# (10 bit periods and its IDLE cycle at 100 MHz), instead of a flat 1000 ns
+UART_BAUD = int(os.environ.get("UART_BAUD", "0"))
+UART_BYTE_NS = (10 * (100_000_000 // UART_BAUD) + 1) * CLOCK_PERIOD_NS if UART_BAUD else 1000
+
+async def handle_mmio(dut, uart=None, timeout_ns=None):
+    """ acknowledge UART bytes (appending them to `uart`) until the processor finishes;
+    False if it hasn't by sim time `timeout_ns` """
     dut.uart_tx_ready.value = 1
     while True:
         await RisingEdge(dut.ui_clk)
+        if timeout_ns is not None and get_sim_time("ns") > timeout_ns:
+            print("[PY] no exit after {} ns".format(timeout_ns))
+            return False
         if (dut.uart_tx_valid.value == 1):
             dut.uart_tx_ready.value = 0
-            await Timer(1000,units="ns")
+            if uart is not None:
+                uart.append(int(dut.uart_tx_data.value))
+            await Timer(UART_BYTE_NS,units="ns")
             dut.uart_tx_ready.value = 1
             print("[PY] uart byte: %x" % dut.uart_tx_data.value)
         if (dut.processor_done == 1):
@@ -32,15 +69,61 @@ async def handle_mmio(dut):
 async def test_a(dut):
     """ give memory responses via python input """
 
-    memory = generate_memory('mem.vmh')
+    trace = TraceRecorder(MIG_TRACE, channel=dut.tg.current_channel) if MIG_TRACE else None
+    profile = MemoryProfile(default_regions(load_image(MEM_IMAGE))) if MIG_PROFILE else None
+    mig_args = dict(timing=DDR3Timing() if MIG_TIMING else None, trace=trace, profile=profile)
+    if MIG_RESTORE:
+        mig = load_snapshot(MIG_RESTORE, **mig_args)
+    else:
+        mig = MigModel(generate_memory(MEM_IMAGE), **mig_args)
+    if MIG_FRAME:
+        load_frame(mig.memory, MIG_FRAME)
     
-    await cocotb.start( simulate_mig(dut,memory) )
+    await cocotb.start( mig.run(dut) )
+    if MIG_SNAPSHOT and MIG_SNAPSHOT_CYCLE:
+        cocotb.start_soon( mig.snapshot_at(dut.ui_clk, int(MIG_SNAPSHOT_CYCLE), MIG_SNAPSHOT) )
+
+    # processor <-> traffic_merger streams inside memorytb_top
+    req = AxisMonitor(dut.ui_clk, dut.req_axis_valid, dut.req_axis_ready,
+                      dut.req_axis_data, dut.req_axis_tuser, name="proc req")
+    resp = AxisMonitor(dut.ui_clk, dut.resp_axis_valid, dut.resp_axis_ready,
+                       dut.resp_axis_data, dut.resp_axis_tuser, name="proc resp")
+    # a read command (tuser beat, wen clear) is answered by 4 response beats
+    read_latency = LatencyLink(req, resp, downstream_beats=4, name="proc read latency",
+                               starts=lambda data,tuser: tuser == 1 and (data & 1) == 0)
     dut.rst_in.value = 0
     await Timer(10,units="ns")
     dut.rst_in.value = 1
     await Timer(30,units="ns")
     dut.rst_in.value = 0
     
-    await handle_mmio(dut)
+    uart = bytearray()
+    wall_start = time.perf_counter()
+    timeout_ns = get_sim_time("ns") + int(PROC_MAX_CYCLES) * CLOCK_PERIOD_NS if PROC_MAX_CYCLES else None
+    finished = await handle_mmio(dut, uart, timeout_ns)
+    wall = time.perf_counter() - wall_start
+    if trace is not None:
+        trace.close()
+    mig.report()
+    if MIG_SNAPSHOT and not MIG_SNAPSHOT_CYCLE:
+        mig.save_snapshot(MIG_SNAPSHOT)
+    if FRAME_OUT:
+        import framebuf # numpy, only needed here
+        framebuf.save(FRAME_OUT, framebuf.frame_from_memory(mig.memory, packing=FRAME_PACKING))
+    if profile is not None:
+        profile.report()
+        profile.write(MIG_PROFILE)
+    req.stats.report()
+    resp.stats.report()
+    read_latency.report()
+    if PROC_RESULT:
+        with open(PROC_RESULT, "a") as f:
+            f.write(json.dumps({"proc": os.environ.get("PROC"), "image": MEM_IMAGE, "finished": finished,
+                                "cycles": mig.cycle, "reads": mig.reads, "writes": mig.writes,
+                                "uart_bytes": len(uart), "wall_s": wall}) + "\n")
+    if UART_GOLDEN and finished:
+        with open(UART_GOLDEN, "rb") as f:
+            golden = f.read()
+        assert bytes(uart) == golden, "UART output {!r} differs from {} ({!r})".format(bytes(uart), UART_GOLDEN, golden)
 
                 
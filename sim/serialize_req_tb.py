@@ -1,62 +1,93 @@
 import cocotb
 from cocotb.triggers import RisingEdge, Timer, FallingEdge
 from cocotb.utils import get_sim_time
-import random
+import os
 
-async def generate_clock(dut):
-    """ generate clock pulses """
-    while True:
-        dut.clk_in.value = 0
-        await Timer(5,units="ns")
-        dut.clk_in.value = 1
-        await Timer(5,units="ns")
-
-async def reset(dut):
-    dut.rst_in.value = 1
-    await Timer(10,units="ns")
-    dut.rst_in.value = 0
-    await Timer(10,units="ns")
-
-def cmd_assent(valid,ready):
-    return (valid.value == 1 and ready.value == 1)
-
-async def deliver_value(clk,valid,ready,wire,data):
-    valid.value = 1
-    wire.value = data
-    await RisingEdge(clk)
-    while (not cmd_assent(valid,ready)):
-        await Timer(10,units="ns")
-    await FallingEdge(clk)
-    wire.value = 0
-    valid.value = 0
+import numpy as np
+
+from axis import start_clock, reset, AxisSource, AxisMonitor, LatencyLink
+from structs import MAIN_MEM_REQ, req_beats
+
+# SERIALIZE_REQ_COUNT=<n> random requests for test_random_reqs, from SERIALIZE_REQ_SEED
+SERIALIZE_REQ_COUNT = int(os.environ.get("SERIALIZE_REQ_COUNT", "2000"))
+SERIALIZE_REQ_SEED = int(os.environ.get("SERIALIZE_REQ_SEED", "1"))
 
 def pack_req(write,addr,data):
-    return (write << 538) + (addr << 512) + data
+    return MAIN_MEM_REQ(write=write, addr=addr, data=data)
 
-async def print_successes(dut):
-    while True:
-        await RisingEdge(dut.clk_in)
-        if (cmd_assent(dut.req_axis_ready,dut.req_axis_valid)):
-            print("successful delivery at %dns, of data 0x%x and tuser %d"%(get_sim_time('ns'),dut.req_axis_data.value,dut.req_axis_tuser.value))
+def print_success(now,data,tuser):
+    print("successful delivery at %dns, of data 0x%x and tuser %d"%(now,data,tuser))
             
 
 @cocotb.test()
 async def test_a(dut):
     """ basic serializing test, ensure proper waveform behavior esp on ready/valids """
-    dut.getMReq_en.value = 0
+    dut.getMReq_rdy.value = 0
     dut.getMReq_data.value = 0
     dut.req_axis_ready.value = 0
 
-    await cocotb.start( generate_clock(dut) )
-    await reset(dut)
-    await cocotb.start( print_successes(dut) )
+    start_clock(dut.clk_in)
+    await reset(dut.clk_in, dut.rst_in)
+    source = AxisSource(dut.clk_in, dut.getMReq_rdy, dut.getMReq_en, dut.getMReq_data, name="getMReq")
+    monitor = AxisMonitor(dut.clk_in, dut.req_axis_valid, dut.req_axis_ready,
+                          dut.req_axis_data, dut.req_axis_tuser, name="req_axis")
+    monitor.on_beat(print_success)
+    # a write goes out as a command beat + 4 data beats
+    latency = LatencyLink(source, monitor, downstream_beats=5, name="write latency",
+                          starts=lambda data,tuser: MAIN_MEM_REQ.field(data, "write") == 1)
 
     dut.req_axis_ready.value = 1
-    await deliver_value(dut.clk_in,dut.getMReq_en,dut.getMReq_rdy,dut.getMReq_data, pack_req(1,0x304,0x1210))
+    await source.send(pack_req(1,0x304,0x1210))
     await Timer(30,units="ns")
     dut.req_axis_ready.value = 0
     await Timer(20,units="ns")
     dut.req_axis_ready.value = 1
     await Timer(30,units="ns")
-    await deliver_value(dut.clk_in,dut.getMReq_en,dut.getMReq_rdy,dut.getMReq_data, pack_req(0,0x305,0))
+    await source.send(pack_req(0,0x305,0))
     await Timer(50,units="ns")
+
+    # back to back writes, no gaps on either side
+    for i in range(8):
+        source.append(pack_req(1,0x400+i,i))
+    await source.wait()
+    await Timer(100,units="ns")
+
+    source.stats.report()
+    monitor.stats.report()
+    latency.report()
+
+
+async def random_ready(clk, ready, rng, p=0.7):
+    while True:
+        await RisingEdge(clk)
+        ready.value = int(rng.random() < p)
+
+@cocotb.test()
+async def test_random_reqs(dut):
+    """ random reads and writes under random backpressure; req_axis must carry exactly req_beats() """
+    dut.getMReq_rdy.value = 0
+    dut.getMReq_data.value = 0
+    dut.req_axis_ready.value = 0
+
+    start_clock(dut.clk_in)
+    await reset(dut.clk_in, dut.rst_in)
+    rng = np.random.default_rng(SERIALIZE_REQ_SEED)
+    reqs = MAIN_MEM_REQ.random(rng, SERIALIZE_REQ_COUNT)
+    source = AxisSource(dut.clk_in, dut.getMReq_rdy, dut.getMReq_en, dut.getMReq_data, name="getMReq")
+    monitor = AxisMonitor(dut.clk_in, dut.req_axis_valid, dut.req_axis_ready,
+                          dut.req_axis_data, dut.req_axis_tuser, name="req_axis", record=True)
+    cocotb.start_soon(random_ready(dut.clk_in, dut.req_axis_ready, rng))
+
+    for value in MAIN_MEM_REQ.encode(reqs):
+        source.append(value)
+    expected = req_beats(reqs)
+    await source.wait()
+    while len(monitor.beats) < len(expected):
+        await RisingEdge(dut.clk_in)
+
+    source.stats.report()
+    monitor.stats.report()
+    wrong = [i for (i, (got, want)) in enumerate(zip(monitor.beats, expected)) if got != want]
+    assert not wrong, "beat {} of {}: got {}, expected {}".format(
+        wrong[0], len(expected), monitor.beats[wrong[0]], expected[wrong[0]])
+    print("[PY] {} requests, {} beats match".format(len(reqs), len(expected)))
@@ -0,0 +1,187 @@
+""" structs: the packed SystemVerilog structs testbenches drive and check, packed/unpacked in bulk
+
+A Layout lists a struct's fields MSB first, exactly as its typedef does, and
+converts between
+ * numpy structured arrays, one record per transaction (fields up to 64 bits
+   are plain unsigned ints, wider ones little-endian uint64 words, word 0 the
+   least significant)
+ * packed rows: (n, bytes) uint8, little-endian, ready for int.from_bytes
+ * the Python ints cocotb puts on and reads off a bus
+Packing goes through one bit matrix per batch, so a few hundred thousand
+random requests encode in well under a second with no per-field Python
+arithmetic; layout(**fields) / layout.fields(value) are the scalar forms for
+directed tests.
+
+    reqs = MAIN_MEM_REQ.random(rng, 100_000)
+    for value in MAIN_MEM_REQ.encode(reqs): source.append(value)
+    expected = req_beats(reqs)  # what serialize_req should put on req_axis
+    commands = channel_updates(addrs, lengths, wens)  # traffic_merger command beats
+    assert first_mismatch(read_data, expected_chunks) is None  # checked as putMResp lines
+"""
+
+import numpy as np
+
+BATCH = 1 << 16 # rows per bit matrix
+
+
+def field_dtype(width):
+    for size in (1, 2, 4, 8):
+        if width <= 8 * size:
+            return np.dtype("<u{}".format(size))
+    return np.dtype(("<u8", (width + 63) // 64))
+
+
+class Layout:
+    """ one packed struct: `fields` is [(name, width)], MSB first """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.width = sum(width for (_, width) in fields)
+        self.nbytes = (self.width + 7) // 8
+        self.mask = (1 << self.width) - 1
+        self.dtype = np.dtype([(field, field_dtype(width)) for (field, width) in fields])
+        self.fields_lsb = {}
+        lsb = self.width
+        for (field, width) in fields:
+            lsb -= width
+            self.fields_lsb[field] = (lsb, width)
+
+    def __repr__(self):
+        return "Layout({}, {} bits)".format(self.name, self.width)
+
+    # ---- scalar ----
+
+    def __call__(self, **values):
+        """ the packed int for one struct; missing fields are 0, oversized ones truncate like SV """
+        value = 0
+        for (field, amount) in values.items():
+            (lsb, width) = self.fields_lsb[field]
+            value |= (int(amount) & ((1 << width) - 1)) << lsb
+        return value
+
+    def field(self, value, field):
+        (lsb, width) = self.fields_lsb[field]
+        return (value >> lsb) & ((1 << width) - 1)
+
+    def fields(self, value):
+        """ {field: int} of one packed int """
+        return {field: self.field(value, field) for field in self.fields_lsb}
+
+    # ---- bulk ----
+
+    def array(self, count):
+        return np.zeros(count, dtype=self.dtype)
+
+    def random(self, rng, count):
+        """ `count` records of uniformly random field values (rng: numpy Generator) """
+        records = self.array(count)
+        for (field, (_, width)) in self.fields_lsb.items():
+            raw = rng.integers(0, 256, size=(count, records.dtype[field].itemsize), dtype=np.uint8)
+            bits = np.unpackbits(raw, axis=1, bitorder="little")
+            bits[:, width:] = 0
+            records[field] = np.packbits(bits, axis=1, bitorder="little").view(records.dtype[field].base).reshape(
+                records[field].shape)
+        return records
+
+    def pack(self, records):
+        """ structured array -> (n, nbytes) uint8 packed rows """
+        out = np.empty((len(records), self.nbytes), dtype=np.uint8)
+        for start in range(0, len(records), BATCH):
+            batch = records[start:start + BATCH]
+            bits = np.zeros((len(batch), self.nbytes * 8), dtype=np.uint8)
+            for (field, (lsb, width)) in self.fields_lsb.items():
+                raw = np.ascontiguousarray(batch[field]).view(np.uint8).reshape(len(batch), -1)
+                bits[:, lsb:lsb + width] = np.unpackbits(raw, axis=1, bitorder="little")[:, :width]
+            out[start:start + len(batch)] = np.packbits(bits, axis=1, bitorder="little")
+        return out
+
+    def unpack(self, packed):
+        """ (n, nbytes) uint8 packed rows -> structured array """
+        packed = np.asarray(packed, dtype=np.uint8).reshape(-1, self.nbytes)
+        records = self.array(len(packed))
+        for start in range(0, len(packed), BATCH):
+            bits = np.unpackbits(packed[start:start + BATCH], axis=1, bitorder="little")
+            for (field, (lsb, width)) in self.fields_lsb.items():
+                dtype = records.dtype[field]
+                piece = np.zeros((len(bits), dtype.itemsize * 8), dtype=np.uint8)
+                piece[:, :width] = bits[:, lsb:lsb + width]
+                values = np.packbits(piece, axis=1, bitorder="little").view(dtype.base)
+                records[field][start:start + len(bits)] = values.reshape(records[field][start:start + len(bits)].shape)
+        return records
+
+    def to_ints(self, packed):
+        data = np.ascontiguousarray(packed, dtype=np.uint8).tobytes()
+        n = self.nbytes
+        return [int.from_bytes(data[i:i + n], "little") for i in range(0, len(data), n)]
+
+    def from_ints(self, values):
+        n = self.nbytes
+        mask = self.mask
+        data = b"".join((value & mask).to_bytes(n, "little") for value in values)
+        return np.frombuffer(data, dtype=np.uint8).reshape(-1, n)
+
+    def encode(self, records):
+        """ structured array -> list of packed ints, for AxisSource.append """
+        return self.to_ints(self.pack(records))
+
+    def decode(self, values):
+        """ packed ints (e.g. a monitor's recorded data) -> structured array """
+        return self.unpack(self.from_ints(values))
+
+
+# traffic_merger.sv / parse_asm.sv: the command a TUSER beat carries
+CHANNEL_UPDATE = Layout("channel_update", [("addr", 27), ("stream_length", 27), ("wen", 1)])
+# proc_bridge.sv: the cache's getMReq line request (26-bit line address, 4 chunks of data)
+MAIN_MEM_REQ = Layout("main_mem_req", [("write", 1), ("addr", 26), ("data", 512)])
+# proc_bridge.sv: putMResp, a line as 4 chunks of response data
+MAIN_MEM_RESP = Layout("main_mem_resp", [("data", 512)])
+
+LINE_CHUNKS = 4
+CHUNK_BYTES = 16
+
+
+def line_chunks(records, field="data"):
+    """ a 512-bit field as 4 chunk ints per record, lowest chunk first (the order beats go out) """
+    data = np.ascontiguousarray(records[field]).view(np.uint8).tobytes()
+    return [int.from_bytes(data[i:i + CHUNK_BYTES], "little") for i in range(0, len(data), CHUNK_BYTES)]
+
+def channel_updates(addr, stream_length=0, wen=1):
+    """ packed channel_update ints, one per element of `addr`; scalars broadcast, oversized
+    values truncate like SV """
+    values = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=np.int64)) for v in (addr, stream_length, wen)))
+    commands = CHANNEL_UPDATE.array(len(values[0]))
+    for ((field, (_, width)), value) in zip(CHANNEL_UPDATE.fields_lsb.items(), values):
+        commands[field] = value & ((1 << width) - 1)
+    return CHANNEL_UPDATE.encode(commands)
+
+def req_beats(reqs):
+    """ the (tuser, data) beats serialize_req sends on req_axis for MAIN_MEM_REQ records: a
+    channel_update for the line's 4 chunks, then the chunks themselves for a write """
+    commands = channel_updates(reqs["addr"].astype(np.int64) << 2, LINE_CHUNKS, reqs["write"])
+    chunks = line_chunks(reqs)
+    beats = []
+    for (i, write) in enumerate(reqs["write"].tolist()):
+        beats.append((1, commands[i]))
+        if write:
+            beats.extend((0, chunk) for chunk in chunks[LINE_CHUNKS * i:LINE_CHUNKS * (i + 1)])
+    return beats
+
+def responses(chunks):
+    """ putMResp records from 128-bit response chunk ints, 4 per line, lowest first; a
+    partial last line is zero-padded """
+    chunks = list(chunks)
+    chunks += [0] * (-len(chunks) % LINE_CHUNKS)
+    data = b"".join(chunk.to_bytes(CHUNK_BYTES, "little") for chunk in chunks)
+    return MAIN_MEM_RESP.unpack(np.frombuffer(data, dtype=np.uint8))
+
+def first_mismatch(got, expected):
+    """ index of the first chunk where two response chunk streams differ, None if they match """
+    (got, expected) = (responses(got)["data"], responses(expected)["data"])
+    if len(got) != len(expected):
+        return LINE_CHUNKS * min(len(got), len(expected))
+    lines = np.flatnonzero((got != expected).any(axis=1))
+    if not len(lines):
+        return None
+    line = lines[0]
+    words = np.flatnonzero(got[line] != expected[line])[0] # 64-bit words, 2 per chunk
+    return LINE_CHUNKS * line + words // 2
@@ -0,0 +1,143 @@
+import cocotb
+from cocotb.triggers import RisingEdge, ClockCycles, with_timeout
+from cocotb.result import SimTimeoutError
+
+from memimage import frame_addr, frame_chunk, frame_baud
+from axis import start_clock, reset, AxisMonitor
+from structs import channel_updates
+
+# uart_baud_top defaults: 1Mbaud at 100MHz, 20000-cycle confirmation window
+DEFAULT_PERIOD = 100
+CONFIRM_CYCLES = 20_000
+FAST_PERIOD = 20
+ACK = 0x25
+
+def idle_inputs(dut):
+    dut.host_tx.value = 1
+    dut.proc_tx_valid.value = 0
+    dut.proc_tx_data.value = 0
+    dut.axis_ready.value = 1
+
+async def host_send(dut,data,period):
+    """ bit-bang bytes onto host_tx, `period` clock cycles per bit """
+    for byte in data:
+        for bit in [0] + [(byte >> i) & 1 for i in range(8)] + [1]:
+            dut.host_tx.value = bit
+            await ClockCycles(dut.clk_in, period)
+
+async def host_receive(dut,period):
+    """ one byte from host_rx, sampled mid-bit at `period`; returns (byte, start bit length in cycles) """
+    while dut.host_rx.value == 1:
+        await RisingEdge(dut.clk_in)
+    # time the start bit: every byte checked here has bit 0 set, so it ends on a rising edge
+    start_cycles = 0
+    while dut.host_rx.value == 0:
+        await RisingEdge(dut.clk_in)
+        start_cycles += 1
+    await ClockCycles(dut.clk_in, period//2)
+    byte = 0
+    for i in range(8):
+        if i > 0:
+            await ClockCycles(dut.clk_in, period)
+        byte |= int(dut.host_rx.value) << i
+    await ClockCycles(dut.clk_in, period)
+    assert dut.host_rx.value == 1, "missing stop bit"
+    await ClockCycles(dut.clk_in, period//2)
+    return (byte, start_cycles)
+
+async def expect_ack(dut,period):
+    """ the ACK for a '%' frame that was just sent """
+    (byte, start_cycles) = await with_timeout(host_receive(dut,period), 30*period*10, "ns")
+    assert byte == ACK, "expected ACK, got {:02x}".format(byte)
+    assert start_cycles == period, "ACK sent with a {}-cycle bit period, expected {}".format(start_cycles,period)
+
+async def expect_no_ack(dut,period):
+    try:
+        await with_timeout(host_receive(dut,period), 30*period*10, "ns")
+    except SimTimeoutError:
+        return
+    assert False, "unexpected byte on host_rx"
+
+async def switch(dut,period,at):
+    await host_send(dut,frame_baud(period),at)
+
+async def check_loader(dut,period):
+    """ an '@' + '[' upload at `period` comes out of parse_asm intact """
+    monitor = AxisMonitor(dut.clk_in, dut.axis_valid, dut.axis_ready, dut.axis_data, dut.axis_tuser, record=True)
+    chunk = bytes(range(16))
+    await host_send(dut,frame_addr(0x40) + frame_chunk(chunk),period)
+    await ClockCycles(dut.clk_in, 10)
+    monitor.stop()
+    beats = monitor.beats
+    assert beats == [(1, channel_updates(0x40 >> 2)[0]), (0, int.from_bytes(chunk,'little'))], beats
+
+
+@cocotb.test()
+async def test_switch_and_confirm(dut):
+    """ ACK at the old rate, switch, confirm at the new rate; loader and processor output both run fast """
+    start_clock(dut.clk_in)
+    idle_inputs(dut)
+    await reset(dut.clk_in, dut.rst_in)
+    assert dut.period.value == DEFAULT_PERIOD
+
+    await switch(dut,FAST_PERIOD,DEFAULT_PERIOD)
+    await expect_ack(dut,DEFAULT_PERIOD)
+    await ClockCycles(dut.clk_in, 5)
+    assert dut.period.value == FAST_PERIOD
+
+    await switch(dut,FAST_PERIOD,FAST_PERIOD)
+    await expect_ack(dut,FAST_PERIOD)
+
+    # confirmed: outlives the confirmation window
+    await ClockCycles(dut.clk_in, CONFIRM_CYCLES + 100)
+    assert dut.period.value == FAST_PERIOD
+    await check_loader(dut,FAST_PERIOD)
+
+    # processor output goes out at the new rate too
+    receive = cocotb.start_soon(host_receive(dut,FAST_PERIOD))
+    dut.proc_tx_data.value = 0x5B
+    dut.proc_tx_valid.value = 1
+    await RisingEdge(dut.clk_in)
+    while dut.proc_tx_ready.value != 1:
+        await RisingEdge(dut.clk_in)
+    dut.proc_tx_valid.value = 0
+    (byte, start_cycles) = await receive
+    assert (byte, start_cycles) == (0x5B, FAST_PERIOD)
+
+@cocotb.test()
+async def test_unconfirmed_falls_back(dut):
+    """ a host that never confirms finds the board back at the default rate """
+    start_clock(dut.clk_in)
+    idle_inputs(dut)
+    await reset(dut.clk_in, dut.rst_in)
+
+    await switch(dut,FAST_PERIOD,DEFAULT_PERIOD)
+    await expect_ack(dut,DEFAULT_PERIOD)
+    await ClockCycles(dut.clk_in, 5)
+    assert dut.period.value == FAST_PERIOD
+
+    await ClockCycles(dut.clk_in, CONFIRM_CYCLES + 10)
+    assert dut.period.value == DEFAULT_PERIOD
+    await check_loader(dut,DEFAULT_PERIOD)
+
+@cocotb.test()
+async def test_revert_and_reject(dut):
+    """ period 0 returns to the default; a period below MIN_PERIOD is ignored """
+    start_clock(dut.clk_in)
+    idle_inputs(dut)
+    await reset(dut.clk_in, dut.rst_in)
+
+    await switch(dut,FAST_PERIOD,DEFAULT_PERIOD)
+    await expect_ack(dut,DEFAULT_PERIOD)
+    await switch(dut,FAST_PERIOD,FAST_PERIOD)
+    await expect_ack(dut,FAST_PERIOD)
+
+    await switch(dut,0,FAST_PERIOD)
+    await expect_ack(dut,FAST_PERIOD)
+    await ClockCycles(dut.clk_in, 5)
+    assert dut.period.value == DEFAULT_PERIOD
+
+    await switch(dut,8,DEFAULT_PERIOD)
+    await expect_no_ack(dut,DEFAULT_PERIOD)
+    assert dut.period.value == DEFAULT_PERIOD
+    await check_loader(dut,DEFAULT_PERIOD)
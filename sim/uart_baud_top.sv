@@ -0,0 +1,95 @@
+`timescale 1ns / 1ps
+`default_nettype none
+
+// the top_level UART path (uart_rcv -> parse_asm -> uart_baud -> uart_transmitter)
+// with a fast default rate and a short confirmation window, for uart_baud_tb
+module uart_baud_top
+  #(parameter BAUD_RATE = 1_000_000,
+    parameter CLOCK_SPEED = 100_000_000,
+    parameter CONFIRM_CYCLES = 20_000)
+  (
+   input wire 		clk_in,
+   input wire 		rst_in,
+
+   // host side of the serial link
+   input wire 		host_tx,
+   output logic 	host_rx,
+
+   // processor output
+   input wire [7:0] 	proc_tx_data,
+   input wire 		proc_tx_valid,
+   output logic 	proc_tx_ready,
+
+   // loader output
+   output logic 	axis_tuser,
+   output logic [127:0] axis_data,
+   input wire 		axis_ready,
+   output logic 	axis_valid,
+
+   output logic [15:0] 	period
+   );
+
+   logic 		uart_valid;
+   logic [7:0] 		uart_data;
+   logic 		switch_valid;
+   logic [15:0] 	switch_period;
+
+   logic [7:0] 		tx_data;
+   logic 		tx_valid;
+   logic 		tx_ready;
+
+   uart_rcv
+     #(.BAUD_RATE(BAUD_RATE),
+       .CLOCK_SPEED(CLOCK_SPEED))
+   urm
+     (.clk_in(clk_in),
+      .rst_in(rst_in),
+      .period_in(period),
+      .uart_rx(host_tx),
+      .valid_out(uart_valid),
+      .data_out(uart_data));
+
+   parse_asm pam
+     (.clk_in(clk_in),
+      .rst_in(rst_in),
+      .valid_fbyte(uart_valid),
+      .fbyte(uart_data),
+      .axis_tuser(axis_tuser),
+      .axis_data(axis_data),
+      .axis_ready(axis_ready),
+      .axis_valid(axis_valid),
+      .baud_valid(switch_valid),
+      .baud_period(switch_period));
+
+   uart_baud
+     #(.BAUD_RATE(BAUD_RATE),
+       .CLOCK_SPEED(CLOCK_SPEED),
+       .CONFIRM_CYCLES(CONFIRM_CYCLES))
+   ubaud
+     (.clk_in(clk_in),
+      .rst_in(rst_in),
+      .switch_valid(switch_valid),
+      .switch_period(switch_period),
+      .period_out(period),
+      .proc_tx_data(proc_tx_data),
+      .proc_tx_valid(proc_tx_valid),
+      .proc_tx_ready(proc_tx_ready),
+      .tx_data(tx_data),
+      .tx_valid(tx_valid),
+      .tx_ready(tx_ready));
+
+   uart_transmitter
+     #(.BAUD_RATE(BAUD_RATE),
+       .CLOCK_SPEED(CLOCK_SPEED))
+   utm
+     (.clk_in(clk_in),
+      .rst_in(rst_in),
+      .period_in(period),
+      .data_in(tx_data),
+      .valid_in(tx_valid),
+      .ready_in(tx_ready),
+      .uart_tx(host_rx));
+
+endmodule
+
+`default_nettype wire
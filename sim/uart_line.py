@@ -0,0 +1,131 @@
+""" uart_line: a serial-line UART monitor -- decodes bytes off a tx pin and measures the link's throughput
+
+The monitor never wakes on the clock: it waits for the falling edge of a start
+bit, then jumps by bit-period Timers to the middle of each bit (start, 8 data
+bits LSB first, stop), so a byte costs 11 wakeups however slow the baud rate.
+A start bit that isn't low at its middle is a glitch and is ignored; a low
+stop bit is a framing error (the byte is still reported, flagged), after
+which the monitor waits for the line to go idle again.
+
+Per byte it keeps the start edge time, so it reports
+ * achieved bytes/s over the whole capture against the line rate, 1/(10 bit
+   periods)
+ * idle gaps between one stop bit's end and the next start edge, in clock
+   cycles: back-to-back bytes from uart_transmitter are 1 cycle apart (its
+   IDLE state), anything longer is time the sender left the line unused
+
+    monitor = UartMonitor.for_params(dut.uart_tx, baud_rate=57600, clock_speed=100_000_000)
+    ...
+    assert monitor.data == expected and not monitor.errors
+    monitor.report()
+"""
+
+import cocotb
+from cocotb.triggers import Event, FallingEdge, RisingEdge, Timer
+from cocotb.utils import get_sim_time
+
+from axis import CLOCK_PERIOD_NS, Histogram
+
+FRAME_BITS = 10 # start + 8 data + stop
+
+
+class UartMonitor:
+    """ passive 8N1 decoder on one serial line, `period_cycles` clock cycles per bit """
+
+    def __init__(self, line, period_cycles, clock_period_ns=CLOCK_PERIOD_NS, name="uart"):
+        self.line = line
+        self.clock_period_ns = clock_period_ns
+        self.name = name
+        self.set_period(period_cycles)
+        self.data = bytearray()
+        self.starts = []  # start edge of each byte, ps
+        self.errors = []  # (index into data, start ps) of bytes with a low stop bit
+        self.glitches = 0
+        self.gaps = Histogram()
+        self.last_end = None
+        self.received = Event()
+        self.callbacks = []
+        self.task = cocotb.start_soon(self.run())
+
+    @classmethod
+    def for_params(cls, line, baud_rate, clock_speed, clock_period_ns=CLOCK_PERIOD_NS, name="uart"):
+        """ the bit period a uart_transmitter with these BAUD_RATE/CLOCK_SPEED parameters uses """
+        return cls(line, clock_speed // baud_rate, clock_period_ns, name)
+
+    def set_period(self, period_cycles):
+        """ change the bit period, e.g. after a '%' switch; applies from the next start bit """
+        self.period_cycles = period_cycles
+        self.period_ps = round(period_cycles * self.clock_period_ns * 1000)
+
+    def on_byte(self, callback):
+        """ callback(time_ns, byte, ok) for every byte, ok False on a framing error """
+        self.callbacks.append(callback)
+
+    async def run(self):
+        while True:
+            if self.line.value != 1:
+                await RisingEdge(self.line) # idle (or stuck low after a framing error)
+            await FallingEdge(self.line)
+            start = get_sim_time("ps")
+            period = self.period_ps
+            await Timer(period // 2, units="ps")
+            if self.line.value != 0:
+                self.glitches += 1
+                continue
+            byte = 0
+            for i in range(8):
+                await Timer(period, units="ps")
+                byte |= int(self.line.value) << i
+            await Timer(period, units="ps")
+            ok = self.line.value == 1
+            self.record(start, byte, ok)
+
+    def record(self, start, byte, ok):
+        if self.last_end is not None:
+            gap_ps = start - self.last_end
+            self.gaps.add(round(gap_ps / (self.clock_period_ns * 1000)))
+        self.last_end = start + FRAME_BITS * self.period_ps
+        if not ok:
+            self.errors.append((len(self.data), start))
+        self.data.append(byte)
+        self.starts.append(start)
+        self.received.set()
+        for callback in self.callbacks:
+            callback(start / 1000, byte, ok)
+
+    async def wait_bytes(self, count):
+        """ return once `count` bytes have been decoded in all """
+        while len(self.data) < count:
+            self.received.clear()
+            await self.received.wait()
+
+    def line_rate(self):
+        """ bytes/s the line carries with no gaps at the current bit period """
+        return 1e12 / (FRAME_BITS * self.period_ps)
+
+    def rate(self):
+        """ achieved bytes/s from the first start edge to the end of the last stop bit """
+        if not self.data:
+            return None
+        return len(self.data) * 1e12 / (self.last_end - self.starts[0])
+
+    def as_dict(self):
+        rate = self.rate()
+        return {"bytes": len(self.data), "framing_errors": len(self.errors), "glitches": self.glitches,
+                "period_cycles": self.period_cycles, "line_bytes_per_s": self.line_rate(),
+                "bytes_per_s": rate, "efficiency": rate / self.line_rate() if rate else None,
+                "gap_cycles": self.gaps.as_dict()}
+
+    def report(self):
+        stats = self.as_dict()
+        if not stats["bytes"]:
+            print("[{}] no bytes".format(self.name))
+            return
+        gaps = stats["gap_cycles"]
+        print("[{}] {} bytes, {} framing errors; {:.0f} B/s of {:.0f} B/s line rate ({:.1%}); "
+              "gaps min {} / p50 {} / max {} cycles".format(
+                  self.name, stats["bytes"], stats["framing_errors"], stats["bytes_per_s"],
+                  stats["line_bytes_per_s"], stats["efficiency"], gaps["min"], gaps["p50"], gaps["max"]))
+
+    def stop(self):
+        self.task.kill()
@@ -0,0 +1,323 @@
+""" virtual_board: the board's UART side on a pseudo-terminal, for testing processor_port without hardware
+
+    python virtual_board.py [--link /tmp/ttyARTY] [--reply output.bin | --run] [--check prog.hex]
+then   python processor_port.py prog.hex [out] --port /tmp/ttyARTY
+
+Behind the pty:
+ * received bytes go through ParseAsmModel and land in a PagedMemory, the way
+   parse_asm and traffic_merger load DDR
+ * both directions are paced at the current line rate (10 bits per byte), so
+   the host sees the throughput a real link gives it; reads stop while the
+   receive line is busy and the host's writes back up into the pty
+ * '%' frames follow uart_baud: an ACK at the old rate, then the new period,
+   reverting to BAUD unless confirmed at the new rate within CONFIRM_S.
+   While the host's port is set to a different rate than the board's (read
+   back from the pty's termios), bytes in both directions are lost, as
+   framing errors would lose them
+ * once the upload has gone quiet for --release seconds (the btn[2] press
+   that releases the processor), the board "runs": it plays back --reply
+   bytes ('#'-framed values, a netpbm image, ...) or, with --run, runs the
+   uploaded memory on util/rvsim. That image is PagedMemory.to_image(): every
+   page the upload touched, whole 64 KB pages with 0xAB fill around the
+   written chunks, all of it loaded as program data. It matches a plain
+   `rvsim.py prog.hex` only while rvsim's own fill is also 0xAB (its default;
+   not with --fill), and with --run any earlier upload's chunks stay in place
+
+Each upload and each run prints exact bytes on the wire and the line time
+they took, from the first byte to the end of the last one's stop bit. The
+host's own figures also include the pty's buffer (a few KB the kernel accepts
+before the board has read it), so for short uploads trust the board's.
+"""
+
+import argparse
+import json
+import os
+import select
+import termios
+import threading
+import time
+import tty
+
+from memimage import load_image
+from memstore import PagedMemory
+from parse_asm_model import ParseAsmModel, SYMBOLS, ASC, ADDR, DATA, REPEAT, BAUD as BAUD_FRAME
+from structs import CHANNEL_UPDATE
+
+BAUD = 57600             # rate out of reset
+SYS_CLK_HZ = 100_000_000 # uart_baud CLOCK_SPEED
+MIN_PERIOD = 16
+CONFIRM_S = 0.5          # uart_baud CONFIRM_CYCLES
+ACK = b"%"
+POLL_S = 0.01
+RELEASE_S = 0.3
+FRAME_NAMES = {ADDR: "addr", DATA: "data", REPEAT: "repeat", BAUD_FRAME: "baud"}
+
+# termios speed constants back to rates, for noticing a host on the wrong rate
+TERMIOS_RATES = {getattr(termios, "B%d" % rate): rate
+                 for rate in (9600, 19200, 38400, 57600, 115200, 230400, 460800, 500000, 576000,
+                              921600, 1000000, 1152000, 1500000, 2000000, 2500000, 3000000, 3500000, 4000000)
+                 if hasattr(termios, "B%d" % rate)}
+
+
+class LinkStats:
+    """ bytes and wall-clock time of one direction of one transfer """
+
+    def __init__(self):
+        self.bytes = 0
+        self.lost = 0
+        self.first = None
+        self.last = None
+        self.frames = {name: 0 for name in FRAME_NAMES.values()}
+        self.chunks = 0
+
+    def add(self, count, start, end):
+        """ `count` bytes on the line from `start` until `end` """
+        if self.first is None:
+            self.first = start
+        self.last = end
+        self.bytes += count
+
+    def elapsed(self):
+        return (self.last - self.first) if self.first is not None else 0.0
+
+    def as_dict(self, baud):
+        elapsed = self.elapsed()
+        return {"bytes": self.bytes, "lost": self.lost, "seconds": elapsed,
+                "bytes_per_s": self.bytes / elapsed if elapsed > 0 else None,
+                "line_bytes_per_s": baud / 10, "frames": dict(self.frames), "chunks": self.chunks}
+
+
+class VirtualBoard:
+    """ one pty, one model of the loader + UART + processor output """
+
+    def __init__(self, reply=None, run=False, release_s=RELEASE_S, check=None, stats_path=None):
+        (self.master, self.slave) = os.openpty()
+        tty.setraw(self.slave) # holding the slave open also keeps the master readable between host sessions
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self.slave)
+        self.reply = reply
+        self.run_program = run
+        self.release_s = release_s
+        self.check = check
+        self.stats_path = stats_path
+
+        self.model = ParseAsmModel()
+        self.memory = PagedMemory()
+        self.addr = 0
+        self.period = SYS_CLK_HZ // BAUD
+        self.default_period = self.period
+        self.pending = None   # confirmation deadline of an unconfirmed switch
+        self.rx_free = 0.0    # when the receive line can take the next byte
+        self.tx_free = 0.0
+        self.tx = bytearray() # processor output not yet on the wire
+        self.tx_lock = threading.Lock()
+        self.worker = None
+        self.upload = None    # LinkStats of the upload in progress
+        self.output = None
+        self.last_rx = None
+
+    def baud(self):
+        return SYS_CLK_HZ / self.period
+
+    def host_baud(self):
+        """ the rate the host set on its end, None if it isn't a standard one """
+        speed = termios.tcgetattr(self.slave)[4]
+        return TERMIOS_RATES.get(speed)
+
+    def in_step(self):
+        host = self.host_baud()
+        return host is None or abs(host - self.baud()) / self.baud() < 0.02
+
+    # ---- receive: loader ----
+
+    def receive(self, data, now):
+        if self.upload is None:
+            self.upload = LinkStats()
+        self.upload.add(len(data), now, self.rx_free)
+        self.last_rx = now
+        if not self.in_step():
+            self.upload.lost += len(data)
+            return
+        model = self.model
+        for byte in data:
+            if model.lstate == ASC:
+                self.upload.frames[FRAME_NAMES[SYMBOLS.get(byte, DATA)]] += 1
+            periods = len(model.baud_periods)
+            for (tuser, value) in model.feed(byte):
+                if tuser:
+                    self.addr = CHANNEL_UPDATE.field(value, "addr")
+                else:
+                    self.memory.write_int(self.addr, value)
+                    self.addr += 1
+                    self.upload.chunks += 1
+            if len(model.baud_periods) != periods:
+                self.switch(model.baud_periods[-1], time.monotonic())
+
+    def switch(self, period, now):
+        """ a '%' frame, as uart_baud handles it """
+        target = self.default_period if period == 0 else period
+        if target < MIN_PERIOD:
+            return
+        self.send_now(ACK) # at the current rate, ahead of any processor output
+        if target == self.period:
+            self.pending = None
+            print("[board] {:.0f} baud confirmed".format(self.baud()))
+            return
+        self.period = target
+        self.pending = None if target == self.default_period else now + CONFIRM_S
+        print("[board] switched to {:.0f} baud (period {}), awaiting confirmation".format(self.baud(), target))
+
+    def send_now(self, data):
+        if self.in_step():
+            self.write(data)
+        self.tx_free = max(self.tx_free, time.monotonic()) + len(data) * 10 / self.baud()
+
+    def write(self, data):
+        """ as much of `data` as the pty takes without blocking (nothing while the host isn't reading) """
+        try:
+            return os.write(self.master, data)
+        except BlockingIOError:
+            return 0
+
+    # ---- processor ----
+
+    def release(self):
+        """ the upload is done: report it, then start the processor's output """
+        stats = self.upload.as_dict(self.baud())
+        print("[board] upload: {bytes} bytes in {seconds:.3f}s = {rate} B/s of {line_bytes_per_s:.0f} line rate, "
+              "{chunks} chunks written, frames {frames}".format(
+                  rate="{:.0f}".format(stats["bytes_per_s"]) if stats["bytes_per_s"] else "-", **stats))
+        if stats["lost"]:
+            print("[board] {} bytes arrived at the wrong baud rate and were dropped".format(stats["lost"]))
+        if self.check is not None:
+            self.check_image(self.check)
+        self.log("upload", stats)
+        self.upload = None
+
+        self.output = LinkStats()
+        if self.reply is not None:
+            with open(self.reply, "rb") as f:
+                self.queue(f.read())
+        elif self.run_program:
+            self.worker = threading.Thread(target=self.simulate, daemon=True)
+            self.worker.start()
+
+    def simulate(self):
+        from rvsim import Machine
+        machine = Machine(self.memory.to_image(), uart=lambda byte: self.queue(bytes([byte])))
+        start = time.perf_counter()
+        halt = machine.run()
+        print("[board] program {} after {} instructions, {:.1f}s".format(
+            halt.reason if halt else "stopped", machine.instret, time.perf_counter() - start))
+
+    def queue(self, data):
+        with self.tx_lock:
+            self.tx += data
+
+    def transmit(self, now):
+        """ queued output, a poll interval's worth of line time at once """
+        if now < self.tx_free:
+            return
+        with self.tx_lock:
+            data = bytes(self.tx[:max(1, int(self.baud() / 10 * POLL_S))])
+        if not data:
+            return
+        if self.in_step():
+            count = self.write(data)
+        else:
+            count = len(data)
+            self.output.lost += count
+        with self.tx_lock:
+            del self.tx[:count]
+        start = max(self.tx_free, now)
+        self.tx_free = start + count * 10 / self.baud()
+        self.output.add(count, start, self.tx_free)
+
+    def finish_output(self):
+        stats = self.output.as_dict(self.baud())
+        print("[board] output: {bytes} bytes in {seconds:.3f}s".format(**stats))
+        self.log("output", stats)
+        self.output = None
+
+    # ---- reporting ----
+
+    def check_image(self, filename):
+        image = load_image(filename)
+        wrong = [addr for (addr, chunk) in image.chunks() if self.memory.read(addr) != chunk]
+        if wrong:
+            print("[board] {} of {} chunks differ from {}, first at {:07x}".format(
+                len(wrong), len(image), filename, wrong[0]))
+        else:
+            print("[board] memory matches {} ({} chunks)".format(filename, len(image)))
+
+    def log(self, kind, stats):
+        if self.stats_path is None:
+            return
+        with open(self.stats_path, "a") as f:
+            f.write(json.dumps(dict(stats, kind=kind, baud=self.baud())) + "\n")
+
+    # ---- main loop ----
+
+    def serve(self):
+        print("[board] listening on {}".format(self.name))
+        while True:
+            now = time.monotonic()
+            if self.pending is not None and now >= self.pending:
+                self.pending = None
+                self.period = self.default_period
+                print("[board] switch not confirmed, back to {:.0f} baud".format(self.baud()))
+            if self.upload is not None and self.upload.chunks and now - self.last_rx >= self.release_s:
+                self.release()
+
+            readable = [self.master] if now >= self.rx_free else []
+            timeout = POLL_S if readable else min(POLL_S, self.rx_free - now)
+            (ready, _, _) = select.select(readable, [], [], max(timeout, 0))
+            now = time.monotonic()
+            if ready:
+                # no more than the line carried since it was last free
+                budget = max(1, int(self.baud() / 10 * POLL_S))
+                try:
+                    data = os.read(self.master, budget)
+                except BlockingIOError:
+                    data = b""
+                start = max(self.rx_free, now)
+                self.rx_free = start + len(data) * 10 / self.baud()
+                self.receive(data, start)
+
+            if self.output is not None:
+                self.transmit(now)
+                idle = not self.tx and (self.worker is None or not self.worker.is_alive())
+                if idle and now >= self.tx_free:
+                    self.finish_output()
+                    self.worker = None
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="virtual board on a pty: parse_asm loader, UART pacing, canned output")
+    parser.add_argument("--link", help="symlink the pty here (e.g. /tmp/ttyARTY) for processor_port --port")
+    parser.add_argument("--reply", help="bytes to send back once the processor is released")
+    parser.add_argument("--run", action="store_true", help="run the uploaded program on rvsim and send its UART output")
+    parser.add_argument("--release", type=float, default=RELEASE_S,
+                        help="seconds of upload silence before the processor is released")
+    parser.add_argument("--check", help="after each upload, compare memory with this .hex/.vmh")
+    parser.add_argument("--stats", help="append one JSON line per upload/output here")
+    args = parser.parse_args()
+
+    board = VirtualBoard(reply=args.reply, run=args.run, release_s=args.release,
+                         check=args.check, stats_path=args.stats)
+    if args.link:
+        if os.path.islink(args.link):
+            os.remove(args.link)
+        os.symlink(board.name, args.link)
+    try:
+        board.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+        board.close()
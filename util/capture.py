@@ -0,0 +1,290 @@
+""" capture: threaded receive pipeline for processor UART output
+
+A background SerialReader pulls whatever the port has buffered in large
+reads into a RingBuffer; the consuming thread drains it into a sink:
+ * TextSink prints the stream, expanding '#'-prefixed 32-bit values to hex
+ * FileSink writes raw bytes, and learns the expected size from a netpbm
+   (P4/P5/P6) header if the program sends one
+capture() stops once the expected byte count arrives, or after `idle`
+seconds without data, whichever comes first.
+Captures from several ports run in threads of their own; MultiProgress
+keeps their readouts on one line.
+"""
+
+import re
+import sys
+import threading
+import time
+
+RING_BYTES = 1 << 20
+POLL_S = 0.05       # serial read timeout, bounds how quickly the reader notices stop()
+PROGRESS_S = 0.25   # seconds between progress readout updates
+
+# a header ends in exactly one whitespace byte; raster data follows
+PBM_HEADER = re.compile(rb"^P4\s+(\d+)\s+(\d+)\s")
+PGM_PPM_HEADER = re.compile(rb"^P([56])\s+(\d+)\s+(\d+)\s+(\d+)\s")
+
+
+class RingBuffer:
+    """ fixed-size byte ring between one producer and one consumer thread """
+
+    def __init__(self, capacity=RING_BYTES):
+        self.buf = bytearray(capacity)
+        self.capacity = capacity
+        self.head = 0 # next byte to read
+        self.size = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, data):
+        """ append data, blocking while the ring is full """
+        view = memoryview(data)
+        while len(view):
+            with self.cond:
+                while self.size == self.capacity and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                count = min(len(view), self.capacity - self.size)
+                tail = (self.head + self.size) % self.capacity
+                first = min(count, self.capacity - tail)
+                self.buf[tail:tail+first] = view[:first]
+                self.buf[:count-first] = view[first:count]
+                self.size += count
+                self.cond.notify_all()
+            view = view[count:]
+
+    def get(self, timeout=None):
+        """ everything buffered so far; b'' on timeout or once closed and drained """
+        with self.cond:
+            if self.size == 0 and not self.closed:
+                self.cond.wait(timeout)
+            first = min(self.size, self.capacity - self.head)
+            data = bytes(self.buf[self.head:self.head+first]) + bytes(self.buf[:self.size-first])
+            self.head = (self.head + self.size) % self.capacity
+            self.size = 0
+            self.cond.notify_all()
+            return data
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def drained(self):
+        with self.cond:
+            return self.closed and self.size == 0
+
+
+class SerialReader(threading.Thread):
+    """ moves bytes from a serial port into a RingBuffer, in_waiting bytes at a time """
+
+    def __init__(self, ser, ring):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.ring = ring
+        self.stopping = threading.Event()
+        self.last_rx = None # time.monotonic() of the most recent data
+
+    def run(self):
+        self.ser.timeout = POLL_S
+        try:
+            while not self.stopping.is_set():
+                data = self.ser.read(max(1, self.ser.in_waiting))
+                if data:
+                    self.last_rx = time.monotonic()
+                    self.ring.put(data)
+        finally:
+            self.ring.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.ring.close()
+
+
+class TextSink:
+    """ prints the stream; '#' is followed by a little-endian 32-bit value """
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.value = None # bytes of a '#' value collected so far
+
+    def write(self, data):
+        pieces = []
+        i = 0
+        while i < len(data):
+            if self.value is not None:
+                take = data[i:i + 4 - len(self.value)]
+                self.value += take
+                i += len(take)
+                if len(self.value) == 4:
+                    pieces.append("{:08x}".format(int.from_bytes(self.value, "little")))
+                    self.value = None
+                continue
+            mark = data.find(b"#", i)
+            end = len(data) if mark < 0 else mark + 1
+            pieces.append(data[i:end].decode("utf-8", errors="replace"))
+            if mark >= 0:
+                self.value = bytearray()
+            i = end
+        self.out.write("".join(pieces))
+        self.out.flush()
+
+    def expected(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """ writes the raw stream to a file """
+
+    def __init__(self, filename):
+        self.f = open(filename, "wb")
+        self.head = bytearray() # first bytes, for header sniffing
+        self.frame_bytes = None
+        self.written = 0
+
+    def write(self, data):
+        if self.frame_bytes is None and len(self.head) < 64:
+            self.head += data[:64 - len(self.head)]
+            self.frame_bytes = netpbm_size(self.head)
+        if self.frame_bytes is not None:
+            data = data[:max(self.frame_bytes - self.written, 0)] # nothing past the frame
+        self.f.write(data)
+        self.written += len(data)
+
+    def expected(self):
+        return self.frame_bytes
+
+    def close(self):
+        self.f.close()
+
+
+def netpbm_size(head):
+    """ total file size promised by a P4/P5/P6 header at the start of `head`, or None """
+    head = bytes(head)
+    match = PBM_HEADER.match(head)
+    if match is not None:
+        (width, height) = (int(match.group(1)), int(match.group(2)))
+        return match.end() + ((width + 7) // 8) * height
+    match = PGM_PPM_HEADER.match(head)
+    if match is not None:
+        (width, height, maxval) = (int(match.group(2)), int(match.group(3)), int(match.group(4)))
+        depth = 2 if maxval > 255 else 1
+        channels = 3 if match.group(1) == b"6" else 1
+        return match.end() + width * height * depth * channels
+    return None
+
+
+class Progress:
+    """ live byte count / throughput / ETA readout on stderr """
+
+    def __init__(self, label="", out=sys.stderr):
+        self.label = label
+        self.out = out
+        self.total = 0
+        self.start = None
+        self.last_print = 0
+
+    def update(self, count, expected=None, force=False):
+        """ add `count` bytes; redraws at most every PROGRESS_S unless forced """
+        now = time.monotonic()
+        if self.start is None:
+            if count == 0:
+                return # clock starts with the first byte
+            self.start = now
+        self.total += count
+        if not force and now - self.last_print < PROGRESS_S:
+            return
+        self.last_print = now
+        elapsed = now - self.start
+        rate = self.total / elapsed if elapsed > 0 else 0
+        line = "{}{} bytes, {:.0f} B/s".format(self.label, self.total, rate)
+        if expected:
+            remaining = max(expected - self.total, 0)
+            eta = remaining / rate if rate > 0 else float("inf")
+            line += ", {:.0%} of {}, ETA {:.1f}s".format(self.total / expected, expected, eta)
+        self.show(line)
+
+    def show(self, line):
+        self.out.write("\r" + line + "   ")
+        self.out.flush()
+
+    def finish(self, expected=None):
+        self.update(0, expected, force=True)
+        self.out.write("\n")
+
+
+class MultiProgress:
+    """ one readout line for several concurrent captures, one field per board """
+
+    def __init__(self, out=sys.stderr):
+        self.out = out
+        self.lock = threading.Lock()
+        self.fields = {} # label -> latest status, in board order
+
+    def board(self, label):
+        """ a Progress for one capture thread """
+        self.fields[label] = label + " waiting"
+        return BoardProgress(self, label)
+
+    def show(self, label, line):
+        with self.lock:
+            self.fields[label] = line
+            self.out.write("\r" + " | ".join(self.fields.values()) + "   ")
+            self.out.flush()
+
+    def close(self):
+        with self.lock:
+            self.out.write("\n")
+
+
+class BoardProgress(Progress):
+    """ Progress that reports into a MultiProgress line instead of drawing its own """
+
+    def __init__(self, parent, label):
+        super().__init__(label + ": ")
+        self.parent = parent
+        self.name = label
+
+    def show(self, line):
+        self.parent.show(self.name, line)
+
+    def finish(self, expected=None):
+        self.update(0, expected, force=True)
+        if self.start is None:
+            self.parent.show(self.name, self.name + ": no output")
+
+
+def capture(ser, sink, expect=None, idle=None, progress=None):
+    """ drain `ser` into `sink` until `expect` bytes arrived or `idle` seconds pass with no data """
+    ring = RingBuffer()
+    reader = SerialReader(ser, ring)
+    reader.start()
+    total = 0
+    try:
+        while not ring.drained():
+            data = ring.get(timeout=POLL_S)
+            if expect is not None:
+                data = data[:max(expect - total, 0)]
+            if data:
+                sink.write(data)
+                total += len(data)
+            expected = expect if expect is not None else sink.expected()
+            if progress is not None:
+                progress.update(len(data), expected)
+            if expected is not None and total >= expected:
+                break
+            if idle and reader.last_rx is not None and time.monotonic() - reader.last_rx > idle:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.stop()
+        reader.join()
+        sink.close()
+        if progress is not None:
+            progress.finish(expect if expect is not None else sink.expected())
+    return total
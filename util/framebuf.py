@@ -0,0 +1,167 @@
+""" framebuf: frames as numpy arrays -- from board captures or simulated DDR, to netpbm, and diffs
+
+Sources:
+ * a netpbm stream a program sent over the UART (P4/P5/P6, as processor_port
+   and rvsim write them), header and all
+ * raw framebuffer bytes: FRAME_WIDTH x FRAME_HEIGHT 16-bit little-endian
+   pixels, as the camera writes them at CAMERA_FB_ADDR -- a capture without a
+   header, or a dump of a PagedMemory (frame_from_memory)
+
+Raw pixels are unpacked the two ways the HDMI path shows them (top_level.sv,
+chosen by sw[1]):
+ * rgb565: {r[4:0], g[5:0], b[4:0]}, each shifted up to 8 bits -> PPM
+ * gray: the low byte of each pixel on all three channels -> PGM
+
+Everything is whole-array numpy work: a full 1280x720 frame converts in
+milliseconds.
+
+    python framebuf.py input output.ppm [--packing rgb565|gray]
+    python framebuf.py --diff a b [--out diff.pgm]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from capture import PBM_HEADER, PGM_PPM_HEADER
+from memimage import CAMERA_FB_ADDR, CHUNK_BYTES, FRAME_WIDTH, FRAME_HEIGHT
+
+PACKINGS = ["rgb565", "gray"]
+
+
+def unpack_pixels(data, packing="rgb565", width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """ raw 16-bit framebuffer bytes -> (height, width, 3) uint8 for rgb565, (height, width) for gray """
+    pixels = np.frombuffer(data, dtype="<u2", count=width * height).reshape(height, width)
+    if packing == "gray":
+        return (pixels & 0xFF).astype(np.uint8)
+    if packing != "rgb565":
+        raise ValueError("unknown packing {!r}, expected one of {}".format(packing, PACKINGS))
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[..., 0] = (pixels >> 11) << 3
+    rgb[..., 1] = ((pixels >> 5) & 0x3F) << 2
+    rgb[..., 2] = (pixels & 0x1F) << 3
+    return rgb
+
+def pack_rgb565(image):
+    """ (height, width, 3) or (height, width) uint8 -> raw RGB565 little-endian bytes, as the camera writes them """
+    image = np.asarray(image, dtype=np.uint16)
+    if image.ndim == 2:
+        image = np.repeat(image[..., None], 3, axis=2)
+    pixels = ((image[..., 0] >> 3) << 11) | ((image[..., 1] >> 2) << 5) | (image[..., 2] >> 3)
+    return pixels.astype("<u2").tobytes()
+
+def parse_netpbm(data):
+    """ a P4/P5/P6 stream -> array: bool (1 = black) for P4, (h, w) uint8 for P5, (h, w, 3) for P6 """
+    match = PBM_HEADER.match(data)
+    if match is not None:
+        (width, height) = (int(match.group(1)), int(match.group(2)))
+        row_bytes = (width + 7) // 8
+        raster = np.frombuffer(data, dtype=np.uint8, count=row_bytes * height, offset=match.end())
+        bits = np.unpackbits(raster.reshape(height, row_bytes), axis=1)
+        return bits[:, :width].astype(bool)
+    match = PGM_PPM_HEADER.match(data)
+    if match is None:
+        raise ValueError("not a P4/P5/P6 stream")
+    (kind, width, height) = (match.group(1), int(match.group(2)), int(match.group(3)))
+    raster = np.frombuffer(data, dtype=np.uint8, offset=match.end())
+    if int(match.group(4)) > 255:
+        raise ValueError("16-bit netpbm isn't supported")
+    if kind == b"5":
+        return raster[:width * height].reshape(height, width)
+    return raster[:3 * width * height].reshape(height, width, 3)
+
+def load(filename, packing="rgb565", width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """ a netpbm file/capture, or raw framebuffer bytes unpacked with `packing` """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if PBM_HEADER.match(data) or PGM_PPM_HEADER.match(data):
+        return parse_netpbm(data)
+    return unpack_pixels(data, packing, width, height)
+
+def camera_bytes(filename):
+    """ a FRAME_WIDTH x FRAME_HEIGHT P5/P6 file or raw dump as the RGB565 bytes the camera would write """
+    image = load(filename)
+    if image.dtype == bool or image.shape[:2] != (FRAME_HEIGHT, FRAME_WIDTH):
+        raise ValueError("{}: not a {}x{} P5/P6 frame".format(filename, FRAME_WIDTH, FRAME_HEIGHT))
+    return pack_rgb565(image)
+
+def frame_from_memory(memory, addr=CAMERA_FB_ADDR, packing="rgb565", width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """ the frame at chunk `addr` of a memstore.PagedMemory (e.g. a MigModel's memory) """
+    chunks = (2 * width * height + CHUNK_BYTES - 1) // CHUNK_BYTES
+    return unpack_pixels(memory.dump(addr, chunks), packing, width, height)
+
+def netpbm_bytes(image):
+    """ bool -> P4, (h, w) -> P5, (h, w, 3) -> P6 """
+    image = np.asarray(image)
+    (height, width) = image.shape[:2]
+    if image.dtype == bool:
+        return b"P4\n%d %d\n" % (width, height) + np.packbits(image, axis=1).tobytes()
+    if image.ndim == 2:
+        return b"P5\n%d %d\n255\n" % (width, height) + image.astype(np.uint8).tobytes()
+    return b"P6\n%d %d\n255\n" % (width, height) + image.astype(np.uint8).tobytes()
+
+def save(filename, image):
+    with open(filename, "wb") as f:
+        f.write(netpbm_bytes(image))
+
+def as_gray(image):
+    """ any loaded frame as (h, w) uint8 luma: P4 black is 0, RGB by BT.601 weights """
+    image = np.asarray(image)
+    if image.dtype == bool:
+        return np.where(image, 0, 255).astype(np.uint8)
+    if image.ndim == 3:
+        image = image.astype(np.uint32)
+        return ((image[..., 0] * 299 + image[..., 1] * 587 + image[..., 2] * 114 + 500) // 1000).astype(np.uint8)
+    return image
+
+def diff(a, b):
+    """ (stats dict, (h, w) uint8 per-pixel absolute difference) of two same-sized frames
+
+    Frames of different kinds (P4 vs P5, gray vs RGB) are compared as luma.
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape[:2] != b.shape[:2]:
+        raise ValueError("frame sizes differ: {} vs {}".format(a.shape[:2], b.shape[:2]))
+    if a.shape != b.shape or a.dtype != b.dtype or a.dtype == bool:
+        (a, b) = (as_gray(a), as_gray(b))
+    delta = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    if delta.ndim == 3:
+        delta = delta.max(axis=2)
+    delta = delta.astype(np.uint8)
+    differing = np.count_nonzero(delta)
+    stats = {"pixels": delta.size, "differing": int(differing),
+             "max": int(delta.max()), "mean": float(delta.mean())}
+    if differing:
+        (rows, cols) = np.nonzero(delta)
+        stats["first"] = (int(cols[0]), int(rows[0]))
+        stats["bbox"] = (int(cols.min()), int(rows.min()), int(cols.max()), int(rows.max()))
+    return (stats, delta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert framebuffers/captures to netpbm, or diff two frames")
+    parser.add_argument("input", help="netpbm capture or raw framebuffer bytes")
+    parser.add_argument("output", nargs="?", help="netpbm output (conversion), or second frame (--diff)")
+    parser.add_argument("--packing", choices=PACKINGS, default="rgb565", help="how raw 16-bit pixels are read")
+    parser.add_argument("--width", type=int, default=FRAME_WIDTH)
+    parser.add_argument("--height", type=int, default=FRAME_HEIGHT)
+    parser.add_argument("--diff", action="store_true", help="compare input with output instead of converting")
+    parser.add_argument("--out", help="with --diff: write the absolute difference as a PGM")
+    args = parser.parse_args()
+    if args.output is None:
+        parser.error("need an output file (or a second frame with --diff)")
+
+    first = load(args.input, args.packing, args.width, args.height)
+    if not args.diff:
+        save(args.output, first)
+        sys.exit(0)
+
+    (stats, delta) = diff(first, load(args.output, args.packing, args.width, args.height))
+    print("{differing} of {pixels} pixels differ, max {max}, mean {mean:.3f}".format(**stats))
+    if stats["differing"]:
+        print("first at {}, bounding box {}".format(stats["first"], stats["bbox"]))
+    if args.out:
+        save(args.out, delta)
+    sys.exit(1 if stats["differing"] else 0)
@@ -0,0 +1,162 @@
+""" hexpack: link .hex files into one canonical, burst-friendly image
+
+    python hexpack.py a.hex [b.hex ...] -o out.hex [--image out.img] [--merge-gap 4] [--align 4]
+
+compile_text() takes each '@' line as the start of a fresh chunk, zero-pads a
+segment's last partial chunk and keeps every segment separate, so DDR sees a
+short write burst (and the UART an '@' frame) per segment, and two segments
+sharing a chunk overwrite each other's words with padding. Here every word is
+placed at its own address first, then:
+ * words from all inputs are merged; a word written twice with different
+   values is an overlap, reported (and an error unless --allow-overlap; the
+   later file wins)
+ * touched chunks are laid out 128-bit aligned, zero-filling only the words
+   nothing wrote, and contiguous chunks coalesce into one segment
+ * segments separated by at most --merge-gap chunks are joined with zero
+   chunks, since an '@' frame costs as much as a '[' frame and restarts the
+   burst
+ * with --align N, segments start and end on N-chunk boundaries
+The result is written as .hex text (4 words per chunk, one '@' per segment)
+and/or as a compiled image (memimage's cache format), which load_image --
+and so processor_port and the sims -- read as-is.
+"""
+
+import argparse
+import sys
+
+from memimage import MemImage, CHUNK_BYTES, FRAME_BYTES, compile_text, save_image, load_image
+
+WORD_BYTES = 4
+CHUNK_WORDS = CHUNK_BYTES // WORD_BYTES
+MERGE_GAP = 4
+
+
+class Overlap(Exception):
+    pass
+
+
+def parse_words(text):
+    """ .hex text -> [(word address, [words])], one entry per '@' line """
+    segments = []
+    words = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == "@":
+            words = []
+            segments.append((int(line[1:], 16), words))
+        else:
+            if words is None:
+                words = []
+                segments.append((0, words)) # words before any '@' land at address 0
+            words.append(int(line, 16))
+    return [(addr, words) for (addr, words) in segments if words]
+
+def place_words(sources, allow_overlap=False):
+    """ {word address: value} from [(name, text)], later sources winning; returns (words, overlaps) """
+    placed = {}
+    owner = {}
+    overlaps = []
+    for (name, text) in sources:
+        for (start, words) in parse_words(text):
+            for (i, value) in enumerate(words):
+                addr = start + i
+                if addr in placed and placed[addr] != value:
+                    overlaps.append((addr, owner[addr], name))
+                placed[addr] = value
+                owner[addr] = name
+    if overlaps and not allow_overlap:
+        (addr, first, second) = overlaps[0]
+        raise Overlap("{} conflicting words, first at word {:x} ({} and {})".format(
+            len(overlaps), addr, first, second))
+    return (placed, overlaps)
+
+def link(words, merge_gap=MERGE_GAP, align=1):
+    """ MemImage of whole chunks covering `words`, coalesced and gap-merged """
+    chunks = {}
+    for (addr, value) in words.items():
+        chunk = chunks.setdefault(addr // CHUNK_WORDS, bytearray(CHUNK_BYTES))
+        offset = (addr % CHUNK_WORDS) * WORD_BYTES
+        chunk[offset:offset+WORD_BYTES] = value.to_bytes(WORD_BYTES, "little")
+
+    # [start, end) chunk ranges, joined across small gaps and widened to `align`
+    ranges = []
+    for addr in sorted(chunks):
+        start = addr - addr % align
+        end = addr + 1
+        end += -end % align
+        if ranges and start - ranges[-1][1] <= merge_gap:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+
+    segments = []
+    for (start, end) in ranges:
+        data = bytearray((end - start) * CHUNK_BYTES)
+        for addr in range(start, end):
+            if addr in chunks:
+                data[(addr-start)*CHUNK_BYTES:(addr-start+1)*CHUNK_BYTES] = chunks[addr]
+        segments.append((start, data))
+    return MemImage(segments)
+
+def image_text(image):
+    """ .hex text for a MemImage: word-address '@' lines, 4 words per chunk """
+    lines = []
+    for (addr, data) in image.segments:
+        lines.append("@{:x}".format(addr * CHUNK_WORDS))
+        for i in range(0, len(data), WORD_BYTES):
+            lines.append("{:08x}".format(int.from_bytes(data[i:i+WORD_BYTES], "little")))
+    return "\n".join(lines) + "\n"
+
+def image_stats(image, rle=True):
+    frames = len(image.frames(rle)) // FRAME_BYTES
+    lengths = [len(data) // CHUNK_BYTES for (_, data) in image.segments]
+    return {"segments": len(image.segments), "chunks": len(image), "frames": frames,
+            "bytes": frames * FRAME_BYTES, "longest_burst": max(lengths, default=0)}
+
+def pack(sources, merge_gap=MERGE_GAP, align=1, allow_overlap=False):
+    """ link [(name, text)] into one MemImage; returns (image, stats) comparing it with
+    uploading each source as compile_text() builds it """
+    (words, overlaps) = place_words(sources, allow_overlap)
+    image = link(words, merge_gap, align)
+    before = [image_stats(compile_text(text)) for (_, text) in sources]
+    stats = {"inputs": {key: sum(s[key] for s in before) for key in ("segments", "chunks", "frames", "bytes")},
+             "output": image_stats(image), "overlaps": len(overlaps), "words": len(words)}
+    stats["inputs"]["longest_burst"] = max((s["longest_burst"] for s in before), default=0)
+    return (image, stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="merge .hex files into one coalesced, chunk-aligned image")
+    parser.add_argument("hexfiles", nargs="+")
+    parser.add_argument("-o", "--output", help="write the linked .hex text here")
+    parser.add_argument("--image", help="write the compiled image here (load_image reads it like a .hex)")
+    parser.add_argument("--merge-gap", type=int, default=MERGE_GAP,
+                        help="join segments at most this many chunks apart, zero-filling between")
+    parser.add_argument("--align", type=int, default=1, help="start and end segments on this many-chunk boundary")
+    parser.add_argument("--allow-overlap", action="store_true", help="let later files overwrite conflicting words")
+    args = parser.parse_args()
+
+    sources = []
+    for name in args.hexfiles:
+        with open(name) as f:
+            sources.append((name, f.read()))
+    try:
+        (image, stats) = pack(sources, args.merge_gap, args.align, args.allow_overlap)
+    except Overlap as e:
+        sys.exit("overlap: {} (--allow-overlap to let later files win)".format(e))
+
+    (before, after) = (stats["inputs"], stats["output"])
+    if stats["overlaps"]:
+        print("{} overlapping words, later files won".format(stats["overlaps"]))
+    print("{} words -> {} chunks in {} segments (longest burst {} chunks)".format(
+        stats["words"], after["chunks"], after["segments"], after["longest_burst"]))
+    print("upload: {} -> {} frames, {} -> {} bytes; '@' frames / write bursts {} -> {}".format(
+        before["frames"], after["frames"], before["bytes"], after["bytes"], before["segments"], after["segments"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(image_text(image))
+    if args.image:
+        save_image(args.image, image)
+        assert bytes(load_image(args.image).frames()) == bytes(image.frames())
@@ -0,0 +1,253 @@
+""" memimage: compile .hex/.vmh files into a binary image of 128-bit chunks
+
+The image holds exactly what parse_asm ends up writing to DDR:
+ * an '@' line starts a new segment at chunk address (addr[26:0] >> 2),
+   matching `command.addr` in parse_asm
+ * every 4 words form one 128-bit chunk, word 0 in bits [31:0]
+   (stored little-endian, the same byte order as the '[' UART frame)
+ * a partial chunk at the end of a segment is zero-padded
+
+Compiled images are cached on disk, keyed by the source file's mtime/size
+and the sha1 of its text, so repeated uploads and sim runs skip parsing.
+The same format records the last image sent through each serial port, so
+the uploader can send only what changed (diff_images).
+"""
+
+import hashlib
+import os
+import struct
+
+CHUNK_BYTES = 16
+FRAME_BYTES = 17 # 1 symbol byte + 16 payload bytes
+ADDR_MASK = (1 << 27) - 1
+RLE_MIN_RUN = 3   # '*' + '[' costs two frames, so only runs of 3+ chunks shrink
+RLE_MAX_RUN = 512 # a run must fit the DEPTH of parse_asm's downstream ddr_fifo
+CAMERA_FB_ADDR = 0x1000 # top_level.sv CAMERA_FB_ADDR, in chunks: where the camera writes its frames
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+
+CACHE_DIR = os.environ.get("FPGA_PROC_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "fpga-proc"))
+CACHE_MAGIC = b"FPIMG\x01"
+CACHE_HEADER = struct.Struct("<6sqq20sI") # magic, mtime_ns, size, sha1, segment count
+SEGMENT_HEADER = struct.Struct("<II")     # chunk address, chunk count
+
+
+def chunk_addr(hex_addr):
+    """ chunk address parse_asm derives from an '@' line's (word) address """
+    return (hex_addr & ADDR_MASK) >> 2
+
+def frame_addr( addr ):
+    # '@' symbol followed by the 16-byte little-endian address
+    return b"@" + addr.to_bytes(16, 'little')
+
+def frame_chunk( chunk ):
+    # '[' symbol followed by one 16-byte chunk
+    return b"[" + bytes(chunk)
+
+def frame_repeat( count ):
+    # '*' symbol followed by a 16-byte little-endian repeat count for the next '[' frame
+    return b"*" + count.to_bytes(16, 'little')
+
+def frame_baud( period ):
+    # '%' symbol followed by a 16-byte little-endian UART bit period in sys_clk cycles (0: default)
+    return b"%" + period.to_bytes(16, 'little')
+
+
+class MemImage:
+    """ list of (chunk address, bytearray of whole 16-byte chunks) segments, in file order """
+
+    def __init__(self, segments=None):
+        self.segments = segments if segments is not None else []
+
+    def __len__(self):
+        """ number of 128-bit chunks """
+        return sum(len(data) // CHUNK_BYTES for (_, data) in self.segments)
+
+    def chunks(self):
+        """ yield (chunk address, 16-byte memoryview) for every chunk """
+        for (addr, data) in self.segments:
+            view = memoryview(data)
+            for i in range(len(data) // CHUNK_BYTES):
+                yield (addr + i, view[i*CHUNK_BYTES:(i+1)*CHUNK_BYTES])
+
+    def frame_count(self):
+        return len(self.segments) + len(self)
+
+    def frames(self, rle=False):
+        """ the UART upload stream: one '@' frame per segment, one '[' frame per chunk
+
+        With rle=True, runs of identical chunks become a '*' repeat frame
+        followed by a single '[' frame.
+        """
+        if rle:
+            return self.rle_frames()
+        buf = bytearray(FRAME_BYTES * self.frame_count())
+        offset = 0
+        for (addr, data) in self.segments:
+            buf[offset:offset+FRAME_BYTES] = frame_addr(addr << 2)
+            offset += FRAME_BYTES
+            for i in range(0, len(data), CHUNK_BYTES):
+                buf[offset] = ord("[")
+                buf[offset+1:offset+FRAME_BYTES] = data[i:i+CHUNK_BYTES]
+                offset += FRAME_BYTES
+        return buf
+
+    def rle_frames(self):
+        buf = bytearray()
+        for (addr, data) in self.segments:
+            buf += frame_addr(addr << 2)
+            count = len(data) // CHUNK_BYTES
+            i = 0
+            while i < count:
+                chunk = data[i*CHUNK_BYTES:(i+1)*CHUNK_BYTES]
+                run = 1
+                while (i + run < count and run < RLE_MAX_RUN and
+                       data[(i+run)*CHUNK_BYTES:(i+run+1)*CHUNK_BYTES] == chunk):
+                    run += 1
+                if run >= RLE_MIN_RUN:
+                    buf += frame_repeat(run)
+                    buf += frame_chunk(chunk)
+                else:
+                    for _ in range(run):
+                        buf += frame_chunk(chunk)
+                i += run
+        return buf
+
+
+def compile_text(text):
+    """ parse .hex text into a MemImage """
+    segments = []
+    data = None
+    words = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == '@':
+            data = bytearray()
+            words = 0
+            segments.append((chunk_addr(int(line[1:], 16)), data))
+        else:
+            if data is None:
+                # words before any '@' land at address 0
+                data = bytearray()
+                segments.append((0, data))
+            if words % 4 == 0:
+                data.extend(bytes(CHUNK_BYTES))
+            offset = len(data) - CHUNK_BYTES + 4*(words % 4)
+            data[offset:offset+4] = int(line, 16).to_bytes(4, 'little')
+            words += 1
+    # a bare '@' line (e.g. trailing @100000000) writes nothing
+    return MemImage([(addr, data) for (addr, data) in segments if data])
+
+
+def diff_images(new, old, merge_gap=1):
+    """ the chunks of `new` that DDR loaded with `old` doesn't already hold, as coalesced segments
+
+    Unchanged runs of up to `merge_gap` chunks between two changes are resent
+    instead of opening a new segment, since an '@' frame costs as much as a '['.
+    """
+    previous = {addr: bytes(chunk) for (addr, chunk) in old.chunks()}
+    current = {addr: bytes(chunk) for (addr, chunk) in new.chunks()} # later segments win, like DDR
+    segments = []
+    for addr in sorted(a for (a, chunk) in current.items() if previous.get(a) != chunk):
+        if segments:
+            (start, data) = segments[-1]
+            end = start + len(data) // CHUNK_BYTES
+            if addr - end <= merge_gap and all(a in current for a in range(end, addr)):
+                for a in range(end, addr + 1):
+                    data += current[a]
+                continue
+        segments.append((addr, bytearray(current[addr])))
+    return MemImage(segments)
+
+
+def cache_path(filename):
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, key + ".img")
+
+def write_cache(path, image, mtime_ns, size, digest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, mtime_ns, size, digest, len(image.segments)))
+        for (addr, data) in image.segments:
+            f.write(SEGMENT_HEADER.pack(addr, len(data) // CHUNK_BYTES))
+            f.write(data)
+    os.replace(tmp, path)
+
+def read_cache(path):
+    """ returns (mtime_ns, size, sha1, MemImage), or None if missing/corrupt """
+    try:
+        with open(path, 'rb') as f:
+            blob = f.read()
+    except OSError:
+        return None
+    if len(blob) < CACHE_HEADER.size:
+        return None
+    (magic, mtime_ns, size, digest, count) = CACHE_HEADER.unpack_from(blob, 0)
+    if magic != CACHE_MAGIC:
+        return None
+    offset = CACHE_HEADER.size
+    segments = []
+    for _ in range(count):
+        if offset + SEGMENT_HEADER.size > len(blob):
+            return None
+        (addr, chunks) = SEGMENT_HEADER.unpack_from(blob, offset)
+        offset += SEGMENT_HEADER.size
+        segments.append((addr, bytearray(blob[offset:offset + chunks*CHUNK_BYTES])))
+        offset += chunks*CHUNK_BYTES
+    if offset != len(blob):
+        return None
+    return (mtime_ns, size, digest, MemImage(segments))
+
+def save_image(path, image):
+    """ a compiled image file (the cache format, unkeyed) that load_image reads back as-is """
+    write_cache(os.path.abspath(path), image, 0, 0, bytes(20))
+
+
+def sent_record_path(port):
+    """ where the uploader remembers the last image it sent through `port` """
+    return os.path.join(CACHE_DIR, "sent-" + port.strip("/").replace("/", "_") + ".img")
+
+def save_sent(port, image):
+    write_cache(sent_record_path(port), image, 0, 0, bytes(20))
+
+def load_sent(port):
+    """ last image successfully sent through `port`, or None """
+    cached = read_cache(sent_record_path(port))
+    return cached[3] if cached else None
+
+
+def load_image(filename, use_cache=True):
+    """ compiled MemImage for a .hex/.vmh file, going through the on-disk cache,
+    or for an image file save_image wrote """
+    with open(filename, 'rb') as f:
+        if f.read(len(CACHE_MAGIC)) == CACHE_MAGIC:
+            cached = read_cache(filename)
+            if cached is None:
+                raise ValueError("{}: truncated or corrupt compiled image".format(filename))
+            return cached[3]
+    if not use_cache:
+        with open(filename, 'r') as f:
+            return compile_text(f.read())
+
+    st = os.stat(filename)
+    path = cache_path(filename)
+    cached = read_cache(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[3]
+
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).digest()
+    if cached and cached[2] == digest:
+        image = cached[3] # touched but unchanged, just refresh the key
+    else:
+        image = compile_text(raw.decode('utf-8'))
+    try:
+        write_cache(path, image, st.st_mtime_ns, st.st_size, digest)
+    except OSError:
+        pass # cache is only an optimization
+    return image
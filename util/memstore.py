@@ -0,0 +1,158 @@
+""" memstore: sparse paged store for 128-bit DDR chunks
+
+Chunks live in fixed-size pages that are allocated on first write, so memory
+use follows the touched footprint instead of the simulated address range.
+Pages are bytearrays, or views into a single mmap'd file covering the whole
+address space when a backing file is given. Either way a page reads as `fill`
+until it is first written: the file is scratch space, and whatever an earlier
+run left in it is overwritten with `fill` when the page is claimed.
+
+Chunk bytes are little-endian: int.from_bytes(chunk,'little') is the 128-bit
+value seen on app_wdf_data/app_rd_data, and byte i is covered by bit i of
+app_wdf_mask -- the same layout as a memimage chunk.
+"""
+
+import mmap
+import os
+
+from memimage import MemImage
+
+CHUNK_BYTES = 16
+ADDR_BITS = 24   # 27-bit app_addr >> 3: 256MB of 128-bit chunks
+PAGE_BITS = 12   # 4096 chunks (64KB) per page
+FILL_BYTE = 0xAB # what unwritten memory reads back as
+
+
+class PagedMemory:
+    """ 128-bit-chunk-addressed memory, allocated a page at a time """
+
+    def __init__(self, page_bits=PAGE_BITS, fill=FILL_BYTE, backing=None, addr_bits=ADDR_BITS):
+        self.page_bits = page_bits
+        self.page_bytes = CHUNK_BYTES << page_bits
+        self.offset_mask = (1 << page_bits) - 1
+        self.addr_mask = (1 << addr_bits) - 1
+        self.fill = fill
+        self.fill_page = bytes([fill]) * self.page_bytes
+        self.fill_chunk = memoryview(self.fill_page)[:CHUNK_BYTES]
+        self.pages = {} # page index -> writable memoryview of page_bytes
+
+        # with a backing file, pages are slices of it, claimed (and filled) on first write
+        self.mmap = None
+        if backing is not None:
+            size = CHUNK_BYTES << addr_bits
+            fd = os.open(backing, os.O_RDWR | os.O_CREAT)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size) # sparse on any sane filesystem
+                self.mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self.mmap_view = memoryview(self.mmap)
+
+    def page(self, index, create=True):
+        """ memoryview of page `index`; None if it was never written and create is False """
+        page = self.pages.get(index)
+        if page is None:
+            if not create:
+                return None
+            if self.mmap is not None:
+                page = self.mmap_view[index*self.page_bytes:(index+1)*self.page_bytes]
+                page[:] = self.fill_page
+            else:
+                page = memoryview(bytearray(self.fill_page))
+            self.pages[index] = page
+        return page
+
+    def chunk(self, addr, create=True):
+        """ zero-copy 16-byte view of chunk `addr`, None if unwritten and create is False """
+        addr &= self.addr_mask
+        page = self.page(addr >> self.page_bits, create)
+        if page is None:
+            return None
+        offset = (addr & self.offset_mask) * CHUNK_BYTES
+        return page[offset:offset+CHUNK_BYTES]
+
+    def read(self, addr):
+        view = self.chunk(addr, create=False)
+        return self.fill_chunk if view is None else view
+
+    def write(self, addr, data, mask=0):
+        """ write 16 little-endian bytes; bytes with their app_wdf_mask bit set are kept """
+        view = self.chunk(addr)
+        if mask == 0:
+            view[:] = data
+        else:
+            for i in range(CHUNK_BYTES):
+                if not (mask >> i) & 1:
+                    view[i] = data[i]
+
+    def read_int(self, addr):
+        return int.from_bytes(self.read(addr), 'little')
+
+    def write_int(self, addr, value, mask=0):
+        self.write(addr, value.to_bytes(CHUNK_BYTES, 'little'), mask)
+
+    def load(self, addr, data):
+        """ bulk write of consecutive chunks starting at chunk `addr` """
+        data = memoryview(data)
+        done = 0
+        while done < len(data):
+            masked = addr & self.addr_mask
+            start = (masked & self.offset_mask) * CHUNK_BYTES
+            count = min(self.page_bytes - start, len(data) - done)
+            page = self.page(masked >> self.page_bits)
+            page[start:start+count] = data[done:done+count]
+            done += count
+            addr += count // CHUNK_BYTES
+
+    def dump(self, addr, count):
+        """ copy of `count` consecutive chunks starting at chunk `addr` """
+        out = bytearray(count * CHUNK_BYTES)
+        done = 0
+        while done < len(out):
+            masked = addr & self.addr_mask
+            start = (masked & self.offset_mask) * CHUNK_BYTES
+            length = min(self.page_bytes - start, len(out) - done)
+            page = self.page(masked >> self.page_bits, create=False)
+            if page is None:
+                out[done:done+length] = self.fill_page[:length]
+            else:
+                out[done:done+length] = page[start:start+length]
+            done += length
+            addr += length // CHUNK_BYTES
+        return out
+
+    def load_image(self, image):
+        """ copy every segment of a memimage.MemImage in """
+        for (addr, data) in image.segments:
+            self.load(addr, data)
+
+    def to_image(self):
+        """ every written page as a memimage.MemImage, adjacent pages merged (a snapshot of the contents) """
+        segments = []
+        end = None
+        for index in sorted(self.pages):
+            page = self.pages[index]
+            if page == self.fill_page:
+                continue
+            addr = index << self.page_bits
+            if addr == end:
+                segments[-1][1].extend(page)
+            else:
+                segments.append((addr, bytearray(page)))
+            end = addr + (1 << self.page_bits)
+        return MemImage(segments)
+
+    def footprint(self):
+        """ bytes of page storage currently allocated """
+        return len(self.pages) * self.page_bytes
+
+    def close(self):
+        if self.mmap is not None:
+            for page in self.pages.values():
+                page.release()
+            self.pages = {}
+            self.mmap_view.release()
+            self.mmap.flush()
+            self.mmap.close()
+            self.mmap = None
@@ -1,5 +1,22 @@
+import argparse
+import os
 import serial
 import sys
+import threading
+import time
+
+from capture import capture, TextSink, FileSink, Progress, MultiProgress
+from memimage import FRAME_BYTES, frame_baud, load_image, diff_images, load_sent, save_sent
+
+BAUD = 57600 # the rate the board comes out of reset at
+WRITE_BLOCK = 4096 # bytes handed to each ser.write()
+
+SYS_CLK_HZ = 100_000_000 # clock of uart_rcv/uart_transmitter
+MIN_PERIOD = 16          # uart_baud ignores faster requests
+MAX_RATE_ERROR = 0.02    # tolerable mismatch between the host rate and SYS_CLK_HZ/period
+BAUD_ACK = b"%"
+ACK_TIMEOUT_S = 0.25
+CONFIRM_WINDOW_S = 0.5   # uart_baud CONFIRM_CYCLES: unconfirmed switches revert after this
 
 def transmit_addr_print( addr ):
     print("@%x" % addr)
@@ -11,88 +28,228 @@ def transmit_chunk_print( chunk ):
         out_string += "{:08x}".format(word)
     print(out_string)
 
-def write(byteobject,ser):
-    ser.write(byteobject)
-    # for byte in byteobject:
-    #     print("%02x" % byte)
-    
-def transmit_addr( addr_full, ser ):
-    symbol = "@".encode('utf-8')
-    write(symbol,ser)
-    addr = addr_full
-    addr_bytes = addr.to_bytes(16, 'little')
-    write(addr_bytes,ser)
-    # transmit_addr_print( addr_full )
-    # print("_")
-
-def transmit_chunk( chunk, ser):
-    symbol = "[".encode('utf-8')
-    write(symbol,ser)
-    for i in range(4):
-        word = chunk[i] if (i < len(chunk)) else 0
-        word_bytes = word.to_bytes(4,'little')
-        write(word_bytes,ser)
-    # transmit_chunk_print( chunk )
-    # print("_")
-    
-def send_memfile(filename,ser):    
-    with open(filename,mode="r") as vmhfile:
-        lines = vmhfile.readlines()
-        current_index = 0
-        current_chunk = []
-        for line in lines:
-            if '@' in line:
-                if current_chunk:
-                    transmit_chunk(current_chunk,ser)
-                    current_chunk = []
-                    current_index = 0
-                addr = int(line[1:].strip(),16)
-                transmit_addr( addr , ser)
+def stream_buffer(buf,ser,baud=BAUD,block=WRITE_BLOCK,log=print):
+    """ write buffer to serial port in large blocks, report achieved rate """
+    view = memoryview(buf)
+    start = time.perf_counter()
+    for offset in range(0,len(buf),block):
+        ser.write(view[offset:offset+block])
+    ser.flush() # wait for the OS to drain its transmit buffer
+    elapsed = time.perf_counter() - start
+    line_rate = baud / 10 # 8N1: start + 8 data + stop bits per byte
+    achieved = len(buf) / elapsed if elapsed > 0 else float('inf')
+    log("sent {} bytes in {:.2f}s: {:.0f} B/s ({:.0%} of {:.0f} B/s line rate)".format(
+        len(buf), elapsed, achieved, achieved/line_rate, line_rate))
+    return achieved
+
+def await_ack(ser,timeout):
+    ser.timeout = timeout
+    return ser.read(1) == BAUD_ACK
+
+def negotiate_baud(ser,baud,log=print):
+    """ switch the board and `ser` to `baud` through '%' frames, returns the rate in use afterwards
+
+    The board acknowledges the request at the old rate, switches, and keeps the
+    new rate only if the same request is repeated (and acknowledged) at it;
+    on any failure both sides end up back at BAUD.
+    """
+    if baud == BAUD:
+        return BAUD
+    period = round(SYS_CLK_HZ / baud)
+    if period < MIN_PERIOD or abs(SYS_CLK_HZ / period - baud) / baud > MAX_RATE_ERROR:
+        log("{} baud can't be divided from the {} Hz UART clock, staying at {}".format(baud,SYS_CLK_HZ,BAUD))
+        return BAUD
+    timeout = ser.timeout
+    try:
+        ser.reset_input_buffer()
+        ser.write(frame_baud(period))
+        ser.flush()
+        if not await_ack(ser,ACK_TIMEOUT_S):
+            log("no answer to the baud switch, staying at {} "
+                  "(bitstream without '%' frames, or board not reset since an earlier switch?)".format(BAUD))
+            return BAUD
+        ser.baudrate = baud
+        ser.reset_input_buffer()
+        ser.write(frame_baud(period))
+        ser.flush()
+        if await_ack(ser,ACK_TIMEOUT_S):
+            log("switched to {} baud (bit period {} cycles)".format(baud,period))
+            return baud
+        ser.baudrate = BAUD
+        time.sleep(CONFIRM_WINDOW_S) # let the board's confirmation window run out
+        ser.reset_input_buffer()
+        log("no answer at {} baud, falling back to {}".format(baud,BAUD))
+        return BAUD
+    finally:
+        ser.timeout = timeout
+
+def send_memfile(filename,ser,baud=BAUD,port=None,full=True,rle=True,log=print):
+    """ upload a hex file; with full=False only chunks changed since the last upload to `port`,
+    with rle=True runs of identical chunks go out as '*' repeat frames """
+    image = load_image(filename)
+    upload = image
+    previous = None if (full or port is None) else load_sent(port)
+    if previous is not None:
+        upload = diff_images(image,previous)
+        log("delta upload: {} of {} chunks changed".format(len(upload),len(image)))
+        if not upload.segments:
+            log("image unchanged since last upload, nothing to send")
+    if upload.segments:
+        buf = upload.frames(rle)
+        log("{} frames, {} bytes".format(len(buf)//FRAME_BYTES,len(buf)))
+        stream_buffer(buf,ser,baud,log=log)
+    if port is not None:
+        try:
+            save_sent(port,image)
+        except OSError as e:
+            log("could not record upload for delta mode: {}".format(e))
+
+def print_tty(ser,idle=None):
+    # '#'-framed values are expanded to hex as they arrive
+    return capture(ser,TextSink(),idle=idle)
+
+def write_tty(ser,filename,expect=None,idle=None,progress=None):
+    # stops at the end of a netpbm frame, after `expect` bytes, or once idle
+    progress = Progress() if progress is None else progress
+    return capture(ser,FileSink(filename),expect=expect,idle=idle,progress=progress)
+
+
+def board_label(port):
+    return os.path.basename(port)
+
+def board_output(output,port):
+    """ `output` tagged with the port name, for one of several boards sharing it """
+    if output is None:
+        return None
+    (stem,ext) = os.path.splitext(output)
+    return "{}-{}{}".format(stem,board_label(port),ext)
+
+def text_output(hexfile,port):
+    """ where a board's printed output goes when several boards run at once """
+    return "{}-{}.txt".format(os.path.splitext(os.path.basename(hexfile))[0],board_label(port))
+
+def run_board(job,args,progress,log):
+    """ one board's whole session: open, negotiate, upload, capture; returns a result dict """
+    (port,hexfile,output) = job
+    text = output is None
+    output = text_output(hexfile,port) if text else output
+    result = {"port":port,"hexfile":hexfile,"output":output,"received":0,"error":None}
+    start = time.perf_counter()
+    try:
+        ser = serial.Serial(port,BAUD)
+        try:
+            baud = negotiate_baud(ser,args.baud,log=log)
+            send_memfile(hexfile,ser,baud,port=port,full=args.full,rle=not args.no_rle,log=log)
+            result["upload_s"] = time.perf_counter() - start
+            if text:
+                with open(output,"w") as f:
+                    result["received"] = capture(ser,TextSink(f),expect=args.expect,idle=args.idle,progress=progress)
             else:
-                current_chunk.append( int(line.strip(), 16) )
-                current_index = (current_index + 1) % 4
-                if (current_index == 0):
-                    transmit_chunk(current_chunk,ser)
-                    current_chunk = []
-        if(current_chunk):
-            transmit_chunk(current_chunk,ser)
-
-def print_tty(ser):
-    while True:
-        char = ser.read().decode('utf-8')
-        print(char,end="")
-        if (char == '#'):
-            val = int.from_bytes( ser.read(4), "little" )
-            print("{:08x}".format(val),end="")
-
-def write_tty(ser,filename):
-    total = 0
-    with open(filename,'wb') as f:
-        while True:
-            char = ser.read()
-            f.write(char)
-            total += 1
-            if (total % 1000 == 0):
-                print(total)
-        
+                result["received"] = write_tty(ser,output,args.expect,args.idle,progress)
+        finally:
+            ser.close()
+    except (serial.SerialException,OSError) as e:
+        result["error"] = str(e)
+        log("failed: {}".format(e))
+        progress.show("{}: failed".format(board_label(port)))
+    result["total_s"] = time.perf_counter() - start
+    return result
+
+def run_boards(jobs,args):
+    """ every (port, hexfile, output) job in a thread of its own; returns their results in order """
+    for hexfile in sorted({hexfile for (_,hexfile,_) in jobs}):
+        load_image(hexfile) # compile (and cache) once, before the threads read it
+    readout = MultiProgress()
+    lock = threading.Lock()
+    results = [None] * len(jobs)
+
+    def worker(n,job):
+        label = board_label(job[0])
+        def log(line):
+            with lock:
+                sys.stderr.write("\r\033[K")
+                print("[{}] {}".format(label,line))
+        results[n] = run_board(job,args,readout.board(label),log)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker,args=(n,job),daemon=True) for (n,job) in enumerate(jobs)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    readout.close()
+    wall = time.perf_counter() - start
+    for result in results:
+        if result is None:
+            continue
+        status = "FAILED ({})".format(result["error"]) if result["error"] else "{} bytes -> {}".format(result["received"],result["output"])
+        print("{}: {}, {:.1f}s".format(result["port"],status,result["total_s"]))
+    finished = [result for result in results if result is not None]
+    print("{} boards in {:.1f}s (sum of board times {:.1f}s)".format(
+        len(jobs),wall,sum(result["total_s"] for result in finished)))
+    return results
+
+def parse_job(text):
+    """ PORT,HEXFILE[,OUTPUT] """
+    fields = text.split(",")
+    if len(fields) not in (2,3):
+        raise argparse.ArgumentTypeError("expected PORT,HEXFILE[,OUTPUT], got {!r}".format(text))
+    return (fields[0],fields[1],fields[2] if len(fields) == 3 else None)
+
 
 if __name__ == "__main__":
-    filename = sys.argv[1]
-    
-    ser = serial.Serial("/dev/ttyUSB1",57600)
+    parser = argparse.ArgumentParser(description="send a hex file to the processor over UART, then capture its output")
+    parser.add_argument("hexfile",nargs="?",help="program to send (optional with --job)")
+    parser.add_argument("output",nargs="?",help="write output bytes to this file instead of printing them")
+    parser.add_argument("--port",action="append",
+                        help="serial device (default /dev/ttyUSB1); repeat to send the program to several boards at "
+                        "once, each board's output going to OUTPUT tagged with its port name")
+    parser.add_argument("--job",action="append",type=parse_job,default=[],metavar="PORT,HEXFILE[,OUTPUT]",
+                        help="one board's own program (and output file); repeatable, runs alongside --port boards")
+    parser.add_argument("--expect",type=int,help="output size in bytes (default: from a P4/P5/P6 header, if any)")
+    parser.add_argument("--idle",type=float,default=5.0,help="stop after this many seconds without output (0: wait for ^C)")
+    parser.add_argument("--full",action="store_true",
+                        help="send the whole image, not just chunks changed since the last upload on this port "
+                        "(needed after a power cycle or bitstream load, or if the last program wrote over its own image)")
+    parser.add_argument("--baud",type=int,default=BAUD,
+                        help="switch the link to this rate for the upload and output (e.g. 921600, 3000000); "
+                        "falls back to {} if the board doesn't confirm".format(BAUD))
+    parser.add_argument("--no-rle",action="store_true",
+                        help="don't run-length encode repeated chunks (bitstreams whose parse_asm predates '*' frames)")
+    args = parser.parse_args()
+    if args.hexfile is None and not args.job:
+        parser.error("need a hexfile or at least one --job")
+    if args.port and args.hexfile is None:
+        parser.error("--port boards get the positional hexfile; give one, or use --job PORT,HEXFILE")
+    if args.hexfile is not None and args.job and not args.port:
+        parser.error("the positional hexfile goes to --port boards; give --port, or put it in a --job")
+    ports = args.port if args.port else (["/dev/ttyUSB1"] if args.hexfile and not args.job else [])
+
+    if len(ports) + len(args.job) > 1:
+        jobs = [(port,args.hexfile,board_output(args.output,port)) for port in ports] + args.job
+        results = run_boards(jobs,args)
+        sys.exit(1 if any(result is None or result["error"] for result in results) else 0)
+
+    if args.job:
+        (port,args.hexfile,output) = args.job[0]
+        args.output = output if output else args.output
+    else:
+        port = ports[0]
+    ser = serial.Serial(port,BAUD)
     print("UART established")
+    baud = negotiate_baud(ser,args.baud)
     
     print("beginning file transmission")
-    send_memfile(filename,ser)
+    send_memfile(args.hexfile,ser,baud,port=port,full=args.full,rle=not args.no_rle)
     print("file transmitted")
 
-    if (len(sys.argv) > 2):
-        output_filename = sys.argv[2]
-        print("writing output bytes to {}".format(output_filename))
-        write_tty(ser,output_filename)
+    if (args.output):
+        print("writing output bytes to {}".format(args.output))
+        total = write_tty(ser,args.output,args.expect,args.idle)
     else:
         print("listening for TTY output, writing to shell")
-        print_tty(ser)
-
-
-
+        total = print_tty(ser,args.idle)
+    print("received {} bytes".format(total))
@@ -0,0 +1,460 @@
+""" rvsim: functional RV32IM simulator for the util/hex programs
+
+Runs a .hex/.vmh image the way the board does, minus timing:
+ * memory is byte-addressed from 0, the same bytes parse_asm loads into DDR
+   (processor byte address = DDR chunk address * 16); everything else reads
+   back as memstore's FILL_BYTE, as it does in the MIG model
+ * stores to 0xFFF0-0xFFFB go to handle_mmio (proc_bridge.sv) the way the core
+   sends them, word address and data shifted to its byte lane: 0xFFF8 ends the
+   program, any other word sends the low data byte out the UART; MMIO loads
+   return 0
+ * the camera framebuffer at CAMERA_FB_ADDR can be preloaded from an image
+   (raw RGB565 bytes, or a P5/P6 netpbm file converted to RGB565)
+
+Instructions are decoded once and compiled, a region of basic blocks at a
+time, into a Python function cached by start PC: hot loops run without
+re-decoding, and loops inside a region without leaving it. Per-block
+execution counts give the instruction mix and hot spots without counting
+every instruction.
+
+    python rvsim.py hexfile [output] [--image frame.ppm] [--max-instructions N] [--stats]
+prints UART output like processor_port does, or writes it to `output`
+(e.g. a golden file for proc_context_tb's UART_GOLDEN).
+"""
+
+import argparse
+from collections import Counter
+import sys
+import time
+
+from memimage import load_image, CHUNK_BYTES, CAMERA_FB_ADDR, FRAME_WIDTH, FRAME_HEIGHT
+from memstore import FILL_BYTE
+from capture import TextSink, FileSink
+
+MEM_BYTES = 1 << 24
+MMIO_FINISH = 0xFFF8
+MMIO_LOW = 0xFFF0
+MMIO_HIGH = 0xFFFB
+
+REGION_LIMIT = 256 # instructions in one compiled region
+M32 = 0xFFFFFFFF
+
+
+class Halt(Exception):
+    """ the program stopped: `reason` is 'exit' (MMIO finish) or 'loop' (jump or taken branch to self) """
+
+    def __init__(self, reason, pc):
+        super().__init__("{} at pc {:08x}".format(reason, pc))
+        self.reason = reason
+        self.pc = pc
+
+class IllegalInstruction(Exception):
+    pass
+
+
+def signed(value):
+    return value - (1 << 32) if value & 0x80000000 else value
+
+def sext(value, bits):
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+def reg(n):
+    """ source text reading register n (x0 is always 0) """
+    return "r[%d]" % n if n else "0"
+
+def mulh(a, b):
+    return ((signed(a) * signed(b)) >> 32) & M32
+
+def mulhsu(a, b):
+    return ((signed(a) * b) >> 32) & M32
+
+def mulhu(a, b):
+    return (a * b) >> 32
+
+def div(a, b):
+    if b == 0:
+        return M32
+    (a, b) = (signed(a), signed(b))
+    q = abs(a) // abs(b)
+    return (q if (a < 0) == (b < 0) else -q) & M32 # rounds toward zero; overflow wraps
+
+def divu(a, b):
+    return a // b if b else M32
+
+def rem(a, b):
+    if b == 0:
+        return a
+    (a, b) = (signed(a), signed(b))
+    m = abs(a) % abs(b)
+    return (m if a >= 0 else -m) & M32
+
+def remu(a, b):
+    return a % b if b else a
+
+def mul(a, b):
+    return (a * b) & M32
+
+# funct3 -> helper, for compiled blocks
+MULDIV = ["mul", "mulh", "mulhsu", "mulhu", "div", "divu", "rem", "remu"]
+MULDIV_FUNCTIONS = {name: globals()[name] for name in MULDIV}
+
+def framebuffer_bytes(filename):
+    """ FRAME_WIDTH x FRAME_HEIGHT RGB565 little-endian pixels, as the camera writes them """
+    from framebuf import camera_bytes # numpy, only needed with --image
+    return camera_bytes(filename)
+
+
+class Machine:
+    """ one RV32IM hart, flat memory and the MMIO UART """
+
+    def __init__(self, image=None, uart=None, mem_bytes=MEM_BYTES, fill=FILL_BYTE):
+        self.mem = bytearray([fill]) * mem_bytes
+        self.mem16 = memoryview(self.mem).cast("H")
+        self.mem32 = memoryview(self.mem).cast("I")
+        self.regs = [0] * 32
+        self.pc = 0
+        self.uart = uart           # called with each output byte
+        self.uart_bytes = 0
+        self.regions = {}          # start pc -> (compiled function, {pc: index into segments})
+        self.segments = []         # (start pc, length, instruction mix) of every compiled basic block
+        self.counts = []           # times each of those ran
+        self.retired = [0]         # instructions retired
+        self.code_end = [0]        # stores below this may hit compiled code
+        self.limit = [float("inf")] # max_instructions, checked on backward jumps inside regions
+        self.halt = None
+        # globals of every compiled block
+        self.namespace = {"r": self.regs, "m8": self.mem, "m16": self.mem16, "m32": self.mem32,
+                          "lb": self.load_byte, "lh": self.load_half, "lw": self.load_word,
+                          "st": self.store, "code_end": self.code_end, "limit": self.limit, "Halt": Halt,
+                          "counts": self.counts, "retired": self.retired}
+        self.namespace.update(MULDIV_FUNCTIONS)
+        if image is not None:
+            self.load(image)
+
+    def load(self, image):
+        """ a MemImage, at DDR chunk address * 16 """
+        for (addr, data) in image.segments:
+            start = addr * CHUNK_BYTES
+            self.mem[start:start+len(data)] = data
+        self.invalidate()
+
+    def load_framebuffer(self, data, addr=CAMERA_FB_ADDR * CHUNK_BYTES):
+        self.mem[addr:addr+len(data)] = data
+
+    def invalidate(self):
+        self.regions.clear()
+        self.code_end[0] = 0
+
+    # ---- memory, with MMIO ----
+
+    def load_word(self, addr):
+        if MMIO_LOW <= addr <= MMIO_HIGH:
+            return 0
+        if addr & 3:
+            return int.from_bytes(self.mem[addr:addr+4], "little")
+        return self.mem32[addr >> 2]
+
+    def load_half(self, addr):
+        if MMIO_LOW <= addr <= MMIO_HIGH:
+            return 0
+        if addr & 1:
+            return int.from_bytes(self.mem[addr:addr+2], "little")
+        return self.mem16[addr >> 1]
+
+    def load_byte(self, addr):
+        if MMIO_LOW <= addr <= MMIO_HIGH:
+            return 0
+        return self.mem[addr]
+
+    def mmio(self, addr, value, pc):
+        if addr & ~3 == MMIO_FINISH:
+            raise Halt("exit", pc)
+        self.uart_bytes += 1
+        if self.uart is not None:
+            self.uart((value << 8 * (addr & 3)) & 0xFF)
+
+    def store(self, addr, value, size, pc):
+        if MMIO_LOW <= addr <= MMIO_HIGH:
+            self.mmio(addr, value, pc)
+            return
+        if addr < self.code_end[0]:
+            self.invalidate() # self-modifying code: decode again
+        if size == 4 and not addr & 3:
+            self.mem32[addr >> 2] = value
+        elif size == 2 and not addr & 1:
+            self.mem16[addr >> 1] = value & 0xFFFF
+        elif size == 1:
+            self.mem[addr] = value & 0xFF
+        else:
+            self.mem[addr:addr+size] = (value & ((1 << (8*size)) - 1)).to_bytes(size, "little")
+
+    # ---- decode ----
+
+    def decode(self, pc):
+        """ (Python source lines, exit, instruction class) for the instruction at pc.
+        exit is None for straight-line instructions, else (condition, target, fall-through)
+        source expressions for the next pc (condition None: always target) """
+        inst = self.mem32[pc >> 2]
+        opcode = inst & 0x7F
+        rd = (inst >> 7) & 0x1F
+        f3 = (inst >> 12) & 7
+        rs1 = (inst >> 15) & 0x1F
+        rs2 = (inst >> 20) & 0x1F
+        f7 = inst >> 25
+        imm_i = sext(inst >> 20, 12)
+        (a, b) = (reg(rs1), reg(rs2))
+        dest = "r[%d] = " % rd
+        illegal = IllegalInstruction("{:08x} at {:08x}".format(inst, pc))
+
+        def result(expr, kind="alu"):
+            # writes to x0 vanish; nothing here has side effects worth keeping
+            return ([dest + expr] if rd else [], None, kind)
+
+        if opcode == 0x37: # lui
+            return result(str(inst & 0xFFFFF000))
+        if opcode == 0x17: # auipc
+            return result(str((pc + (inst & 0xFFFFF000)) & M32))
+        if opcode == 0x6F: # jal
+            imm = sext(((inst >> 31) << 20) | (((inst >> 12) & 0xFF) << 12) |
+                       (((inst >> 20) & 1) << 11) | (((inst >> 21) & 0x3FF) << 1), 21)
+            target = (pc + imm) & M32
+            if target == pc:
+                return (["raise Halt('loop', %d)" % pc], (None, None, None), "jump")
+            lines = [dest + str((pc + 4) & M32)] if rd else []
+            return (lines, (None, str(target), None), "jump")
+        if opcode == 0x67: # jalr
+            lines = ["t = (%s + %d) & 0xFFFFFFFE" % (a, imm_i)]
+            if rd:
+                lines.append(dest + str((pc + 4) & M32))
+            return (lines, (None, "t", None), "jump")
+        if opcode == 0x63: # branches
+            imm = sext(((inst >> 31) << 12) | (((inst >> 7) & 1) << 11) |
+                       (((inst >> 25) & 0x3F) << 5) | (((inst >> 8) & 0xF) << 1), 13)
+            condition = {0: "{a} == {b}", 1: "{a} != {b}",
+                         4: "({a} ^ 0x80000000) < ({b} ^ 0x80000000)",
+                         5: "({a} ^ 0x80000000) >= ({b} ^ 0x80000000)",
+                         6: "{a} < {b}", 7: "{a} >= {b}"}.get(f3)
+            if condition is None:
+                raise illegal
+            condition = condition.format(a=a, b=b)
+            if (pc + imm) & M32 == pc:
+                # nothing changes between iterations: taken once is taken forever
+                return (["if %s: raise Halt('loop', %d)" % (condition, pc)], (None, str((pc + 4) & M32), None), "branch")
+            return ([], (condition, str((pc + imm) & M32), str((pc + 4) & M32)), "branch")
+        if opcode == 0x03: # loads
+            addr = "a = (%s + %d) & 0xFFFFFFFF" % (a, imm_i)
+            mmio = "%d <= a <= %d" % (MMIO_LOW, MMIO_HIGH)
+            byte = "(lb(a) if %s else m8[a])" % mmio
+            half = "(lh(a) if a & 1 or %s else m16[a >> 1])" % mmio
+            value = {0: "((%s ^ 0x80) - 0x80) & 0xFFFFFFFF" % byte,
+                     1: "((%s ^ 0x8000) - 0x8000) & 0xFFFFFFFF" % half,
+                     2: "lw(a) if a & 3 or %s else m32[a >> 2]" % mmio,
+                     4: byte,
+                     5: half}.get(f3)
+            if value is None:
+                raise illegal
+            return ([addr, dest + value] if rd else [], None, "load")
+        if opcode == 0x23: # stores
+            imm = sext(((inst >> 25) << 5) | ((inst >> 7) & 0x1F), 12)
+            fast = {0: (1, "0", "m8[a] = %s & 0xFF" % b),
+                    1: (2, "a & 1", "m16[a >> 1] = %s & 0xFFFF" % b),
+                    2: (4, "a & 3", "m32[a >> 2] = %s" % b)}.get(f3)
+            if fast is None:
+                raise illegal
+            (size, misaligned, store) = fast
+            return (["a = (%s + %d) & 0xFFFFFFFF" % (a, imm),
+                     "if a < code_end[0] or %d <= a <= %d or %s: st(a, %s, %d, %d)" % (
+                         MMIO_LOW, MMIO_HIGH, misaligned, b, size, pc),
+                     "else: " + store], None, "store")
+        if opcode == 0x13: # register-immediate
+            uimm = imm_i & M32
+            shamt = rs2
+            expr = {0: "(%s + %d) & 0xFFFFFFFF" % (a, imm_i) if rs1 else str(uimm),
+                    2: "int((%s ^ 0x80000000) < %d)" % (a, uimm ^ 0x80000000),
+                    3: "int(%s < %d)" % (a, uimm),
+                    4: "%s ^ %d" % (a, uimm),
+                    6: "%s | %d" % (a, uimm),
+                    7: "%s & %d" % (a, uimm),
+                    1: "(%s << %d) & 0xFFFFFFFF" % (a, shamt),
+                    5: ("(((%s ^ 0x80000000) - 0x80000000) >> %d) & 0xFFFFFFFF" % (a, shamt) if f7 == 0x20
+                        else "%s >> %d" % (a, shamt))}[f3]
+            return result(expr)
+        if opcode == 0x33 and f7 == 1: # M extension
+            return result("%s(%s, %s)" % (MULDIV[f3], a, b), "muldiv")
+        if opcode == 0x33:
+            expr = {(0, 0): "(%s + %s) & 0xFFFFFFFF",
+                    (0, 0x20): "(%s - %s) & 0xFFFFFFFF",
+                    (1, 0): "(%s << (%s & 31)) & 0xFFFFFFFF",
+                    (2, 0): "int((%s ^ 0x80000000) < (%s ^ 0x80000000))",
+                    (3, 0): "int(%s < %s)",
+                    (4, 0): "%s ^ %s",
+                    (5, 0): "%s >> (%s & 31)",
+                    (5, 0x20): "(((%s ^ 0x80000000) - 0x80000000) >> (%s & 31)) & 0xFFFFFFFF",
+                    (6, 0): "%s | %s",
+                    (7, 0): "%s & %s"}.get((f3, f7))
+            if expr is None:
+                raise illegal
+            return result(expr % (a, b))
+        if opcode == 0x0F: # fence
+            return ([], None, "system")
+        raise illegal
+
+    def compile_region(self, start):
+        """ compile the code reachable from `start` through branches that stay inside a
+        REGION_LIMIT-instruction window into one function: a local dispatch loop over its
+        basic blocks, so loops within the window never come back to run(). """
+        limit = start + 4*REGION_LIMIT
+        decoded = {}
+        leaders = {start}
+        work = [start]
+        while work:
+            pc = work.pop()
+            while start <= pc < limit and pc not in decoded:
+                decoded[pc] = self.decode(pc)
+                exit = decoded[pc][1]
+                if exit is not None:
+                    for next_pc in exit[1:]:
+                        if next_pc is not None and next_pc.isdigit() and start <= int(next_pc) < limit:
+                            leaders.add(int(next_pc))
+                            work.append(int(next_pc))
+                    break
+                pc += 4
+
+        def goto(target, leader, indent):
+            if not (target.isdigit() and int(target) in leaders):
+                return [indent + "return %s" % target]
+            if int(target) <= leader: # a loop: give run() a chance to stop it
+                return [indent + "if retired[0] + n >= limit[0]: return %s" % target, indent + "pc = %s" % target]
+            return [indent + "pc = %s" % target]
+
+        lines = ["n = 0", "pc = %d" % start, "try:", "    while True:"]
+        segment_of = {}
+        for (i, leader) in enumerate([start] + sorted(leaders - {start})):
+            index = len(self.segments)
+            mix = Counter()
+            lines.append("        %s pc == %d:" % ("if" if i == 0 else "elif", leader))
+            pc = leader
+            while True:
+                (code, exit, kind) = decoded[pc]
+                segment_of[pc] = index
+                mix[kind] += 1
+                lines += ["            " + line for line in code]
+                if exit is not None or pc + 4 in leaders or pc + 4 not in decoded:
+                    break
+                pc += 4
+            length = (pc - leader) // 4 + 1
+            self.segments.append((leader, length, mix))
+            self.counts.append(0)
+            lines += ["            counts[%d] += 1" % index, "            n += %d" % length]
+            if exit is None:
+                lines += goto(str(pc + 4), leader, "            ")
+            elif exit[0] is not None:
+                (condition, target, fall) = exit
+                lines += (["            if %s:" % condition] + goto(target, leader, "                ") +
+                          ["            else:"] + goto(fall, leader, "                "))
+            elif exit[1] is not None:
+                lines += goto(exit[1], leader, "            ")
+        lines += ["        else:", "            return pc", "finally:", "    retired[0] += n"]
+
+        source = "def region():\n" + "".join("    %s\n" % line for line in lines)
+        namespace = dict(self.namespace)
+        exec(compile(source, "<region {:08x}>".format(start), "exec"), namespace)
+        region = (namespace["region"], segment_of)
+        self.regions[start] = region
+        self.code_end[0] = max(self.code_end[0], max(decoded) + 4)
+        return region
+
+    # ---- run ----
+
+    def run(self, max_instructions=None):
+        """ run until the program exits or loops forever; returns the Halt (None if the limit hit first).
+        The limit is checked between regions and on every backward jump inside one, so it
+        overshoots by at most one pass through a region. """
+        regions = self.regions
+        retired = self.retired
+        self.limit[0] = float("inf") if max_instructions is None else max_instructions
+        pc = self.pc
+        try:
+            while max_instructions is None or retired[0] < max_instructions:
+                region = regions.get(pc)
+                if region is None:
+                    region = self.compile_region(pc)
+                pc = region[0]()
+        except Halt as halt:
+            # the halting instruction retires; anything after it in its block doesn't.
+            # `region` is the one that ran, even if a store to code dropped it from the cache
+            index = region[1][halt.pc]
+            retired[0] += (halt.pc - self.segments[index][0]) // 4 + 1
+            self.counts[index] += 1
+            self.halt = halt
+        finally:
+            self.pc = pc
+        return self.halt
+
+    @property
+    def instret(self):
+        return self.retired[0]
+
+    def mix(self):
+        """ executed instruction counts per class (loads, stores, branches, ...); a block that
+        halted partway counts in full """
+        total = Counter()
+        for ((_, _, mix), count) in zip(self.segments, self.counts):
+            for (kind, n) in mix.items():
+                total[kind] += n * count
+        return total
+
+    def hot_blocks(self, count=10):
+        """ [(start pc, instructions executed in blocks starting there)], busiest first """
+        weights = Counter()
+        for ((pc, length, _), n) in zip(self.segments, self.counts):
+            weights[pc] += n * length
+        return weights.most_common(count)
+
+
+def run_program(hexfile, uart=None, framebuffer=None, max_instructions=None, fill=FILL_BYTE):
+    """ load and run a program; returns the Machine """
+    machine = Machine(load_image(hexfile), uart=uart, fill=fill)
+    if framebuffer is not None:
+        machine.load_framebuffer(framebuffer)
+    machine.run(max_instructions)
+    return machine
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a hex program on a functional RV32IM model")
+    parser.add_argument("hexfile")
+    parser.add_argument("output", nargs="?", help="write UART bytes to this file instead of printing them")
+    parser.add_argument("--image", help="camera framebuffer contents: raw RGB565 dump or a {}x{} P5/P6 file".format(
+        FRAME_WIDTH, FRAME_HEIGHT))
+    parser.add_argument("--max-instructions", type=int)
+    parser.add_argument("--fill", type=lambda v: int(v, 0), default=FILL_BYTE,
+                        help="byte unwritten memory reads as (default 0x{:02X}, as in the MIG model)".format(FILL_BYTE))
+    parser.add_argument("--stats", action="store_true", help="print the instruction mix and hottest blocks")
+    args = parser.parse_args()
+
+    sink = FileSink(args.output) if args.output else TextSink()
+    pending = bytearray()
+    def uart(byte):
+        pending.append(byte)
+        if len(pending) >= 4096:
+            sink.write(bytes(pending))
+            pending.clear()
+
+    framebuffer = framebuffer_bytes(args.image) if args.image else None
+    start = time.perf_counter()
+    machine = run_program(args.hexfile, uart, framebuffer, args.max_instructions, args.fill)
+    elapsed = time.perf_counter() - start
+    sink.write(bytes(pending))
+    sink.close()
+
+    outcome = "stopped after the instruction limit" if machine.halt is None else str(machine.halt)
+    print("\n{}: {} instructions, {} UART bytes, {:.2f}s ({:.2f}M instructions/s)".format(
+        outcome, machine.instret, machine.uart_bytes, elapsed, machine.instret / elapsed / 1e6 if elapsed else 0),
+        file=sys.stderr)
+    if args.stats:
+        for (kind, count) in machine.mix().most_common():
+            print("  {:8s} {:12d} {:6.1%}".format(kind, count, count / machine.instret), file=sys.stderr)
+        for (pc, count) in machine.hot_blocks():
+            print("  block {:08x}: {} instructions".format(pc, count), file=sys.stderr)